@@ -1,55 +1,93 @@
 """Main bot module with message batching and multi-user support."""
 import asyncio
 import logging
+import os
+from collections import Counter
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 from aiogram import Bot, Dispatcher, Router, F
-from aiogram.types import Message, CallbackQuery
-from aiogram.utils.chat_action import ChatActionSender
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message, CallbackQuery, FSInputFile
 from aiogram.filters import Command, CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 
-from app.config import BOT_TOKEN, BATCH_TIMEOUT_SECONDS, SAME_LEAD_WINDOW_MINUTES, BOT_USERNAME, STATUS_ORDER, STATUSES, LEADS_PER_PAGE
+from app.config import (
+    BOT_TOKEN, TELEGRAM_API_URL, RUN_MODE,
+    BATCH_TIMEOUT_SECONDS, BATCH_MAX_MESSAGES, BATCH_MAX_WAIT_SECONDS,
+    SAME_LEAD_WINDOW_MINUTES, BOT_USERNAME, STATUSES, LEADS_PER_PAGE,
+    STATE_BACKEND, STATE_DB_PATH, STATE_FLUSH_INTERVAL_SECONDS,
+    ENRICHMENT_CONCURRENCY, ENRICHMENT_MAX_ATTEMPTS, ENRICHMENT_RETRY_SECONDS,
+    WORKERS, SEND_GLOBAL_PER_SECOND, SEND_CHAT_PER_SECOND, SEND_CHAT_BURST, SEND_MAX_RETRIES,
+    METRICS_HOST, METRICS_PORT, EXPORT_DIR, EXPORT_MAX_UPLOAD_MB
+)
 from app.services.database import (
     create_lead, get_lead, get_lead_messages, update_lead_status,
-    get_leads_by_status, search_leads, get_stats, get_recent_lead_by_contact,
+    get_leads_page, get_hot_leads, count_leads, search_leads, get_stats, get_recent_lead_by_contact,
     add_messages_to_lead, update_lead_parsed_data, get_all_messages_text,
-    update_lead_field, toggle_lead_hot
+    update_lead_field, toggle_lead_hot, warm_recent_contacts, start_storage, close_storage,
+    get_funnel_stats
 )
-from app.services.ai_parser import parse_messages
+from app.services.ai_parser import parse_messages, parse_new_messages, quick_parse
+from app.services.batcher import BatchScheduler
+from app.services.enrichment import EnrichmentQueue
+from app.services.exporter import FORMATS as EXPORT_FORMATS, export_filename, export_leads
+from app.services.send_queue import SendQueue
+from app.services.state_store import StateStore, StoredDict, FSMStorage
+from app.monitoring import HandlerTimer, start_metrics_server
+from app.webhook import run_webhook
+from app.utils import metrics
 from app.utils.keyboards import (
     get_lead_keyboard, get_add_to_lead_keyboard,
     get_back_keyboard, get_edit_keyboard, get_leads_list_keyboard
 )
 from app.utils.formatters import (
     format_lead, format_new_lead, format_originals, format_stats,
-    format_leads_by_status, format_lead_short
+    format_leads_by_status, format_search_results
 )
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Initialize bot and dispatcher
-bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
+session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+bot = Bot(token=BOT_TOKEN, session=session)
+# Every send/edit goes through the flood-limit queue; workers split the global limit
+bot.session.middleware(SendQueue(
+    global_rate=SEND_GLOBAL_PER_SECOND / max(WORKERS, 1),
+    chat_rate=SEND_CHAT_PER_SECOND,
+    chat_burst=SEND_CHAT_BURST,
+    max_retries=SEND_MAX_RETRIES
+))
+state_store = StateStore(
+    STATE_DB_PATH if STATE_BACKEND == "sqlite" else None,
+    flush_interval=STATE_FLUSH_INTERVAL_SECONDS
+)
+storage = FSMStorage(state_store)
 dp = Dispatcher(storage=storage)
 router = Router()
+router.message.middleware(HandlerTimer())
+router.callback_query.middleware(HandlerTimer())
 dp.include_router(router)
 
+# Reference point for compact updated_at values in /leads page deep links
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
 
 # FSM States for editing
 class EditStates(StatesGroup):
     waiting_for_value = State()
 
 
-# Message buffer for batching
-# Structure: {(user_id, sender_key): {"messages": [...], "task": asyncio.Task, "chat_id": int, "user_id": int}}
-message_buffer: dict = {}
-
-# Pending messages for add-to-lead flow
+# Pending messages for add-to-lead flow (persisted in state_store)
 # Structure: {(user_id, chat_id): {"messages": [...], "sender_info": {...}}}
-pending_messages: dict = {}
+pending_messages = StoredDict(state_store, "pending")
+metrics.gauge(
+    "crm_pending_forwards", "Forwarded batches waiting for the new lead / add to lead choice",
+    lambda: len(pending_messages)
+)
 
 
 def get_sender_key(message: Message) -> tuple[Optional[int], Optional[str]]:
@@ -79,17 +117,17 @@ def get_sender_info(message: Message) -> dict:
     return info
 
 
-async def process_batch(buffer_key: str, chat_id: int, user_id: int):
-    """Process batched messages after timeout."""
-    async with ChatActionSender.typing(bot=bot, chat_id=chat_id):
-        await asyncio.sleep(BATCH_TIMEOUT_SECONDS)
+async def send_typing(chat_id: int):
+    """Show the typing indicator while a batch is being collected."""
+    await bot.send_chat_action(chat_id, "typing")
 
-    if buffer_key not in message_buffer:
-        return
 
-    batch_data = message_buffer.pop(buffer_key)
-    messages = batch_data["messages"]
-    sender_info = batch_data["sender_info"]
+async def process_batch(buffer_key: str, batch: dict):
+    """Process a batch of forwarded messages once the batcher flushes it."""
+    messages = batch["messages"]
+    sender_info = batch["sender_info"]
+    chat_id = batch["chat_id"]
+    user_id = batch["user_id"]
 
     if not messages:
         return
@@ -104,6 +142,10 @@ async def process_batch(buffer_key: str, chat_id: int, user_id: int):
         SAME_LEAD_WINDOW_MINUTES
     )
 
+    if batch.get("replayed") and await batch_already_handled(recent_lead, user_id, chat_id, messages):
+        logger.info(f"Batch {buffer_key} was handled before the restart, not replaying it")
+        return
+
     if recent_lead:
         pending_key = (user_id, chat_id)
         pending_messages[pending_key] = {
@@ -122,32 +164,152 @@ async def process_batch(buffer_key: str, chat_id: int, user_id: int):
     await create_new_lead_from_messages(chat_id, user_id, messages, sender_info)
 
 
+async def batch_already_handled(recent_lead: Optional[dict], user_id: int, chat_id: int, messages: list[dict]) -> bool:
+    """A replayed batch is done if its messages are saved with the lead or waiting in the add-to-lead prompt."""
+    pending = pending_messages.get((user_id, chat_id))
+    if pending and pending["messages"] == messages:
+        return True
+    if not recent_lead:
+        return False
+    saved = Counter(m["raw_text"] for m in await get_lead_messages(recent_lead["id"]))
+    return not Counter(m["text"] for m in messages) - saved
+
+
+# Message batching: one debounce timer per (user, sender), all on one heap
+batcher = BatchScheduler(
+    on_flush=process_batch,
+    timeout=BATCH_TIMEOUT_SECONDS,
+    max_messages=BATCH_MAX_MESSAGES,
+    max_wait=BATCH_MAX_WAIT_SECONDS,
+    on_typing=send_typing,
+    store=state_store
+)
+
+
 async def create_new_lead_from_messages(chat_id: int, user_id: int, messages: list[dict], sender_info: dict):
-    """Create a new lead from collected messages."""
-    combined_text = "\n\n---\n\n".join([m["text"] for m in messages])
+    """Create a new lead from collected messages.
 
-    parsed = await parse_messages(combined_text)
-    logger.info(f"AI parsed: {parsed}")
+    The lead is saved with rule-based fields and its card is sent right away;
+    if some fields are uncertain, the AI parse runs in the background and the
+    card is edited when it finishes.
+    """
+    combined_text = "\n\n---\n\n".join([m["text"] for m in messages])
+    fields, complete = quick_parse(combined_text, sender_info["name"])
+
+    lead = {
+        "user_id": user_id,
+        "contact_telegram_id": sender_info["telegram_id"],
+        "contact_name": fields["contact"] or sender_info["name"],
+        "contact_username": sender_info["username"],
+        "brand": fields["brand"],
+        "request": fields["request"],
+        "dates": fields["dates"]
+    }
+    lead = await create_lead(**lead, raw_messages=messages)
 
-    lead_id = await create_lead(
-        user_id=user_id,
-        contact_telegram_id=sender_info["telegram_id"],
-        contact_name=parsed.get("contact") or sender_info["name"],
-        contact_username=sender_info["username"],
-        brand=parsed.get("brand"),
-        request=parsed.get("request"),
-        dates=parsed.get("dates"),
-        raw_messages=messages
+    card = await bot.send_message(
+        chat_id,
+        format_new_lead(lead, len(messages), enriching=not complete),
+        reply_markup=get_lead_keyboard(lead["id"], lead.get("is_hot", False))
     )
 
+    if not complete:
+        enrichment.submit(lead["id"], {
+            "kind": "parse",
+            "user_id": user_id,
+            "chat_id": chat_id,
+            "message_id": card.message_id,
+            "text": combined_text,
+            "contact_hint": sender_info["name"],
+            "message_count": len(messages),
+            "initial": lead_fields(lead)
+        })
+
+
+def lead_fields(lead: dict) -> dict:
+    """Parsed fields of a lead, keyed like the AI parser output."""
+    return {
+        "brand": lead.get("brand"),
+        "request": lead.get("request"),
+        "contact": lead.get("contact_name"),
+        "dates": lead.get("dates")
+    }
+
+
+async def enrich_lead(lead_id: int, job: dict):
+    """Background AI parse for a lead; updates the lead and edits its card in place.
+
+    Job kinds: "parse" (new lead), "merge" (messages added to a lead) and
+    "reparse" (full history). Fields the user edited since the job was
+    queued are left alone.
+    """
+    user_id = job["user_id"]
     lead = await get_lead(lead_id, user_id)
-    message_count = len(messages)
+    if not lead:
+        return
 
-    await bot.send_message(
-        chat_id,
-        format_new_lead(lead, message_count),
-        reply_markup=get_lead_keyboard(lead_id, lead.get("is_hot", False))
-    )
+    current = lead_fields(lead)
+    if job["kind"] == "merge":
+        parsed = await parse_new_messages(current, job["text"], user_id)
+    elif job["kind"] == "reparse":
+        parsed = await parse_messages(await get_all_messages_text(lead_id), user_id)
+    else:
+        parsed = await parse_messages(job["text"], user_id, job.get("contact_hint"))
+    logger.info(f"AI parsed lead {lead_id}: {parsed}")
+
+    initial = job.get("initial") or current
+    updated = {
+        field: current[field] if current[field] != initial[field] else (parsed.get(field) or current[field])
+        for field in current
+    }
+    if updated != current:
+        lead = await update_lead_parsed_data(
+            lead_id,
+            updated["brand"],
+            updated["request"],
+            updated["contact"],
+            updated["dates"]
+        ) or lead
+
+    await edit_enriched_card(lead, job)
+
+
+async def enrichment_failed(lead_id: int, job: dict):
+    """Last attempt failed: show the card as it is, without the parsing note."""
+    lead = await get_lead(lead_id, job["user_id"])
+    if lead:
+        await edit_enriched_card(lead, job)
+
+
+async def edit_enriched_card(lead: dict, job: dict):
+    if job["kind"] == "parse":
+        text = format_new_lead(lead, job["message_count"])
+    elif job["kind"] == "merge":
+        text = f"📎 Добавлено {job['message_count']} сообщений!\n\n{format_lead(lead)}"
+    else:
+        text = format_lead(lead)
+
+    try:
+        await bot.edit_message_text(
+            text,
+            chat_id=job["chat_id"],
+            message_id=job["message_id"],
+            reply_markup=get_lead_keyboard(lead["id"], lead.get("is_hot", False))
+        )
+    except TelegramBadRequest as e:
+        # Card deleted or already showing the same text
+        logger.info(f"Could not update card for lead {lead['id']}: {e.message}")
+
+
+# AI enrichment runs off the request path; pending jobs survive restarts via state_store
+enrichment = EnrichmentQueue(
+    enrich_lead,
+    ENRICHMENT_CONCURRENCY,
+    store=state_store,
+    max_attempts=ENRICHMENT_MAX_ATTEMPTS,
+    retry_delay=ENRICHMENT_RETRY_SECONDS,
+    on_give_up=enrichment_failed
+)
 
 
 # === COMMAND HANDLERS ===
@@ -172,17 +334,24 @@ async def cmd_start(message: Message):
                 await message.answer("❌ Лид не найден или у вас нет доступа.")
                 return
             
-            messages = await get_lead_messages(lead_id)
             await message.answer(
-                format_lead(lead, len(messages)),
+                format_lead(lead),
                 reply_markup=get_lead_keyboard(lead_id, lead.get("is_hot", False))
             )
             return
         
-        # Handle leads page deep link: leads_page_2
+        # Handle leads page deep link: leads_page_2 or leads_page_2_a<rank>_<micros>_<id>
         if param.startswith("leads_page_"):
-            page = int(param.replace("leads_page_", ""))
-            await show_leads_page(message, user_id, page)
+            parts = param.replace("leads_page_", "").split("_")
+            page = int(parts[0])
+            after = before = None
+            if len(parts) == 4:
+                cursor = decode_page_cursor(parts[1][1:], parts[2], parts[3])
+                if parts[1].startswith("a"):
+                    after = cursor
+                else:
+                    before = cursor
+            await show_leads_page(message, user_id, page, after=after, before=before)
             return
     
     # Default start message
@@ -192,98 +361,123 @@ async def cmd_start(message: Message):
         "Команды:\n"
         "/leads — все лиды\n"
         "/search <запрос> — поиск\n"
-        "/stats — статистика"
+        "/stats — статистика\n"
+        "/export [csv|xlsx] — выгрузка лидов и сообщений"
     )
 
 
-def format_leads_as_links(leads: list[dict], page: int = 1) -> tuple[str, int]:
-    """Format leads as clickable deep links.
-    Hot leads shown at the top, then grouped by status.
-    Returns (text, total_pages)."""
-    
-    # Separate hot and regular leads
-    hot_leads = [l for l in leads if l.get("is_hot")]
-    # regular_leads are now ALL leads for the status grouping, as requested to show duplicates
-    
-    # Group ALL leads by status
-    by_status = {}
-    for lead in leads:
-        status = lead.get("status", "new")
-        if status not in by_status:
-            by_status[status] = []
-        by_status[status].append(lead)
-    
+def encode_page_cursor(lead: dict) -> str:
+    """Encode a lead's (status_rank, updated_at, id) keyset position for a deep link."""
+    updated_at = datetime.fromisoformat(lead["updated_at"])
+    if updated_at.tzinfo is None:
+        updated_at = updated_at.replace(tzinfo=timezone.utc)
+    micros = (updated_at - EPOCH) // timedelta(microseconds=1)
+    return f"{lead['status_rank']}_{micros}_{lead['id']}"
+
+
+def decode_page_cursor(rank: str, micros: str, lead_id: str) -> tuple[int, str, int]:
+    """Decode a deep link keyset position back into a database cursor."""
+    updated_at = EPOCH + timedelta(microseconds=int(micros))
+    return int(rank), updated_at.isoformat(), int(lead_id)
+
+
+def format_lead_link(lead: dict, with_status: bool = False) -> str:
+    """Format one lead as a deep link line."""
+    brand = lead.get("brand") or "Без бренда"
+    if len(brand) > 25:
+        brand = brand[:22] + "..."
+    # Format: • #2 [Перекрёсток](url)
+    link = f" • #{lead['id']} [{brand}](https://t.me/{BOT_USERNAME}?start=lead_{lead['id']})"
+    if with_status:
+        link += f" {STATUSES.get(lead.get('status', 'new'), '❓')}"
+    return link
+
+
+def format_leads_as_links(
+    leads: list[dict],
+    page: int = 1,
+    total_pages: int = 1,
+    hot_leads: Optional[list[dict]] = None
+) -> str:
+    """Format one page of leads as clickable deep links.
+    Hot leads shown at the top of the first page, then leads grouped by status."""
     lines = ["📋 *Все лиды:*\n"]
-    all_leads_ordered = []
-    
-    # Show hot leads first
+
     if hot_leads:
         lines.append("\n*🔥 ВАЖНЫЕ*")
         for lead in hot_leads:
-            all_leads_ordered.append(lead)
-            status_emoji = STATUSES.get(lead.get("status", "new"), "❓")
-            brand = lead.get("brand") or "Без бренда"
-            if len(brand) > 25:
-                brand = brand[:22] + "..."
-            # Format:  • #1 [magssory](url) ⏳
-            link = f" • #{lead['id']} [{brand}](https://t.me/{BOT_USERNAME}?start=lead_{lead['id']}) {status_emoji}"
-            lines.append(link)
-    
-    # Then show rest by status
-    for status in STATUS_ORDER:
-        if status in by_status:
+            lines.append(format_lead_link(lead, with_status=True))
+
+    # Page rows arrive sorted by status, so a header starts each status run
+    current_status = None
+    for lead in leads:
+        status = lead.get("status", "new")
+        if status != current_status:
+            current_status = status
             status_emoji = STATUSES.get(status, "❓")
             lines.append(f"\n*{status_emoji} {status.upper()}*")
-            
-            for lead in by_status[status]:
-                all_leads_ordered.append(lead)
-                brand = lead.get("brand") or "Без бренда"
-                if len(brand) > 25:
-                    brand = brand[:22] + "..."
-                # Format: • #2 [Перекрёсток](url)
-                link = f" • #{lead['id']} [{brand}](https://t.me/{BOT_USERNAME}?start=lead_{lead['id']})"
-                lines.append(link)
-    
-    total_leads = len(all_leads_ordered)
-    total_pages = (total_leads + LEADS_PER_PAGE - 1) // LEADS_PER_PAGE
-    if total_pages == 0:
-        total_pages = 1
-    
-    # Add pagination info
+        lines.append(format_lead_link(lead))
+
     if total_pages > 1:
         lines.append(f"\n📄 Страница {page}/{total_pages}")
-    
-    return "\n".join(lines), total_pages
-
 
-async def show_leads_page(message: Message, user_id: int, page: int = 1):
-    """Show leads list with pagination."""
-    leads = await get_leads_by_status(user_id)
-    
-    if not leads:
+    return "\n".join(lines)
+
+
+async def show_leads_page(
+    message: Message,
+    user_id: int,
+    page: int = 1,
+    after: Optional[tuple] = None,
+    before: Optional[tuple] = None
+):
+    """Show leads list with keyset pagination.
+
+    Deep links carry the cursor of the neighbouring page, so each page is one
+    LEADS_PER_PAGE-row query plus a count. Old cursorless links fall back to offset.
+    """
+    offset = (page - 1) * LEADS_PER_PAGE
+    queries = [
+        get_leads_page(user_id, LEADS_PER_PAGE, after=after, before=before, offset=offset),
+        count_leads(user_id)
+    ]
+    if page == 1:
+        queries.append(get_hot_leads(user_id, LEADS_PER_PAGE))
+
+    leads, total, *hot = await asyncio.gather(*queries)
+    hot_leads = hot[0] if hot else None
+
+    if not total:
         await message.answer("📋 Нет лидов.")
         return
-    
-    text, total_pages = format_leads_as_links(leads, page)
-    
+
+    if not leads and page > 1:
+        await show_leads_page(message, user_id, page=1)
+        return
+
+    total_pages = max(1, (total + LEADS_PER_PAGE - 1) // LEADS_PER_PAGE)
+    text = format_leads_as_links(leads, page, total_pages, hot_leads)
+
     # Build pagination keyboard if needed
     keyboard = None
-    if total_pages > 1:
+    if total_pages > 1 and leads:
         from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
         buttons = []
         if page > 1:
+            prev_param = "leads_page_1" if page == 2 else \
+                f"leads_page_{page-1}_b{encode_page_cursor(leads[0])}"
             buttons.append(InlineKeyboardButton(
                 text="⬅️ Назад",
-                url=f"https://t.me/{BOT_USERNAME}?start=leads_page_{page-1}"
+                url=f"https://t.me/{BOT_USERNAME}?start={prev_param}"
             ))
         if page < total_pages:
             buttons.append(InlineKeyboardButton(
                 text="Вперёд ➡️",
-                url=f"https://t.me/{BOT_USERNAME}?start=leads_page_{page+1}"
+                url=f"https://t.me/{BOT_USERNAME}?start=leads_page_{page+1}_a{encode_page_cursor(leads[-1])}"
             ))
         if buttons:
             keyboard = InlineKeyboardMarkup(inline_keyboard=[buttons])
-    
+
     await message.answer(text, reply_markup=keyboard, parse_mode="Markdown", disable_web_page_preview=True)
 
 
@@ -311,19 +505,68 @@ async def cmd_search(message: Message):
         await message.answer(f"🔍 По запросу «{query}» ничего не найдено.")
         return
 
-    result = f"🔍 Результаты по «{query}»:\n\n"
-    for lead in leads:
-        result += format_lead_short(lead) + "\n"
-
-    await message.answer(result)
+    await message.answer(format_search_results(query, leads))
 
 
 @router.message(Command("stats"))
 async def cmd_stats(message: Message):
     """Handle /stats command."""
     user_id = message.from_user.id
-    stats = await get_stats(user_id)
-    await message.answer(format_stats(stats))
+    stats, funnel = await asyncio.gather(get_stats(user_id), get_funnel_stats(user_id))
+    await message.answer(format_stats(stats, funnel))
+
+
+# Running /export jobs by user: one at a time per user
+export_jobs: dict[int, asyncio.Task] = {}
+
+
+@router.message(Command("export"))
+async def cmd_export(message: Message):
+    """Handle /export command: build the file in the background and send it as a document."""
+    user_id = message.from_user.id
+
+    parts = message.text.split(maxsplit=1)
+    fmt = parts[1].strip().lower() if len(parts) > 1 else "csv"
+    if fmt not in EXPORT_FORMATS:
+        await message.answer("Использование: /export [csv|xlsx]")
+        return
+
+    if user_id in export_jobs:
+        await message.answer("⏳ Выгрузка уже готовится, файл придёт сюда.")
+        return
+
+    await message.answer("⏳ Готовлю выгрузку, файл придёт сюда...")
+    export_jobs[user_id] = asyncio.create_task(run_export(message.chat.id, user_id, fmt))
+
+
+async def run_export(chat_id: int, user_id: int, fmt: str):
+    path = os.path.join(EXPORT_DIR, export_filename(user_id, fmt))
+    try:
+        leads, rows = await export_leads(user_id, path, fmt)
+        if not leads:
+            await bot.send_message(chat_id, "📭 Лидов пока нет — выгружать нечего.")
+            return
+
+        size_mb = os.path.getsize(path) / (1 << 20)
+        if size_mb > EXPORT_MAX_UPLOAD_MB:
+            await bot.send_message(
+                chat_id,
+                f"❌ Файл слишком большой для Telegram ({size_mb:.0f} МБ). "
+                f"Выгрузите его на сервере: python -m app.export --user-id {user_id} --format {fmt}"
+            )
+            return
+
+        await bot.send_document(
+            chat_id, FSInputFile(path), caption=f"📤 Лидов: {leads}, строк: {rows}"
+        )
+    except Exception as e:
+        logger.exception(f"Export failed for user {user_id}")
+        reason = str(e) if isinstance(e, RuntimeError) else "попробуйте позже"
+        await bot.send_message(chat_id, f"❌ Не удалось выгрузить лиды: {reason}")
+    finally:
+        export_jobs.pop(user_id, None)
+        if os.path.exists(path):
+            os.remove(path)
 
 
 # === FORWARDED MESSAGES HANDLER ===
@@ -346,24 +589,15 @@ async def handle_forwarded(message: Message):
         "forward_date": message.forward_date.isoformat() if message.forward_date else None
     }
 
-    if buffer_key in message_buffer:
-        message_buffer[buffer_key]["messages"].append(msg_data)
-
-        old_task = message_buffer[buffer_key].get("task")
-        if old_task and not old_task.done():
-            old_task.cancel()
-    else:
-        message_buffer[buffer_key] = {
-            "messages": [msg_data],
-            "sender_info": sender_info,
-            "chat_id": message.chat.id,
-            "user_id": user_id
-        }
-
-    task = asyncio.create_task(process_batch(buffer_key, message.chat.id, user_id))
-    message_buffer[buffer_key]["task"] = task
+    total = batcher.add(
+        buffer_key,
+        msg_data,
+        chat_id=message.chat.id,
+        user_id=user_id,
+        sender_info=sender_info
+    )
 
-    logger.info(f"Buffered message for user {user_id}, total: {len(message_buffer[buffer_key]['messages'])}")
+    logger.info(f"Buffered message for user {user_id}, total: {total}")
 
 
 # === CALLBACK HANDLERS ===
@@ -375,17 +609,13 @@ async def handle_status_change(callback: CallbackQuery):
     _, lead_id, new_status = callback.data.split(":")
     lead_id = int(lead_id)
 
-    await update_lead_status(lead_id, user_id, new_status)
-
-    lead = await get_lead(lead_id, user_id)
+    lead = await update_lead_status(lead_id, user_id, new_status)
     if not lead:
         await callback.answer("Лид не найден")
         return
 
-    messages = await get_lead_messages(lead_id)
-
     await callback.message.edit_text(
-        format_lead(lead, len(messages)),
+        format_lead(lead),
         reply_markup=get_lead_keyboard(lead_id, lead.get("is_hot", False))
     )
     await callback.answer("Статус изменён")
@@ -397,20 +627,16 @@ async def handle_toggle_hot(callback: CallbackQuery):
     user_id = callback.from_user.id
     lead_id = int(callback.data.split(":")[1])
 
-    new_value = await toggle_lead_hot(lead_id, user_id)
-
-    lead = await get_lead(lead_id, user_id)
+    lead = await toggle_lead_hot(lead_id, user_id)
     if not lead:
         await callback.answer("Лид не найден")
         return
 
-    messages = await get_lead_messages(lead_id)
-
     await callback.message.edit_text(
-        format_lead(lead, len(messages)),
-        reply_markup=get_lead_keyboard(lead_id, is_hot=new_value)
+        format_lead(lead),
+        reply_markup=get_lead_keyboard(lead_id, is_hot=lead["is_hot"])
     )
-    await callback.answer("🔥 Важный!" if new_value else "Снято")
+    await callback.answer("🔥 Важный!" if lead["is_hot"] else "Снято")
 
 
 @router.callback_query(F.data.startswith("originals:"))
@@ -450,10 +676,8 @@ async def handle_back(callback: CallbackQuery):
         await callback.answer("Лид не найден")
         return
 
-    messages = await get_lead_messages(lead_id)
-
     await callback.message.edit_text(
-        format_lead(lead, len(messages)),
+        format_lead(lead),
         reply_markup=get_lead_keyboard(lead_id, lead.get("is_hot", False))
     )
     await callback.answer()
@@ -470,10 +694,8 @@ async def handle_view_lead(callback: CallbackQuery):
         await callback.answer("Лид не найден")
         return
 
-    messages = await get_lead_messages(lead_id)
-
     await callback.message.edit_text(
-        format_lead(lead, len(messages)),
+        format_lead(lead),
         reply_markup=get_lead_keyboard(lead_id, lead.get("is_hot", False))
     )
     await callback.answer()
@@ -552,10 +774,8 @@ async def handle_cancel_edit(callback: CallbackQuery, state: FSMContext):
         await callback.answer("Лид не найден")
         return
     
-    messages = await get_lead_messages(lead_id)
-    
     await callback.message.edit_text(
-        format_lead(lead, len(messages)),
+        format_lead(lead),
         reply_markup=get_lead_keyboard(lead_id, lead.get("is_hot", False))
     )
     await callback.answer("Редактирование отменено")
@@ -576,9 +796,8 @@ async def handle_edit_value(message: Message, state: FSMContext):
         
         lead = await get_lead(lead_id, user_id)
         if lead:
-            messages = await get_lead_messages(lead_id)
             await message.answer(
-                f"❌ Редактирование отменено.\n\n{format_lead(lead, len(messages))}",
+                f"❌ Редактирование отменено.\n\n{format_lead(lead)}",
                 reply_markup=get_lead_keyboard(lead_id, lead.get("is_hot", False))
             )
         else:
@@ -597,15 +816,16 @@ async def handle_edit_value(message: Message, state: FSMContext):
     }
 
     db_field = field_map.get(field, field)
-    await update_lead_field(lead_id, user_id, db_field, new_value)
+    lead = await update_lead_field(lead_id, user_id, db_field, new_value)
 
     await state.clear()
 
-    lead = await get_lead(lead_id, user_id)
-    messages = await get_lead_messages(lead_id)
+    if not lead:
+        await message.answer("❌ Лид не найден или у вас нет доступа.")
+        return
 
     await message.answer(
-        f"✅ Обновлено!\n\n{format_lead(lead, len(messages))}",
+        f"✅ Обновлено!\n\n{format_lead(lead)}",
         reply_markup=get_lead_keyboard(lead_id, lead.get("is_hot", False))
     )
 
@@ -631,27 +851,49 @@ async def handle_add_to_lead(callback: CallbackQuery):
     pending = pending_messages.pop(pending_key)
     messages = pending["messages"]
 
-    await add_messages_to_lead(lead_id, messages)
+    lead = await add_messages_to_lead(lead_id, messages) or lead
 
-    all_text = await get_all_messages_text(lead_id)
-    parsed = await parse_messages(all_text)
-
-    await update_lead_parsed_data(
-        lead_id,
-        parsed.get("brand"),
-        parsed.get("request"),
-        parsed.get("contact"),
-        parsed.get("dates")
+    await callback.message.edit_text(
+        f"📎 Добавлено {len(messages)} сообщений!\n\n{format_lead(lead, enriching=True)}",
+        reply_markup=get_lead_keyboard(lead_id, lead.get("is_hot", False))
     )
+    await callback.answer()
+
+    # Only the new messages go to the model, merged into the stored fields
+    enrichment.submit(lead_id, {
+        "kind": "merge",
+        "user_id": user_id,
+        "chat_id": chat_id,
+        "message_id": callback.message.message_id,
+        "text": "\n\n---\n\n".join([m["text"] for m in messages]),
+        "message_count": len(messages)
+    })
+
+
+@router.callback_query(F.data.startswith("reparse:"))
+async def handle_reparse(callback: CallbackQuery):
+    """Re-parse the lead's full message history from scratch."""
+    user_id = callback.from_user.id
+    lead_id = int(callback.data.split(":")[1])
 
+    # Verify lead belongs to user
     lead = await get_lead(lead_id, user_id)
-    all_messages = await get_lead_messages(lead_id)
+    if not lead:
+        await callback.answer("Лид не найден")
+        return
 
+    await callback.answer("🔄 Перепарсиваю...")
     await callback.message.edit_text(
-        f"📎 Добавлено {len(messages)} сообщений!\n\n{format_lead(lead, len(all_messages))}",
+        format_lead(lead, enriching=True),
         reply_markup=get_lead_keyboard(lead_id, lead.get("is_hot", False))
     )
-    await callback.answer()
+
+    enrichment.submit(lead_id, {
+        "kind": "reparse",
+        "user_id": user_id,
+        "chat_id": callback.message.chat.id,
+        "message_id": callback.message.message_id
+    })
 
 
 @router.callback_query(F.data == "create_new_lead")
@@ -674,7 +916,37 @@ async def handle_create_new_lead(callback: CallbackQuery):
 
 # === MAIN ===
 
+async def restore_state():
+    """Open lead storage, re-open work interrupted by a restart and warm in-process indexes."""
+    await start_storage()
+    restored = batcher.restore()
+    if restored:
+        logger.info(f"Restored {restored} unfinished message batches")
+    restored = enrichment.restore()
+    if restored:
+        logger.info(f"Restored {restored} unfinished enrichment jobs")
+    enrichment.start()
+    try:
+        warmed = await warm_recent_contacts()
+        logger.info(f"Recent-contact index warmed with {warmed} leads")
+    except Exception:
+        logger.exception("Failed to warm recent-contact index, same-lead checks will query the database")
+
+
 async def start_bot():
     """Main entry point."""
-    logger.info("🤖 Bot starting...")
-    await dp.start_polling(bot)
+    logger.info(f"🤖 Bot starting ({RUN_MODE})...")
+    await restore_state()
+    if METRICS_PORT:
+        await start_metrics_server(METRICS_HOST, METRICS_PORT)
+
+    try:
+        if RUN_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            # A webhook left over from webhook mode would make getUpdates fail
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        # Pushes local writes still waiting for Supabase (STORAGE_BACKEND=sqlite)
+        await close_storage()
@@ -0,0 +1,302 @@
+"""Multi-worker mode: a front process routes updates to bot workers by user_id.
+
+The front receives updates (getUpdates or webhook, per RUN_MODE) without
+parsing them into aiogram objects, picks worker `user_id % WORKERS` and passes
+the raw JSON over that worker's multiprocessing queue. Each worker is a full
+bot (app.bot) with its own state database, so batching, FSM state and caches
+for a user always live in one process. Changing WORKERS moves users between
+workers; their in-flight batches and FSM state stay in the old worker's file.
+
+Workers that exit are restarted with exponential backoff.
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import secrets
+import signal
+import threading
+import time
+from queue import Empty
+from typing import Optional
+
+from aiohttp import ClientSession, ClientTimeout, web
+
+from app import config
+from app.config import (
+    BOT_TOKEN, TELEGRAM_API_URL, RUN_MODE, STATE_DB_PATH, WORKER_MAX_IN_FLIGHT,
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT
+)
+
+logger = logging.getLogger(__name__)
+
+POLL_TIMEOUT_SECONDS = 30
+SUPERVISE_INTERVAL_SECONDS = 1.0
+RESTART_BACKOFF_MAX_SECONDS = 60.0
+# A worker that stayed up this long gets its backoff reset
+STABLE_AFTER_SECONDS = 60.0
+SHUTDOWN_GRACE_SECONDS = 10.0
+
+
+def route(update: dict, workers: int) -> int:
+    """Worker index for an update: by the acting user, else the chat, else worker 0."""
+    for key, event in update.items():
+        if key == "update_id" or not isinstance(event, dict):
+            continue
+        user = event.get("from") or event.get("user")
+        if user:
+            return user["id"] % workers
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"] % workers
+    return 0
+
+
+def worker_state_path(index: int) -> str:
+    root, ext = os.path.splitext(STATE_DB_PATH)
+    return f"{root}-{index}{ext or '.db'}"
+
+
+def worker_main(index: int, queue: multiprocessing.Queue, ready):
+    """Process entry point: run one bot worker fed from `queue`; sets `ready` once started."""
+    # Must happen before app.bot is imported, which reads the path from config
+    config.STATE_DB_PATH = worker_state_path(index)
+    # Workers share LOCAL_DB_PATH; one of them replicates it to Supabase
+    config.LOCAL_SYNC = index == 0
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # The front coordinates shutdown
+    logging.basicConfig(level=logging.INFO, format=f"[worker {index}] %(levelname)s:%(name)s:%(message)s")
+    asyncio.run(_consume(index, queue, ready))
+
+
+async def _consume(index: int, queue: multiprocessing.Queue, ready):
+    from app.bot import bot, dp, state_store, restore_state
+    from app.services.database import close_storage
+    from app.monitoring import start_metrics_server
+
+    await restore_state()
+    if config.METRICS_PORT:
+        await start_metrics_server(config.METRICS_HOST, config.METRICS_PORT + 1 + index)
+    ready.set()
+
+    loop = asyncio.get_running_loop()
+    inbox: asyncio.Queue = asyncio.Queue()
+
+    parent = os.getppid()
+
+    def reader():
+        # Blocking queue reads stay off the event loop
+        while True:
+            try:
+                raw = queue.get(timeout=SUPERVISE_INTERVAL_SECONDS)
+            except Empty:
+                # The front was killed without stopping us
+                if os.getppid() != parent:
+                    raw = None
+                else:
+                    continue
+            loop.call_soon_threadsafe(inbox.put_nowait, raw)
+            if raw is None:
+                return
+
+    threading.Thread(target=reader, name="cluster-reader", daemon=True).start()
+
+    slots = asyncio.Semaphore(WORKER_MAX_IN_FLIGHT)
+    tasks: set[asyncio.Task] = set()
+
+    async def handle(update: dict):
+        try:
+            await dp.feed_raw_update(bot, update)
+        except Exception:
+            logger.exception(f"Failed to handle update {update.get('update_id')}")
+        finally:
+            slots.release()
+
+    while True:
+        raw = await inbox.get()
+        if raw is None:
+            break
+        await slots.acquire()
+        task = asyncio.create_task(handle(json.loads(raw)))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await close_storage()
+    await state_store.close()
+    await bot.session.close()
+
+
+class Cluster:
+    """Owns the worker processes and their queues."""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._ctx = multiprocessing.get_context("spawn")
+        self.queues = [self._ctx.Queue() for _ in range(workers)]
+        self.processes: list[Optional[multiprocessing.Process]] = [None] * workers
+        self._ready = [self._ctx.Event() for _ in range(workers)]
+        self._started_at = [0.0] * workers
+        self._backoff = [1.0] * workers
+        self._restart_at: list[Optional[float]] = [None] * workers
+        self.dispatched = [0] * workers
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+
+    def _spawn(self, index: int):
+        self._ready[index].clear()
+        process = self._ctx.Process(
+            target=worker_main,
+            args=(index, self.queues[index], self._ready[index]),
+            name=f"crm-worker-{index}",
+            daemon=True
+        )
+        process.start()
+        self.processes[index] = process
+        self._started_at[index] = time.monotonic()
+        self._restart_at[index] = None
+        logger.info(f"Started worker {index} (pid {process.pid})")
+
+    def dispatch(self, update: dict, raw: Optional[str] = None):
+        index = route(update, self.workers)
+        self.queues[index].put(raw if raw is not None else json.dumps(update))
+        self.dispatched[index] += 1
+
+    def ready(self) -> list[bool]:
+        """Per worker: running and done with startup (state restore, index warm-up)."""
+        return [
+            process is not None and process.is_alive() and event.is_set()
+            for process, event in zip(self.processes, self._ready)
+        ]
+
+    async def supervise(self):
+        """Restart workers that exit; queued updates wait in their queue meanwhile."""
+        while True:
+            now = time.monotonic()
+            for index, process in enumerate(self.processes):
+                if process.is_alive():
+                    if now - self._started_at[index] >= STABLE_AFTER_SECONDS:
+                        self._backoff[index] = 1.0
+                    continue
+
+                if self._restart_at[index] is None:
+                    delay = self._backoff[index]
+                    self._backoff[index] = min(delay * 2, RESTART_BACKOFF_MAX_SECONDS)
+                    self._restart_at[index] = now + delay
+                    logger.error(f"Worker {index} exited with code {process.exitcode}, restarting in {delay:.0f}s")
+                elif now >= self._restart_at[index]:
+                    self._spawn(index)
+            await asyncio.sleep(SUPERVISE_INTERVAL_SECONDS)
+
+    def stop(self):
+        """Let workers finish queued updates, then terminate stragglers."""
+        for queue in self.queues:
+            queue.put(None)
+        deadline = time.monotonic() + SHUTDOWN_GRACE_SECONDS
+        for process in self.processes:
+            if process is not None:
+                process.join(max(0.0, deadline - time.monotonic()))
+                if process.is_alive():
+                    process.terminate()
+
+
+def _api_url(method: str) -> str:
+    base = (TELEGRAM_API_URL or "https://api.telegram.org").rstrip("/")
+    return f"{base}/bot{BOT_TOKEN}/{method}"
+
+
+async def _call(session: ClientSession, method: str, **params):
+    async with session.post(_api_url(method), json=params) as response:
+        payload = await response.json()
+    if not payload.get("ok"):
+        raise RuntimeError(f"{method} failed: {payload.get('description')}")
+    return payload["result"]
+
+
+async def poll_updates(cluster: Cluster, session: ClientSession):
+    """getUpdates loop that only routes; handlers run in the workers."""
+    await _call(session, "deleteWebhook")
+    offset = None
+    while True:
+        try:
+            updates = await _call(session, "getUpdates", offset=offset, timeout=POLL_TIMEOUT_SECONDS)
+        except Exception as e:
+            logger.warning(f"getUpdates failed: {e}")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            cluster.dispatch(update)
+            offset = update["update_id"] + 1
+
+
+async def serve_webhook(cluster: Cluster, session: ClientSession):
+    """Webhook endpoint that verifies the secret, routes the raw body and answers at once."""
+    if not WEBHOOK_SECRET and not WEBHOOK_URL:
+        raise RuntimeError("Set WEBHOOK_SECRET when the webhook is registered outside the bot (no WEBHOOK_URL)")
+    secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    expected = secret.encode()
+
+    async def receive(request: web.Request) -> web.Response:
+        # Bytes: compare_digest rejects non-ASCII str, and aiohttp keeps undecodable header bytes as surrogates
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "").encode("utf-8", "surrogateescape")
+        if not secrets.compare_digest(token, expected):
+            return web.Response(body="Unauthorized", status=401)
+        raw = await request.text()
+        cluster.dispatch(json.loads(raw), raw)
+        return web.Response()
+
+    async def healthz(request: web.Request) -> web.Response:
+        ready = cluster.ready()
+        return web.json_response(
+            {"status": "ok" if all(ready) else "degraded", "mode": "cluster", "workers": ready},
+            status=200 if any(ready) else 503
+        )
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, receive)
+    app.router.add_get("/healthz", healthz)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    logger.info(f"Cluster front listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    if WEBHOOK_URL:
+        await _call(
+            session, "setWebhook",
+            url=f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+            secret_token=secret,
+            max_connections=100
+        )
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def run_front(cluster: Cluster):
+    async with ClientSession(timeout=ClientTimeout(total=POLL_TIMEOUT_SECONDS + 10)) as session:
+        receive = serve_webhook if RUN_MODE == "webhook" else poll_updates
+        await asyncio.gather(receive(cluster, session), cluster.supervise())
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def run_cluster(workers: int):
+    """Entry point for WORKERS > 1."""
+    logging.basicConfig(level=logging.INFO)
+    # systemd stops with SIGTERM: shut the workers down the same way as on Ctrl+C
+    signal.signal(signal.SIGTERM, _interrupt)
+    logger.info(f"🤖 Bot starting ({RUN_MODE}, {workers} workers)...")
+    cluster = Cluster(workers)
+    cluster.start()
+    try:
+        asyncio.run(run_front(cluster))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cluster.stop()
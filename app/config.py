@@ -2,17 +2,108 @@
 import os
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")  # None = api.telegram.org (set for a local Bot API or stub)
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")  # None = api.openai.com
 OWNER_ID = int(os.getenv("OWNER_ID", "0"))
 
 # Supabase
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
+# Lead storage: "supabase" (every query goes to Supabase), "sqlite" (local file, replicated
+# to Supabase in the background when SUPABASE_URL is set) or "memory" (no persistence, for tests)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase")
+LOCAL_DB_PATH = os.getenv("LOCAL_DB_PATH", "data/leads.db")
+SYNC_BATCH_SIZE = 500  # Outbox entries per sync_leads call
+SYNC_INTERVAL_SECONDS = 1.0  # Wait after a local write so a burst goes out as one batch
+LOCAL_SYNC = True  # This process runs the replicator (cluster: worker 0 only)
+SYNC_ID_BLOCK = 100000  # Ids reserved in Supabase per table at a time for rows created locally
+
+# Direct Postgres connection, only used by `python -m app.migrate`
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+# Database thread pool: max concurrent Supabase queries (and pooled connections)
+DB_MAX_WORKERS = int(os.getenv("DB_MAX_WORKERS", "8"))
+DB_TIMEOUT_SECONDS = float(os.getenv("DB_TIMEOUT_SECONDS", "10"))
+
 # Batching settings
 BATCH_TIMEOUT_SECONDS = 1.0  # Wait 1 second for more messages
+BATCH_MAX_MESSAGES = 50  # Flush immediately once a batch reaches this size
+BATCH_MAX_WAIT_SECONDS = 10.0  # Flush even if messages keep arriving
 SAME_LEAD_WINDOW_MINUTES = 30  # Window to add to existing lead
 
+# Durable bot state (FSM, open batches, pending add-to-lead prompts)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite")  # "sqlite" or "memory"
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "data/state.db")
+STATE_FLUSH_INTERVAL_SECONDS = 0.05  # Coalesce state writes into one transaction per interval
+
+# AI parse result cache (in-memory LRU + SQLite tier; empty path disables the SQLite tier)
+PARSE_CACHE_DB_PATH = os.getenv("PARSE_CACHE_DB_PATH", "data/parse_cache.db")
+PARSE_CACHE_MAX_ENTRIES = 1000
+PARSE_CACHE_TTL_SECONDS = 30 * 24 * 3600
+
+# LLM execution limits (shared by all AI parsing)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_PER_USER_CONCURRENCY = int(os.getenv("LLM_PER_USER_CONCURRENCY", "2"))
+LLM_RPM = float(os.getenv("LLM_RPM", "500"))  # Requests per minute budget
+LLM_TPM = float(os.getenv("LLM_TPM", "200000"))  # Tokens per minute budget
+LLM_MAX_RETRIES = 4
+LLM_TIMEOUT_SECONDS = 30.0
+LLM_BREAKER_FAILURES = 5  # Consecutive failures before the circuit opens
+LLM_BREAKER_RESET_SECONDS = 30.0
+
+# Lead cache: per-user LRU of lead rows plus message lists (TTL 0 disables it)
+LEAD_CACHE_TTL_SECONDS = float(os.getenv("LEAD_CACHE_TTL_SECONDS", "300"))
+LEAD_CACHE_MAX_USERS = int(os.getenv("LEAD_CACHE_MAX_USERS", "500"))
+LEAD_CACHE_MAX_LEADS_PER_USER = 50
+LEAD_CACHE_MAX_MESSAGE_LISTS = 200
+
+# Background AI enrichment of new leads (parallel leads; jobs for one lead run in order)
+ENRICHMENT_CONCURRENCY = int(os.getenv("ENRICHMENT_CONCURRENCY", "4"))
+ENRICHMENT_MAX_ATTEMPTS = 4  # A failed job is retried with backoff, then its card drops the parsing note
+ENRICHMENT_RETRY_SECONDS = 5.0  # First retry delay, doubled for each further attempt
+
+# Update delivery: "polling" (getUpdates) or "webhook" (embedded aiohttp server)
+RUN_MODE = os.getenv("RUN_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # Public base URL; when set, the webhook is registered on startup
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # Random per start if unset
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_MAX_IN_FLIGHT = int(os.getenv("WEBHOOK_MAX_IN_FLIGHT", "64"))  # Updates processed at once
+
+# Worker processes; above 1 a front process routes updates to workers by user_id (app/cluster.py)
+WORKERS = int(os.getenv("WORKERS", "1"))
+WORKER_MAX_IN_FLIGHT = int(os.getenv("WORKER_MAX_IN_FLIGHT", "64"))  # Updates processed at once per worker
+
+# Outbound Telegram limits (https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this)
+SEND_GLOBAL_PER_SECOND = float(os.getenv("SEND_GLOBAL_PER_SECOND", "30"))  # Per bot, shared by all workers
+SEND_CHAT_PER_SECOND = 1.0
+SEND_CHAT_BURST = 3  # Short bursts in one chat are tolerated
+SEND_MAX_RETRIES = 3  # Retries after a 429 (retry_after) before giving up
+
+# Prometheus /metrics endpoint; 0 disables it. Cluster workers use METRICS_PORT + 1 + worker index
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Telegram Desktop export importer (python -m app.importer)
+IMPORT_STATE_PATH = os.getenv("IMPORT_STATE_PATH", "data/import.db")  # Resume checkpoints
+IMPORT_BATCH_SIZE = 100  # Leads per bulk insert
+IMPORT_MAX_MESSAGES_PER_LEAD = 500  # Longer conversations are split, keeping memory bounded
+
+# Lead status history (lead_status_events) and the funnel section of /stats
+STATUS_EVENTS_FLUSH_SECONDS = 2.0  # Events are written in one insert per interval
+STATUS_EVENTS_BATCH_SIZE = 500  # ...or as soon as this many are waiting
+STATUS_EVENTS_MAX_PENDING = 20000  # Kept for retry while the database is failing; oldest dropped beyond
+FUNNEL_COHORT_WEEKS = 8  # Weekly cohorts shown in /stats
+FUNNEL_TOP_TRANSITIONS = 8
+
+# Lead export (/export, python -m app.export)
+EXPORT_DIR = os.getenv("EXPORT_DIR", "data/exports")  # Files are deleted after sending
+EXPORT_CHUNK_SIZE = 200  # Leads (with their messages) read per query
+EXPORT_MAX_UPLOAD_MB = 2000 if TELEGRAM_API_URL else 50  # Document upload limit (local Bot API server: 2000)
+
 # Bot username (without @) for deep links
 BOT_USERNAME = os.getenv("BOT_USERNAME", "savefornow_bot")
 
@@ -37,8 +128,11 @@ STATUS_NAMES = {
     "lost": "Lost",
 }
 
-# Order for displaying leads (top to bottom)
+# Order for displaying leads (top to bottom); must match leads.status_rank in the database
 STATUS_ORDER = ["contract", "signing", "negotiating", "waiting", "replied", "new", "lost"]
 
 # Pagination
 LEADS_PER_PAGE = 15
+
+# Search: max results shown by /search
+SEARCH_LIMIT = 20
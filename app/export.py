@@ -0,0 +1,57 @@
+"""Export a user's leads with their original messages to CSV or XLSX.
+
+    python -m app.export --user-id 55174158
+    python -m app.export --format xlsx -o leads.xlsx
+
+Same file as the bot's /export, without the Bot API upload size limit.
+XLSX needs openpyxl (pip install openpyxl).
+"""
+import argparse
+import asyncio
+import logging
+import sys
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app import config  # noqa: E402
+from app.config import OWNER_ID, EXPORT_CHUNK_SIZE  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+async def run(user_id: int, path: str, fmt: str, chunk_size: int) -> tuple[int, int]:
+    from app.services.database import start_storage, close_storage
+    from app.services.exporter import export_leads
+
+    await start_storage()
+    try:
+        return await export_leads(user_id, path, fmt, chunk_size)
+    finally:
+        await close_storage()
+
+
+def main():
+    from app.services.exporter import FORMATS, export_filename
+
+    parser = argparse.ArgumentParser(description="Export a user's leads and messages to CSV or XLSX")
+    parser.add_argument("--user-id", type=int, default=OWNER_ID, help="Telegram id of the bot user")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("-o", "--output", help="file to write (default leads_<user>_<time>.<format>)")
+    parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE, help="leads read per query")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if not args.user_id:
+        parser.error("--user-id is required (or set OWNER_ID)")
+
+    # A running bot replicates STORAGE_BACKEND=sqlite; this process only reads the file
+    config.LOCAL_SYNC = False
+    path = args.output or export_filename(args.user_id, args.format)
+    leads, rows = asyncio.run(run(args.user_id, path, args.format, args.chunk_size))
+    print(f"{leads} leads, {rows} rows → {path}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
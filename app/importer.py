@@ -0,0 +1,466 @@
+"""Import Telegram Desktop chat exports (result.json) as leads.
+
+    python -m app.importer result.json --user-id 55174158
+    python -m app.importer result.json --no-ai          # rule-based fields only
+    python -m app.importer result.json --restart        # ignore the saved checkpoint
+
+Works with single-chat and full-account exports (Settings → Advanced → Export
+Telegram data, format JSON). Only personal chats are read, and only the other
+person's messages, like the forwards the bot receives. A contact's messages
+form one lead until they pause for longer than SAME_LEAD_WINDOW_MINUTES, the
+same rule the bot uses to add forwards to a recent lead.
+
+The file is read incrementally, so memory stays bounded whatever its size.
+Finished conversations are recorded in IMPORT_STATE_PATH after each batch
+insert; running the same command again continues where it stopped.
+"""
+import argparse
+import asyncio
+import codecs
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Iterator, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app import config  # noqa: E402
+from app.config import (  # noqa: E402
+    OWNER_ID, SAME_LEAD_WINDOW_MINUTES, BATCH_MAX_MESSAGES, LLM_MAX_CONCURRENCY,
+    IMPORT_STATE_PATH, IMPORT_BATCH_SIZE, IMPORT_MAX_MESSAGES_PER_LEAD
+)
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1 << 20  # Bytes read from the export at a time
+PROGRESS_INTERVAL_SECONDS = 5.0
+MEDIA_FIELDS = ("photo", "file", "media_type", "sticker_emoji", "location_information", "contact_information")
+MEDIA_PLACEHOLDER = "[Медиа без текста]"
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_STRUCTURE = re.compile(r'[{}\[\]"]')
+_STRING_TAIL = re.compile(r'(?:[^"\\]|\\.)*"', re.DOTALL)
+
+
+class JsonStream:
+    """Walks one large JSON document without loading it.
+
+    Objects and arrays are entered with items()/elements(); values the caller
+    wants whole (one message, one chat's id) are decoded with value(), and
+    everything else is skipped with skip(). Only the current chunk and the
+    value being decoded are held in memory.
+    """
+
+    def __init__(self, file, chunk_size: int = CHUNK_SIZE):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.bytes_read = 0
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self) -> bool:
+        """Append the next chunk; False at the end of the file."""
+        if self._eof:
+            return False
+        data = self.file.read(self.chunk_size)
+        self.bytes_read += len(data)
+        if not data:
+            self._eof = True
+            self._buffer += self._decoder.decode(b"", final=True)
+            return False
+        if self._pos:
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+        self._buffer += self._decoder.decode(data)
+        return True
+
+    def peek(self) -> str:
+        """The next non-whitespace character ("" at the end)."""
+        while True:
+            self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at byte ~{self.bytes_read}, got {self.peek()!r}")
+        self._pos += 1
+
+    def value(self):
+        """Decode the next value whole."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number can be cut by the chunk boundary
+            if end == len(self._buffer) and not isinstance(value, (dict, list, str)) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def skip(self):
+        """Move past the next value without building it."""
+        if self.peek() not in "{[":
+            self.value()
+            return
+        depth = 0
+        while True:
+            match = _STRUCTURE.search(self._buffer, self._pos)
+            if match is None:
+                self._pos = len(self._buffer)
+                if not self._fill():
+                    raise ValueError("Unexpected end of file")
+                continue
+            char = match.group()
+            self._pos = match.end()
+            if char == '"':
+                self._skip_string()
+            elif char in "{[":
+                depth += 1
+            else:
+                depth -= 1
+                if not depth:
+                    return
+
+    def _skip_string(self):
+        while True:
+            tail = _STRING_TAIL.match(self._buffer, self._pos)
+            if tail is not None:
+                self._pos = tail.end()
+                return
+            # Unterminated in this chunk: keep the string's start and read more
+            if not self._fill():
+                raise ValueError("Unexpected end of file in a string")
+
+    def items(self) -> Iterator[str]:
+        """Iterate an object's keys; the caller consumes each value before the next key."""
+        self.expect("{")
+        if self.peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.peek() == ",":
+                self._pos += 1
+                continue
+            self.expect("}")
+            return
+
+    def elements(self) -> Iterator[None]:
+        """Iterate an array; the caller consumes each element."""
+        self.expect("[")
+        if self.peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield None
+            if self.peek() == ",":
+                self._pos += 1
+                continue
+            self.expect("]")
+            return
+
+
+def iter_messages(stream: JsonStream) -> Iterator[tuple[dict, dict]]:
+    """(chat, message) for every message in a single-chat or full-account export.
+
+    chat holds the chat's scalar fields (name, type, id) read before its messages.
+    """
+    top: dict = {}
+    for key in stream.items():
+        if key == "messages":
+            yield from _chat_messages(stream, top)
+        elif key in ("chats", "left_chats"):
+            for section_key in stream.items():
+                if section_key != "list":
+                    stream.skip()
+                    continue
+                for _ in stream.elements():
+                    chat: dict = {}
+                    for chat_key in stream.items():
+                        if chat_key == "messages":
+                            yield from _chat_messages(stream, chat)
+                        elif stream.peek() in "{[":
+                            stream.skip()
+                        else:
+                            chat[chat_key] = stream.value()
+        elif stream.peek() in "{[":
+            stream.skip()
+        else:
+            top[key] = stream.value()
+
+
+def _chat_messages(stream: JsonStream, chat: dict) -> Iterator[tuple[dict, dict]]:
+    for _ in stream.elements():
+        yield chat, stream.value()
+
+
+def message_text(message: dict) -> str:
+    """Plain text of an export message (text is a string or a list of string/entity parts)."""
+    text = message.get("text", "")
+    if isinstance(text, list):
+        text = "".join(part if isinstance(part, str) else part.get("text", "") for part in text)
+    text = text.strip()
+    if not text and any(field in message for field in MEDIA_FIELDS):
+        return MEDIA_PLACEHOLDER
+    return text
+
+
+def message_time(message: dict) -> datetime:
+    if message.get("date_unixtime"):
+        return datetime.fromtimestamp(int(message["date_unixtime"]), tz=timezone.utc)
+    # Older exports: local time without an offset
+    return datetime.fromisoformat(message["date"]).astimezone(timezone.utc)
+
+
+def iter_conversations(stream: JsonStream) -> Iterator[dict]:
+    """Leads to create: a contact's messages, split where they pause past the same-lead window."""
+    window = SAME_LEAD_WINDOW_MINUTES * 60
+    current: Optional[dict] = None
+    last_at = 0.0
+
+    for chat, message in iter_messages(stream):
+        if chat.get("type") != "personal_chat" or message.get("type") != "message":
+            continue
+        contact_id = chat.get("id")
+        # Only the other person's messages, as if they had been forwarded to the bot
+        if contact_id is None or message.get("from_id") != f"user{contact_id}":
+            continue
+        text = message_text(message)
+        if not text:
+            continue
+
+        sent_at = message_time(message)
+        timestamp = sent_at.timestamp()
+        if current is not None and (
+            current["contact_telegram_id"] != contact_id
+            or timestamp - last_at > window
+            or len(current["raw_messages"]) >= IMPORT_MAX_MESSAGES_PER_LEAD
+        ):
+            yield current
+            current = None
+
+        if current is None:
+            current = {
+                "contact_telegram_id": contact_id,
+                "contact_name": chat.get("name") or message.get("from"),
+                "created_at": sent_at.isoformat(),
+                "raw_messages": []
+            }
+        current["raw_messages"].append({"text": text, "forward_date": sent_at.isoformat()})
+        current["updated_at"] = sent_at.isoformat()
+        last_at = timestamp
+
+    if current is not None:
+        yield current
+
+
+class Checkpoint:
+    """Which conversations (numbered in file order) are already imported.
+
+    Batches finish out of order, so besides the contiguous watermark the
+    numbers finished above it are kept (at most a few batches' worth).
+    """
+
+    def __init__(self, state: dict):
+        self.watermark = state.get("watermark", 0)
+        self.done = set(state.get("done", []))
+        self.leads = state.get("leads", 0)
+
+    def __contains__(self, seq: int) -> bool:
+        return seq <= self.watermark or seq in self.done
+
+    def mark(self, seqs: list[int]):
+        self.done.update(seqs)
+        self.leads += len(seqs)
+        while self.watermark + 1 in self.done:
+            self.watermark += 1
+            self.done.discard(self.watermark)
+
+    def state(self) -> dict:
+        return {"watermark": self.watermark, "done": sorted(self.done), "leads": self.leads}
+
+
+def export_key(path: str) -> str:
+    """Identifies an export file across runs (size plus a hash of its first megabyte)."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        digest.update(file.read(CHUNK_SIZE))
+    return f"{os.path.getsize(path)}:{digest.hexdigest()}"
+
+
+class Importer:
+    """Reader thread → bounded queue → parse workers → batched inserts."""
+
+    def __init__(self, path: str, user_id: int, concurrency: int, batch_size: int, use_ai: bool, checkpoint: Checkpoint):
+        self.path = path
+        self.user_id = user_id
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.use_ai = use_ai
+        self.checkpoint = checkpoint
+        self.on_batch = None  # async callable run after each batch is stored
+
+        self.size = os.path.getsize(path)
+        self.stream: Optional[JsonStream] = None
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+        self.ready: list[tuple[int, dict]] = []
+        self.insert_lock = asyncio.Lock()
+        self.read = self.skipped = self.parsed = self.created = 0
+        self.started = time.monotonic()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        reader = threading.Thread(target=self._read, args=(loop,), name="import-reader", daemon=True)
+        reader.start()
+        progress = asyncio.create_task(self._report())
+        try:
+            await asyncio.gather(*(self._worker() for _ in range(self.concurrency)))
+            await self._insert(final=True)
+        finally:
+            progress.cancel()
+        self._log_progress()
+
+    def _read(self, loop: asyncio.AbstractEventLoop):
+        """Parse the file off the event loop; blocks while the queue is full."""
+        def put(item):
+            asyncio.run_coroutine_threadsafe(self.queue.put(item), loop).result()
+
+        try:
+            with open(self.path, "rb") as file:
+                self.stream = JsonStream(file)
+                for seq, conversation in enumerate(iter_conversations(self.stream), start=1):
+                    self.read += 1
+                    if seq in self.checkpoint:
+                        self.skipped += 1
+                        continue
+                    put((seq, conversation))
+        except Exception:
+            logger.exception(f"Failed to read {self.path}")
+        finally:
+            for _ in range(self.concurrency):
+                put(None)
+
+    async def _worker(self):
+        from app.services.ai_parser import parse_messages, quick_parse
+
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                return
+            seq, conversation = item
+            # The pitch is at the start; long threads are not sent to the model whole
+            text = "\n\n---\n\n".join(m["text"] for m in conversation["raw_messages"][:BATCH_MAX_MESSAGES])
+            if self.use_ai:
+                fields = await parse_messages(text, self.user_id, conversation["contact_name"])
+            else:
+                fields, _ = quick_parse(text, conversation["contact_name"])
+            conversation.update(
+                brand=fields.get("brand"),
+                request=fields.get("request"),
+                dates=fields.get("dates"),
+                contact_name=fields.get("contact") or conversation["contact_name"]
+            )
+            self.parsed += 1
+            self.ready.append((seq, conversation))
+            if len(self.ready) >= self.batch_size:
+                await self._insert()
+
+    async def _insert(self, final: bool = False):
+        from app.services.database import create_leads
+
+        async with self.insert_lock:
+            while self.ready and (final or len(self.ready) >= self.batch_size):
+                batch, self.ready = self.ready[:self.batch_size], self.ready[self.batch_size:]
+                await create_leads(self.user_id, [conversation for _, conversation in batch])
+                self.created += len(batch)
+                self.checkpoint.mark([seq for seq, _ in batch])
+                if self.on_batch is not None:
+                    await self.on_batch()
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL_SECONDS)
+            self._log_progress()
+
+    def _log_progress(self):
+        done = self.stream.bytes_read if self.stream else 0
+        elapsed = time.monotonic() - self.started
+        rate = self.created / elapsed if elapsed else 0.0
+        logger.info(
+            f"{done / max(self.size, 1):6.1%} of {self.size / 1e6:.0f} MB read, "
+            f"{self.read} conversations ({self.skipped} already imported), "
+            f"{self.parsed} parsed, {self.created} leads created ({rate:.1f}/s)"
+        )
+
+
+async def import_export(path: str, user_id: int, concurrency: int, batch_size: int, use_ai: bool, restart: bool) -> int:
+    """Import one export file; returns the number of leads created by this run."""
+    from app.services.database import start_storage, close_storage
+    from app.services.state_store import StateStore
+
+    state = StateStore(IMPORT_STATE_PATH)
+    key = export_key(path)
+    checkpoint = Checkpoint({} if restart else state.get("imports", key, {}))
+    if checkpoint.watermark or checkpoint.done:
+        logger.info(f"Resuming: {checkpoint.leads} leads were imported from this file before")
+
+    importer = Importer(path, user_id, concurrency, batch_size, use_ai, checkpoint)
+
+    async def save():
+        state.set("imports", key, checkpoint.state())
+        await state.flush()
+
+    importer.on_batch = save
+    await start_storage()
+    try:
+        await importer.run()
+    finally:
+        await close_storage()
+        await state.close()
+    return importer.created
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import a Telegram Desktop export (result.json) as leads")
+    parser.add_argument("path", help="result.json from Telegram Desktop")
+    parser.add_argument("--user-id", type=int, default=OWNER_ID, help="Telegram id of the bot user who owns the leads")
+    parser.add_argument("--concurrency", type=int, default=LLM_MAX_CONCURRENCY, help="conversations parsed at once")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE, help="leads per insert")
+    parser.add_argument("--no-ai", action="store_true", help="rule-based fields only, no LLM calls")
+    parser.add_argument("--restart", action="store_true", help="ignore the saved checkpoint for this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if not args.user_id:
+        parser.error("--user-id is required (or set OWNER_ID)")
+
+    # A running bot replicates STORAGE_BACKEND=sqlite; this process only writes the file
+    config.LOCAL_SYNC = False
+    created = asyncio.run(import_export(
+        args.path, args.user_id, args.concurrency, args.batch_size, not args.no_ai, args.restart
+    ))
+    logger.info(f"Imported {created} leads")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+"""Versioned SQL migrations for the bot's Postgres (Supabase) database.
+
+    python -m app.migrate            # apply pending migrations from app/migrations
+    python -m app.migrate --status   # show applied and pending migrations
+    python -m app.migrate --explain  # check that every supabase_store.py query uses an index
+
+Needs DATABASE_URL (Supabase: Settings → Database → Connection string) and
+psycopg, which the bot itself does not use: pip install "psycopg[binary]".
+Run --explain against a local Postgres with the migrations applied.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+from typing import NamedTuple
+
+from app.config import DATABASE_URL
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "migrations")
+
+# Only one migrator at a time, even from several deploy hosts
+LOCK_ID = 0x43524D  # "CRM"
+
+# Representative SQL for each query in app/services/supabase_store.py (literals stand in for parameters)
+EXPLAIN_QUERIES = [
+    ("get_lead", "select * from leads where id = 1 and user_id = 1"),
+    ("get_lead_messages", "select * from lead_messages where lead_id = 1 order by created_at"),
+    (
+        "get_leads_by_status",
+        "select * from leads where user_id = 1 and status = 'new' order by updated_at desc"
+    ),
+    (
+        "get_leads_page",
+        "select id, brand, status, is_hot, status_rank, updated_at from leads"
+        " where user_id = 1 and (status_rank > 2"
+        " or (status_rank = 2 and updated_at < now())"
+        " or (status_rank = 2 and updated_at = now() and id < 10))"
+        " order by status_rank, updated_at desc, id desc limit 15"
+    ),
+    (
+        "get_hot_leads",
+        "select id from leads where user_id = 1 and is_hot order by updated_at desc limit 15"
+    ),
+    ("count_leads", "select count(*) from leads where user_id = 1"),
+    (
+        "get_recent_lead_by_contact (telegram id)",
+        "select * from leads where user_id = 1 and contact_telegram_id = 2"
+        " and updated_at >= now() - interval '30 minutes' order by updated_at desc limit 1"
+    ),
+    (
+        "get_recent_lead_by_contact (name)",
+        "select * from leads where user_id = 1 and contact_name = 'Анна'"
+        " and updated_at >= now() - interval '30 minutes' order by updated_at desc limit 1"
+    ),
+    (
+        "search_leads (trigram)",
+        "select id from leads where user_id = 1 and 'ozon' <% search_text"
+    ),
+    (
+        "search_leads (messages)",
+        "select lead_id from lead_messages"
+        " where to_tsvector('simple', raw_text) @@ websearch_to_tsquery('simple', 'ozon')"
+    ),
+    (
+        "search_leads (ilike fallback)",
+        "select id from leads where user_id = 1"
+        " and (brand ilike '%ozon%' or contact_name ilike '%ozon%' or contact_username ilike '%ozon%')"
+        " order by updated_at desc limit 200"
+    ),
+    (
+        "warm_recent_contacts",
+        "select id, user_id, contact_telegram_id, contact_name, updated_at from leads"
+        " where updated_at >= now() - interval '30 minutes' order by id limit 1000"
+    ),
+    ("lead_stats", "select status, count(*) from leads where user_id = 1 group by status"),
+    ("get_stats (batched counts)", "select count(*) from lead_messages where lead_id in (1, 2, 3)"),
+    ("update_lead_status", "update leads set status = 'replied' where id = 1 and user_id = 1"),
+    ("toggle_lead_hot", "update leads set is_hot = not is_hot where id = 1 and user_id = 1"),
+    (
+        "lead_status_history",
+        "select lead_id, value, created_at from lead_status_events"
+        " where user_id = 1 and kind in ('created', 'status')"
+    ),
+]
+
+
+# Queries that must use a specific index: any index scan (e.g. leads_pkey in id order) is not enough
+REQUIRED_INDEXES = {
+    "warm_recent_contacts": "leads_updated_at_idx",
+}
+
+
+class Migration(NamedTuple):
+    version: str
+    name: str
+    sql: str
+    checksum: str
+
+
+def load_migrations() -> list[Migration]:
+    """Migrations from app/migrations, ordered by their NNNN_ prefix."""
+    migrations = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        if not filename.endswith(".sql"):
+            continue
+        version, _, name = filename[:-4].partition("_")
+        with open(os.path.join(MIGRATIONS_DIR, filename), encoding="utf-8") as f:
+            sql = f.read()
+        migrations.append(Migration(version, name, sql, hashlib.sha256(sql.encode()).hexdigest()))
+    return migrations
+
+
+def connect():
+    try:
+        import psycopg
+    except ImportError:
+        sys.exit('psycopg is not installed: pip install "psycopg[binary]"')
+
+    if not DATABASE_URL:
+        sys.exit("DATABASE_URL is not set")
+    return psycopg.connect(DATABASE_URL, autocommit=True)
+
+
+def applied_migrations(conn) -> dict[str, str]:
+    conn.execute(
+        "create table if not exists schema_migrations ("
+        " version text primary key,"
+        " name text not null,"
+        " checksum text not null,"
+        " applied_at timestamptz not null default now())"
+    )
+    rows = conn.execute("select version, checksum from schema_migrations").fetchall()
+    return dict(rows)
+
+
+def migrate(conn) -> int:
+    """Apply pending migrations, each in its own transaction. Returns how many ran."""
+    conn.execute("select pg_advisory_lock(%s)", (LOCK_ID,))
+    try:
+        applied = applied_migrations(conn)
+        count = 0
+        for migration in load_migrations():
+            if migration.version in applied:
+                if applied[migration.version] != migration.checksum:
+                    logger.warning(f"Migration {migration.version}_{migration.name} changed after it was applied")
+                continue
+
+            logger.info(f"Applying {migration.version}_{migration.name}")
+            with conn.transaction():
+                conn.execute(migration.sql)
+                conn.execute(
+                    "insert into schema_migrations (version, name, checksum) values (%s, %s, %s)",
+                    (migration.version, migration.name, migration.checksum)
+                )
+            count += 1
+        return count
+    finally:
+        conn.execute("select pg_advisory_unlock(%s)", (LOCK_ID,))
+
+
+def print_status(conn):
+    applied = applied_migrations(conn)
+    for migration in load_migrations():
+        if migration.version not in applied:
+            mark = "pending"
+        elif applied[migration.version] != migration.checksum:
+            mark = "changed"
+        else:
+            mark = "applied"
+        print(f"{mark:8} {migration.version}_{migration.name}")
+
+
+def explain_check(conn) -> bool:
+    """EXPLAIN each query with sequential scans disabled; any Seq Scan left means no usable index.
+
+    Queries in REQUIRED_INDEXES also fail when their plan does not use that index.
+    """
+    ok = True
+    for name, sql in EXPLAIN_QUERIES:
+        with conn.transaction():
+            conn.execute("set local enable_seqscan = off")
+            plan = conn.execute(f"explain (format json) {sql}").fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        seq_scans = sorted(set(_seq_scans(plan[0]["Plan"])))
+        indexes = sorted(set(_indexes(plan[0]["Plan"])))
+        required = REQUIRED_INDEXES.get(name)
+        if seq_scans:
+            ok = False
+            print(f"FAIL {name}: sequential scan on {', '.join(seq_scans)}")
+        elif required and required not in indexes:
+            ok = False
+            print(f"FAIL {name}: does not use {required} ({', '.join(indexes) or 'no index'})")
+        else:
+            print(f"ok   {name}: {', '.join(indexes) or 'no table access'}")
+    return ok
+
+
+def _seq_scans(node: dict):
+    if node.get("Node Type") == "Seq Scan":
+        yield node.get("Relation Name", "?")
+    for child in node.get("Plans", []):
+        yield from _seq_scans(child)
+
+
+def _indexes(node: dict):
+    if "Index Name" in node:
+        yield node["Index Name"]
+    for child in node.get("Plans", []):
+        yield from _indexes(child)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply database migrations")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--status", action="store_true", help="show applied and pending migrations")
+    mode.add_argument("--explain", action="store_true", help="check that queries use indexes")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    with connect() as conn:
+        if args.status:
+            print_status(conn)
+        elif args.explain:
+            if not explain_check(conn):
+                sys.exit(1)
+        else:
+            count = migrate(conn)
+            logger.info(f"Applied {count} migration(s)" if count else "Database is up to date")
+
+
+if __name__ == "__main__":
+    main()
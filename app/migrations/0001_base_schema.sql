@@ -0,0 +1,27 @@
+-- Leads and their original forwarded messages
+create table if not exists leads (
+    id bigint generated always as identity primary key,
+    user_id bigint not null,
+    contact_telegram_id bigint,
+    contact_name text,
+    contact_username text,
+    brand text,
+    request text,
+    dates text,
+    status text default 'new',
+    is_hot boolean not null default false,
+    created_at timestamptz default now(),
+    updated_at timestamptz default now()
+);
+
+-- Databases created from the old DEPLOY.md got these columns by hand
+alter table leads add column if not exists user_id bigint;
+alter table leads add column if not exists is_hot boolean not null default false;
+
+create table if not exists lead_messages (
+    id bigint generated always as identity primary key,
+    lead_id bigint not null references leads(id) on delete cascade,
+    raw_text text not null,
+    forward_date timestamptz,
+    created_at timestamptz default now()
+);
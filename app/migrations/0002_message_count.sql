@@ -0,0 +1,42 @@
+-- Cards show leads.message_count instead of loading the messages;
+-- statement-level triggers on lead_messages keep it current
+alter table leads add column if not exists message_count integer not null default 0;
+
+update leads l
+set message_count = (select count(*) from lead_messages m where m.lead_id = l.id);
+
+create or replace function lead_messages_count_insert()
+returns trigger
+language plpgsql
+as $$
+begin
+    update leads l
+    set message_count = l.message_count + n.cnt
+    from (select lead_id, count(*) as cnt from new_rows group by lead_id) n
+    where l.id = n.lead_id;
+    return null;
+end;
+$$;
+
+create or replace function lead_messages_count_delete()
+returns trigger
+language plpgsql
+as $$
+begin
+    update leads l
+    set message_count = greatest(l.message_count - o.cnt, 0)
+    from (select lead_id, count(*) as cnt from old_rows group by lead_id) o
+    where l.id = o.lead_id;
+    return null;
+end;
+$$;
+
+create or replace trigger lead_messages_count_insert
+after insert on lead_messages
+referencing new table as new_rows
+for each statement execute function lead_messages_count_insert();
+
+create or replace trigger lead_messages_count_delete
+after delete on lead_messages
+referencing old table as old_rows
+for each statement execute function lead_messages_count_delete();
@@ -0,0 +1,16 @@
+-- /leads pages by (status_rank, updated_at, id); ranks follow STATUS_ORDER in app/config.py
+alter table leads add column if not exists status_rank smallint generated always as (
+    case status
+        when 'contract' then 0
+        when 'signing' then 1
+        when 'negotiating' then 2
+        when 'waiting' then 3
+        when 'replied' then 4
+        when 'new' then 5
+        when 'lost' then 6
+        else 7
+    end
+) stored;
+
+create index if not exists leads_user_page_idx
+    on leads(user_id, status_rank, updated_at desc, id desc);
@@ -0,0 +1,24 @@
+-- /stats in one round-trip
+create or replace function lead_stats(p_user_id bigint)
+returns json
+language sql
+stable
+as $$
+    select json_build_object(
+        'total_leads', (select count(*) from leads where user_id = p_user_id),
+        'total_messages', (
+            select coalesce(sum(message_count), 0)
+            from leads
+            where user_id = p_user_id
+        ),
+        'by_status', coalesce((
+            select json_object_agg(status, cnt)
+            from (
+                select status, count(*) as cnt
+                from leads
+                where user_id = p_user_id
+                group by status
+            ) s
+        ), '{}'::json)
+    );
+$$;
@@ -0,0 +1,11 @@
+-- Atomic 🔥 toggle: double taps cannot lose an update
+create or replace function toggle_lead_hot(p_lead_id bigint, p_user_id bigint)
+returns setof leads
+language sql
+as $$
+    update leads
+    set is_hot = not coalesce(is_hot, false),
+        updated_at = now()
+    where id = p_lead_id and user_id = p_user_id
+    returning *;
+$$;
@@ -0,0 +1,72 @@
+-- /search: trigram + full-text indexes and the search_leads RPC
+create extension if not exists pg_trgm;
+create extension if not exists btree_gin;
+
+alter table leads add column if not exists search_text text generated always as (
+    coalesce(brand, '') || ' ' ||
+    coalesce(contact_name, '') || ' ' ||
+    coalesce(contact_username, '') || ' ' ||
+    coalesce(request, '')
+) stored;
+
+create index if not exists leads_search_trgm_idx
+    on leads using gin (user_id, search_text gin_trgm_ops);
+create index if not exists leads_search_fts_idx
+    on leads using gin (user_id, to_tsvector('simple', search_text));
+create index if not exists lead_messages_fts_idx
+    on lead_messages using gin (to_tsvector('simple', raw_text));
+
+create or replace function search_leads(p_user_id bigint, p_query text, p_limit int default 20)
+returns table (
+    id bigint,
+    brand text,
+    contact_name text,
+    contact_username text,
+    status text,
+    is_hot boolean,
+    rank real,
+    snippet text
+)
+language sql
+stable
+as $$
+    with q as (
+        select p_query as text, websearch_to_tsquery('simple', p_query) as ts
+    ),
+    hits as (
+        select l.id,
+               greatest(
+                   word_similarity(q.text, l.search_text),
+                   ts_rank(to_tsvector('simple', l.search_text), q.ts)
+               ) as rank
+        from leads l, q
+        where l.user_id = p_user_id
+          and (q.text <% l.search_text or to_tsvector('simple', l.search_text) @@ q.ts)
+        union all
+        select m.lead_id,
+               ts_rank(to_tsvector('simple', m.raw_text), q.ts) * 0.5
+        from lead_messages m
+        join leads l on l.id = m.lead_id, q
+        where l.user_id = p_user_id
+          and to_tsvector('simple', m.raw_text) @@ q.ts
+    ),
+    best as (
+        select id, max(rank) as rank
+        from hits
+        group by id
+        order by max(rank) desc
+        limit p_limit
+    )
+    select l.id, l.brand, l.contact_name, l.contact_username, l.status, l.is_hot,
+           b.rank::real,
+           (
+               select ts_headline('simple', m.raw_text, q.ts,
+                                  'StartSel=«, StopSel=», MaxWords=12, MinWords=4')
+               from lead_messages m, q
+               where m.lead_id = l.id and to_tsvector('simple', m.raw_text) @@ q.ts
+               limit 1
+           ) as snippet
+    from best b
+    join leads l on l.id = b.id
+    order by b.rank desc, l.updated_at desc;
+$$;
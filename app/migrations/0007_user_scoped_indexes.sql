@@ -0,0 +1,21 @@
+-- Every query filters by user_id first, so indexes lead with it and end with the sort key
+
+-- get_leads_by_status, get_hot_leads, search_leads ilike fallback, lead_stats
+create index if not exists leads_user_updated_idx
+    on leads(user_id, updated_at desc);
+
+-- get_recent_lead_by_contact
+create index if not exists leads_user_contact_tg_idx
+    on leads(user_id, contact_telegram_id, updated_at desc);
+create index if not exists leads_user_contact_name_idx
+    on leads(user_id, contact_name, updated_at desc);
+
+-- get_lead_messages (filter + order), message counts per lead
+create index if not exists lead_messages_lead_created_idx
+    on lead_messages(lead_id, created_at);
+
+-- Superseded: no query filters on these columns without user_id / lead_id ordering
+-- (warm_recent_contacts reads recent leads across all users: leads_updated_at_idx, 0008)
+drop index if exists leads_status_idx;
+drop index if exists leads_contact_telegram_id_idx;
+drop index if exists lead_messages_lead_id_idx;
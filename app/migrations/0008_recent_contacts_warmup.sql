@@ -0,0 +1,3 @@
+-- warm_recent_contacts reads leads updated in the last window across all users at startup
+create index if not exists leads_updated_at_idx
+    on leads(updated_at);
@@ -0,0 +1,56 @@
+-- Write-behind replication from STORAGE_BACKEND=sqlite (app/services/replicator.py).
+-- Rows keep the ids assigned locally; replaying a batch writes the same rows again.
+-- A lead row only replaces one with an older updated_at; the ids of rejected rows
+-- are returned so the bot can take the Supabase version instead.
+create or replace function sync_leads(p_leads jsonb, p_messages jsonb)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_conflicts bigint[];
+begin
+    with incoming as (
+        select * from jsonb_populate_recordset(null::leads, p_leads)
+    ),
+    written as (
+        insert into leads (
+            id, user_id, contact_telegram_id, contact_name, contact_username,
+            brand, request, dates, status, is_hot, created_at, updated_at
+        )
+        overriding system value
+        select id, user_id, contact_telegram_id, contact_name, contact_username,
+               brand, request, dates, status, coalesce(is_hot, false), created_at, updated_at
+        from incoming
+        on conflict (id) do update set
+            user_id = excluded.user_id,
+            contact_telegram_id = excluded.contact_telegram_id,
+            contact_name = excluded.contact_name,
+            contact_username = excluded.contact_username,
+            brand = excluded.brand,
+            request = excluded.request,
+            dates = excluded.dates,
+            status = excluded.status,
+            is_hot = excluded.is_hot,
+            updated_at = excluded.updated_at
+        where leads.updated_at <= excluded.updated_at
+        returning id
+    )
+    select coalesce(array_agg(i.id), '{}')
+    into v_conflicts
+    from incoming i
+    where i.id not in (select id from written);
+
+    -- The message_count trigger only sees rows actually inserted
+    insert into lead_messages (id, lead_id, raw_text, forward_date, created_at)
+    overriding system value
+    select id, lead_id, raw_text, forward_date, created_at
+    from jsonb_populate_recordset(null::lead_messages, p_messages)
+    on conflict (id) do nothing;
+
+    -- Keep identity sequences past replicated ids, so inserts made directly in Supabase cannot collide
+    perform setval(pg_get_serial_sequence('leads', 'id'), greatest((select max(id) from leads), 1));
+    perform setval(pg_get_serial_sequence('lead_messages', 'id'), greatest((select max(id) from lead_messages), 1));
+
+    return jsonb_build_object('conflicts', to_jsonb(v_conflicts));
+end;
+$$;
@@ -0,0 +1,3 @@
+-- /export and python -m app.export page through a user's leads by id (keyset)
+create index if not exists leads_user_id_idx
+    on leads(user_id, id);
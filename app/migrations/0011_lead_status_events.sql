@@ -0,0 +1,66 @@
+-- Append-only history of lead changes, for funnel timing in /stats.
+-- kind: created (value 'new'), status (value = new status), hot ('true'/'false'),
+-- edit (value = edited field). Rows are written in batches by app.services.lead_events.
+create table if not exists lead_status_events (
+    id bigint generated always as identity primary key,
+    lead_id bigint not null references leads(id) on delete cascade,
+    user_id bigint not null,
+    kind text not null,
+    value text,
+    created_at timestamptz not null default now()
+);
+
+-- lead_status_history: one user's status events, read in index order
+create index if not exists lead_status_events_user_idx
+    on lead_status_events(user_id, kind, lead_id, created_at);
+
+-- Leads created before the log existed: their creation, and the current status
+-- as of the last update (time spent in earlier stages is unknown)
+insert into lead_status_events (lead_id, user_id, kind, value, created_at)
+select id, user_id, 'created', 'new', coalesce(created_at, now())
+from leads
+where user_id is not null
+  and not exists (select 1 from lead_status_events);
+
+insert into lead_status_events (lead_id, user_id, kind, value, created_at)
+select id, user_id, 'status', status, coalesce(updated_at, now())
+from leads
+where user_id is not null
+  and coalesce(status, 'new') <> 'new'
+  and not exists (select 1 from lead_status_events where kind = 'status');
+
+-- Columnar status history for the funnel analytics, in one round-trip
+create or replace function lead_status_history(p_user_id bigint)
+returns json
+language sql
+stable
+as $$
+    select json_build_object(
+        'lead_id', coalesce(array_agg(lead_id), '{}'),
+        'status', coalesce(array_agg(value), '{}'),
+        'at', coalesce(array_agg(extract(epoch from created_at)), '{}')
+    )
+    from lead_status_events
+    where user_id = p_user_id
+      and kind in ('created', 'status');
+$$;
+
+-- Write-behind replication of events from STORAGE_BACKEND=sqlite (see 0009_sync_leads.sql)
+create or replace function sync_lead_events(p_events jsonb)
+returns void
+language plpgsql
+as $$
+begin
+    insert into lead_status_events (id, lead_id, user_id, kind, value, created_at)
+    overriding system value
+    select id, lead_id, user_id, kind, value, created_at
+    from jsonb_populate_recordset(null::lead_status_events, p_events)
+    where exists (select 1 from leads where leads.id = lead_id)
+    on conflict (id) do nothing;
+
+    perform setval(
+        pg_get_serial_sequence('lead_status_events', 'id'),
+        greatest((select max(id) from lead_status_events), 1)
+    );
+end;
+$$;
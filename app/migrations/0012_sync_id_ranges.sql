@@ -0,0 +1,136 @@
+-- STORAGE_BACKEND=sqlite assigns ids from blocks reserved here, so a row created in
+-- the bot can never take the id of a row inserted directly in Supabase.
+-- Replaces the sync functions from 0009/0011: they no longer move the sequences back
+-- to max(id) (which could hand out reserved ids), and an id already used by another
+-- user's lead or another lead's message is reported instead of overwritten.
+
+-- Reserve p_count ids per table; returns the first id of each block.
+-- p_after: the caller's highest local id per table, so blocks also start above rows
+-- written before this migration and not yet replicated.
+create or replace function reserve_ids(p_count bigint, p_after jsonb default '{}')
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_table text;
+    v_sequence text;
+    v_start bigint;
+    v_max bigint;
+    v_result jsonb := '{}';
+begin
+    -- Inserts take their ids from the same sequences: hold them off until the blocks are set
+    lock table leads, lead_messages, lead_status_events in exclusive mode;
+
+    foreach v_table in array array['leads', 'lead_messages', 'lead_status_events'] loop
+        v_sequence := pg_get_serial_sequence(v_table, 'id');
+        execute format('select max(id) from %I', v_table) into v_max;
+        v_start := greatest(
+            nextval(v_sequence),
+            coalesce(v_max, 0) + 1,
+            coalesce((p_after ->> v_table)::bigint, 0) + 1
+        );
+        perform setval(v_sequence, v_start + p_count - 1);
+        v_result := v_result || jsonb_build_object(v_table, v_start);
+    end loop;
+    return v_result;
+end;
+$$;
+
+-- A lead row only replaces one of the same user with an older updated_at.
+-- conflicts: ids not written (newer Supabase row, or collisions);
+-- collisions: ids that belong to another user's lead;
+-- message_collisions: message ids that belong to another lead's message.
+create or replace function sync_leads(p_leads jsonb, p_messages jsonb)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_conflicts bigint[];
+    v_collisions bigint[];
+    v_message_collisions bigint[];
+begin
+    with incoming as (
+        select * from jsonb_populate_recordset(null::leads, p_leads)
+    ),
+    written as (
+        insert into leads (
+            id, user_id, contact_telegram_id, contact_name, contact_username,
+            brand, request, dates, status, is_hot, created_at, updated_at
+        )
+        overriding system value
+        select id, user_id, contact_telegram_id, contact_name, contact_username,
+               brand, request, dates, status, coalesce(is_hot, false), created_at, updated_at
+        from incoming
+        on conflict (id) do update set
+            contact_telegram_id = excluded.contact_telegram_id,
+            contact_name = excluded.contact_name,
+            contact_username = excluded.contact_username,
+            brand = excluded.brand,
+            request = excluded.request,
+            dates = excluded.dates,
+            status = excluded.status,
+            is_hot = excluded.is_hot,
+            updated_at = excluded.updated_at
+        where leads.updated_at <= excluded.updated_at
+          and leads.user_id = excluded.user_id
+        returning id
+    )
+    select coalesce(array_agg(i.id), '{}')
+    into v_conflicts
+    from incoming i
+    where i.id not in (select id from written);
+
+    select coalesce(array_agg(l.id), '{}')
+    into v_collisions
+    from leads l
+    join jsonb_populate_recordset(null::leads, p_leads) i on i.id = l.id
+    where l.user_id <> i.user_id;
+
+    select coalesce(array_agg(m.id), '{}')
+    into v_message_collisions
+    from jsonb_populate_recordset(null::lead_messages, p_messages) m
+    join lead_messages x on x.id = m.id
+    where x.lead_id <> m.lead_id;
+
+    -- The message_count trigger only sees rows actually inserted.
+    -- Messages of a colliding lead would land on another user's lead: skip them.
+    insert into lead_messages (id, lead_id, raw_text, forward_date, created_at)
+    overriding system value
+    select id, lead_id, raw_text, forward_date, created_at
+    from jsonb_populate_recordset(null::lead_messages, p_messages)
+    where lead_id <> all (v_collisions)
+    on conflict (id) do nothing;
+
+    return jsonb_build_object(
+        'conflicts', to_jsonb(v_conflicts),
+        'collisions', to_jsonb(v_collisions),
+        'message_collisions', to_jsonb(v_message_collisions)
+    );
+end;
+$$;
+
+-- Returns {"collisions": ids already used by another lead's or user's event}
+drop function if exists sync_lead_events(jsonb);
+create function sync_lead_events(p_events jsonb)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_collisions bigint[];
+begin
+    select coalesce(array_agg(e.id), '{}')
+    into v_collisions
+    from jsonb_populate_recordset(null::lead_status_events, p_events) e
+    join lead_status_events x on x.id = e.id
+    where x.lead_id <> e.lead_id or x.user_id <> e.user_id;
+
+    insert into lead_status_events (id, lead_id, user_id, kind, value, created_at)
+    overriding system value
+    select id, lead_id, user_id, kind, value, created_at
+    from jsonb_populate_recordset(null::lead_status_events, p_events) e
+    where exists (select 1 from leads where leads.id = e.lead_id and leads.user_id = e.user_id)
+    on conflict (id) do nothing;
+
+    return jsonb_build_object('collisions', to_jsonb(v_collisions));
+end;
+$$;
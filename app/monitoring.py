@@ -0,0 +1,51 @@
+"""Handler timing and the /metrics endpoint (Prometheus text format)."""
+import logging
+import time
+from typing import Any, Awaitable, Callable
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+handler_latency = metrics.histogram("crm_handler_seconds", "Time spent in each bot handler")
+handler_errors = metrics.counter("crm_handler_errors_total", "Bot handlers that raised, by handler")
+
+
+class HandlerTimer(BaseMiddleware):
+    """Inner middleware: latency per handler function, labelled handler=<name>."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any]
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object is not None else "unknown"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(handler=name)
+            raise
+        finally:
+            handler_latency.observe(time.perf_counter() - started, handler=name)
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Serve /metrics on its own port (polling mode and cluster workers)."""
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Metrics on http://{host}:{port}/metrics")
+    return runner
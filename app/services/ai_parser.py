@@ -1,9 +1,50 @@
 """AI parsing module using OpenAI."""
+import hashlib
 import json
+import logging
+from typing import Optional
 from openai import AsyncOpenAI
-from app.config import OPENAI_API_KEY
+from app.config import (
+    OPENAI_API_KEY, OPENAI_BASE_URL, PARSE_CACHE_DB_PATH, PARSE_CACHE_MAX_ENTRIES, PARSE_CACHE_TTL_SECONDS,
+    LLM_MAX_CONCURRENCY, LLM_PER_USER_CONCURRENCY, LLM_RPM, LLM_TPM, LLM_MAX_RETRIES,
+    LLM_TIMEOUT_SECONDS, LLM_BREAKER_FAILURES, LLM_BREAKER_RESET_SECONDS
+)
+from app.services.heuristics import extract_fields, is_confident, CONFIDENCE_THRESHOLD
+from app.services.llm_runner import LLMRunner, CircuitBreaker
+from app.services.parse_cache import ParseCache, cache_key
+from app.utils import metrics
 
-client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+logger = logging.getLogger(__name__)
+
+heuristic_results = metrics.counter(
+    "crm_parse_heuristic_total", "Parses by heuristic outcome (skipped_llm / needed_llm)"
+)
+INPUT_CHAR_BUCKETS = (100, 300, 1000, 3000, 10000, 30000, 100000)
+input_chars = metrics.histogram("crm_parse_input_chars", "Characters of message text per parse call", INPUT_CHAR_BUCKETS)
+timed = metrics.timed(
+    metrics.histogram("crm_parse_seconds", "Parse call time (heuristics, cache and LLM) by function"),
+    metrics.counter("crm_parse_errors_total", "Parse calls that raised, by function")
+)
+
+# Retries are handled by llm_runner (with backoff shared across all callers)
+client = AsyncOpenAI(
+    api_key=OPENAI_API_KEY,
+    base_url=OPENAI_BASE_URL,
+    max_retries=0,
+    timeout=LLM_TIMEOUT_SECONDS
+)
+
+llm = LLMRunner(
+    max_concurrency=LLM_MAX_CONCURRENCY,
+    per_user_concurrency=LLM_PER_USER_CONCURRENCY,
+    rpm=LLM_RPM,
+    tpm=LLM_TPM,
+    max_retries=LLM_MAX_RETRIES,
+    breaker=CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_RESET_SECONDS)
+)
+
+MODEL = "gpt-4o-mini"
+MAX_TOKENS = 500
 
 SYSTEM_PROMPT = """Ты анализируешь сообщения о рекламном сотрудничестве. Извлеки информацию:
 
@@ -17,40 +58,164 @@ SYSTEM_PROMPT = """Ты анализируешь сообщения о рекл
 
 Если что-то не найдено, используй null."""
 
+INCREMENTAL_PROMPT = """Ты обновляешь карточку лида о рекламном сотрудничестве.
+Тебе даны текущие поля лида и НОВЫЕ сообщения из той же переписки.
+
+- brand: Название компании/бренда
+- request: Что хотят (1 короткое предложение на русском)
+- contact: Имя контактного лица
+- dates: Упомянутые даты/дедлайны
+
+Обнови поля с учётом новых сообщений. Если новые сообщения не меняют поле, верни его текущее значение.
+Если даты уточнились или добавились, объедини их с текущими.
+
+Верни ТОЛЬКО валидный JSON без markdown:
+{"brand": "...", "request": "...", "contact": "...", "dates": "..."}
+
+Если что-то не найдено, используй null."""
+
+FIELDS = ("brand", "request", "contact", "dates")
+
+
+def _prompt_version(prompt: str) -> str:
+    """Part of every cache key: editing the prompt or model invalidates old entries."""
+    return hashlib.sha256(f"{MODEL}\0{prompt}".encode()).hexdigest()[:16]
+
+
+PROMPT_VERSION = _prompt_version(SYSTEM_PROMPT)
+INCREMENTAL_PROMPT_VERSION = _prompt_version(INCREMENTAL_PROMPT)
+
+parse_cache = ParseCache(PARSE_CACHE_DB_PATH or None, PARSE_CACHE_MAX_ENTRIES, PARSE_CACHE_TTL_SECONDS)
+
+
+def quick_parse(combined_text: str, contact_hint: Optional[str] = None) -> tuple[dict, bool]:
+    """Rule-based fields only; the flag is True when all are confident enough to skip the LLM."""
+    guess = extract_fields(combined_text, contact_hint)
+    confident = is_confident(guess)
+    if confident:
+        heuristic_results.inc(outcome="skipped_llm")
+    return {field: value for field, (value, _) in guess.items()}, confident
+
+
+@timed
+async def parse_messages(
+    combined_text: str,
+    user_id: Optional[int] = None,
+    contact_hint: Optional[str] = None
+) -> dict:
+    """Parse combined messages and extract lead info.
+
+    Rule-based extraction runs first; the LLM is only called when some field is
+    below the confidence threshold, and confident rule-based fields win the merge.
+    """
+    input_chars.observe(len(combined_text), call="parse_messages")
+    guess = extract_fields(combined_text, contact_hint)
+    if is_confident(guess):
+        heuristic_results.inc(outcome="skipped_llm")
+        return {field: value for field, (value, _) in guess.items()}
+
+    heuristic_results.inc(outcome="needed_llm")
+    parsed = await _cached_completion(SYSTEM_PROMPT, PROMPT_VERSION, combined_text, user_id)
+    if parsed is None:
+        return {field: value for field, (value, _) in guess.items()}
+
+    return {
+        field: value if confidence >= CONFIDENCE_THRESHOLD else (parsed.get(field) or value)
+        for field, (value, confidence) in guess.items()
+    }
+
+
+@timed
+async def parse_new_messages(current: dict, new_text: str, user_id: Optional[int] = None) -> dict:
+    """Merge newly added messages into a lead's current fields.
+
+    Only the current fields and the new messages are sent, so cost does not grow
+    with thread length. Use parse_messages on the full history for a full re-parse.
+    Without the LLM, rule-based fields from the new messages only fill empty fields.
+    """
+    input_chars.observe(len(new_text), call="parse_new_messages")
+    current_fields = {field: current.get(field) for field in FIELDS}
+    user_content = (
+        f"Текущие поля лида:\n{json.dumps(current_fields, ensure_ascii=False)}\n\n"
+        f"Новые сообщения:\n{new_text}"
+    )
+
+    parsed = await _cached_completion(INCREMENTAL_PROMPT, INCREMENTAL_PROMPT_VERSION, user_content, user_id)
+    if parsed is None:
+        guess = fallback_parse(new_text)
+        return {field: current_fields[field] or guess[field] for field in FIELDS}
+
+    # Never lose a known field because the model answered null
+    return {field: parsed.get(field) or current_fields[field] for field in FIELDS}
+
+
+async def _cached_completion(
+    system_prompt: str,
+    prompt_version: str,
+    user_content: str,
+    user_id: Optional[int] = None
+) -> Optional[dict]:
+    """Run a completion through the parse cache; None when the LLM is unavailable.
+
+    Callers fall back on their own text: user_content may hold more than the messages.
+    """
+    key = cache_key(user_content, prompt_version)
+    cached = await parse_cache.get(key)
+    if cached is not None:
+        return cached
 
-async def parse_messages(combined_text: str) -> dict:
-    """Parse combined messages and extract lead info."""
     try:
-        response = await client.chat.completions.create(
-            model="gpt-4o-mini",
+        result = await _complete(system_prompt, user_content, user_id)
+    except Exception as e:
+        logger.warning(f"AI parsing unavailable ({e.__class__.__name__}: {e}), using fallback parser")
+        return None
+
+    # Failed parses come back all-null; retry those next time instead of caching
+    if any(result.values()):
+        await parse_cache.put(key, result)
+
+    return result
+
+
+def fallback_parse(text: str) -> dict:
+    """Parser used when the LLM is unavailable (circuit open, retries exhausted)."""
+    return {field: value for field, (value, _) in extract_fields(text).items()}
+
+
+def estimate_tokens(*texts: str) -> int:
+    """Rough prompt + completion token estimate for TPM pacing (~3 chars per token)."""
+    return sum(len(t) for t in texts) // 3 + MAX_TOKENS
+
+
+async def _complete(system_prompt: str, user_content: str, user_id: Optional[int] = None) -> dict:
+    """Ask the model for lead fields as JSON. Raises if the LLM call itself fails."""
+    response = await llm.run(
+        lambda: client.chat.completions.create(
+            model=MODEL,
             messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": combined_text}
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_content}
             ],
             temperature=0.1,
-            max_tokens=500
-        )
+            max_tokens=MAX_TOKENS
+        ),
+        user_id=user_id,
+        tokens=estimate_tokens(system_prompt, user_content)
+    )
 
-        content = response.choices[0].message.content.strip()
+    content = response.choices[0].message.content.strip()
 
-        # Remove markdown code blocks if present
-        if content.startswith("```"):
-            content = content.split("```")[1]
-            if content.startswith("json"):
-                content = content[4:]
-            content = content.strip()
+    # Remove markdown code blocks if present
+    if content.startswith("```"):
+        content = content.split("```")[1]
+        if content.startswith("json"):
+            content = content[4:]
+        content = content.strip()
 
+    try:
         result = json.loads(content)
-
-        return {
-            "brand": result.get("brand"),
-            "request": result.get("request"),
-            "contact": result.get("contact"),
-            "dates": result.get("dates")
-        }
-
     except json.JSONDecodeError:
-        return {"brand": None, "request": None, "contact": None, "dates": None}
-    except Exception as e:
-        print(f"AI parsing error: {e}")
-        return {"brand": None, "request": None, "contact": None, "dates": None}
+        logger.warning(f"AI returned invalid JSON: {content[:200]}")
+        return {field: None for field in FIELDS}
+
+    return {field: result.get(field) for field in FIELDS}
@@ -0,0 +1,224 @@
+"""Debounce scheduler for forwarded-message batching."""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+from app.services.state_store import StateStore
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# Telegram shows "typing" for ~5 seconds per chat action
+TYPING_REFRESH_SECONDS = 4.5
+
+BATCH_SIZE_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+# A flushed batch whose processing never finished is replayed at most this many times
+MAX_REPLAYS = 3
+
+batches_open = metrics.gauge("crm_batches_open", "Forwarded-message batches waiting for their deadline")
+messages_buffered = metrics.gauge("crm_batch_messages_buffered", "Messages held in open batches")
+batch_size = metrics.histogram("crm_batch_size", "Messages per flushed batch", BATCH_SIZE_BUCKETS)
+batches_flushed = metrics.counter("crm_batches_flushed_total", "Flushed batches by reason")
+
+
+class BatchScheduler:
+    """Collects messages per key and flushes each batch once it goes quiet.
+
+    All keys share one deadline heap and a single loop timer: adding a message
+    pushes a new (deadline, key) entry in O(log n) and older entries for the key
+    are skipped when they surface. A batch flushes after `timeout` seconds
+    without new messages, after `max_wait` seconds in total, or immediately
+    once it holds `max_messages`. With a StateStore, open batches are persisted
+    and can be re-opened after a restart with restore(); a flushed batch stays
+    persisted until on_flush succeeds, so a restart during processing replays
+    it (with "replayed": True in the batch, for on_flush to skip finished work).
+    """
+
+    namespace = "batches"
+    flushing_namespace = "batches_flushing"
+
+    def __init__(
+        self,
+        on_flush: Callable[[str, dict], Awaitable[None]],
+        timeout: float,
+        max_messages: int,
+        max_wait: float,
+        on_typing: Optional[Callable[[int], Awaitable[None]]] = None,
+        store: Optional[StateStore] = None
+    ):
+        self.on_flush = on_flush
+        self.on_typing = on_typing
+        self.timeout = timeout
+        self.max_messages = max_messages
+        self.max_wait = max_wait
+        self.store = store
+
+        # key -> {"messages": [...], "chat_id": int, "first_at": float, "deadline": float, **meta}
+        self._batches: dict[str, dict] = {}
+        self._heap: list[tuple[float, int, str]] = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_at: Optional[float] = None
+        self._typing_sent: dict[int, float] = {}
+        self._open_per_chat: dict[int, int] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._buffered = 0
+
+        batches_open.fn = lambda: len(self._batches)
+        messages_buffered.fn = lambda: self._buffered
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._batches
+
+    def __len__(self) -> int:
+        return len(self._batches)
+
+    def add(self, key: str, message: dict, chat_id: int, **meta) -> int:
+        """Buffer a message under key and reset its deadline. Returns batch size."""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = {"messages": [], "chat_id": chat_id, "first_at": now, **meta}
+            self._batches[key] = batch
+            self._open_per_chat[chat_id] = self._open_per_chat.get(chat_id, 0) + 1
+
+        batch["messages"].append(message)
+        self._buffered += 1
+        self._persist(key, batch)
+        self._send_typing(chat_id, now)
+
+        if len(batch["messages"]) >= self.max_messages:
+            self._flush(key, "max_messages")
+            return len(batch["messages"])
+
+        batch["deadline"] = min(now + self.timeout, batch["first_at"] + self.max_wait)
+        heapq.heappush(self._heap, (batch["deadline"], next(self._seq), key))
+        self._arm(loop)
+        return len(batch["messages"])
+
+    def restore(self) -> int:
+        """Re-open batches persisted before a restart; each flushes after one timeout.
+
+        Batches that were flushed but not processed are handed to on_flush again.
+        """
+        if self.store is None:
+            return 0
+
+        replayed = 0
+        for token, saved in sorted(self.store.items(self.flushing_namespace), key=lambda item: item[1]["flushed_at"]):
+            replays = saved.get("replays", 0) + 1
+            if replays > MAX_REPLAYS:
+                logger.error(f"Dropping batch {saved['key']} after {MAX_REPLAYS} failed replays")
+                self.store.delete(self.flushing_namespace, token)
+                continue
+            saved["replays"] = replays
+            self.store.set(self.flushing_namespace, token, saved)
+            batch = {k: v for k, v in saved.items() if k not in ("key", "flushed_at", "replays")}
+            self._spawn(self._run_flush(saved["key"], {**batch, "replayed": True}, token))
+            replayed += 1
+
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        restored = self.store.items(self.namespace)
+        for key, saved in restored:
+            batch = {**saved, "first_at": now, "deadline": now + self.timeout}
+            self._batches[key] = batch
+            self._buffered += len(batch["messages"])
+            self._open_per_chat[batch["chat_id"]] = self._open_per_chat.get(batch["chat_id"], 0) + 1
+            heapq.heappush(self._heap, (batch["deadline"], next(self._seq), key))
+
+        self._arm(loop)
+        return len(restored) + replayed
+
+    def _persist(self, key: str, batch: dict):
+        if self.store is not None:
+            saved = {k: v for k, v in batch.items() if k not in ("first_at", "deadline")}
+            self.store.set(self.namespace, key, saved)
+
+    def _arm(self, loop: asyncio.AbstractEventLoop):
+        """Point the single timer at the earliest heap entry."""
+        if not self._heap:
+            return
+        when = self._heap[0][0]
+        if self._timer is not None:
+            if self._timer_at <= when:
+                return
+            self._timer.cancel()
+        self._timer_at = when
+        self._timer = loop.call_at(when, self._on_timer)
+
+    def _on_timer(self):
+        """Flush every batch whose deadline has passed, then re-arm."""
+        loop = asyncio.get_running_loop()
+        self._timer = None
+        self._timer_at = None
+        now = loop.time()
+
+        while self._heap and self._heap[0][0] <= now:
+            deadline, _, key = heapq.heappop(self._heap)
+            batch = self._batches.get(key)
+            # Skip entries superseded by a later add() for the same key
+            if batch is None or batch["deadline"] != deadline:
+                continue
+            reason = "max_wait" if deadline >= batch["first_at"] + self.max_wait else "timeout"
+            self._flush(key, reason)
+
+        self._arm(loop)
+
+    def _flush(self, key: str, reason: str):
+        batch = self._batches.pop(key)
+        self._buffered -= len(batch["messages"])
+        token = None
+        if self.store is not None:
+            # Moved, not deleted: the key is free for new messages, the batch survives until processed
+            token = f"{key}@{time.time_ns()}"
+            saved = {k: v for k, v in batch.items() if k not in ("first_at", "deadline")}
+            self.store.set(self.flushing_namespace, token, {**saved, "key": key, "flushed_at": time.time()})
+            self.store.delete(self.namespace, key)
+        batch_size.observe(len(batch["messages"]))
+        batches_flushed.inc(reason=reason)
+
+        chat_id = batch["chat_id"]
+        self._open_per_chat[chat_id] -= 1
+        if not self._open_per_chat[chat_id]:
+            del self._open_per_chat[chat_id]
+            self._typing_sent.pop(chat_id, None)
+
+        self._spawn(self._run_flush(key, batch, token))
+
+    async def _run_flush(self, key: str, batch: dict, token: Optional[str]):
+        try:
+            await self.on_flush(key, batch)
+        except Exception:
+            # Left persisted: replayed after the next restart
+            logger.exception(f"Failed to process batch {key}")
+            return
+        if token is not None:
+            self.store.delete(self.flushing_namespace, token)
+
+    def _send_typing(self, chat_id: int, now: float):
+        """Send one typing action per chat, refreshed only when it would expire."""
+        if self.on_typing is None:
+            return
+        last = self._typing_sent.get(chat_id)
+        if last is not None and now - last < TYPING_REFRESH_SECONDS:
+            return
+        self._typing_sent[chat_id] = now
+        self._spawn(self._run_typing(chat_id))
+
+    async def _run_typing(self, chat_id: int):
+        try:
+            await self.on_typing(chat_id)
+        except Exception as e:
+            logger.warning(f"Failed to send typing action to {chat_id}: {e}")
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
@@ -1,9 +1,152 @@
-"""Database operations using Supabase with multi-user support."""
-from datetime import datetime, timedelta
+"""Database operations with multi-user support.
+
+Queries go to the backend chosen by STORAGE_BACKEND: Supabase directly
+(supabase_store), a local SQLite copy replicated to Supabase in the background
+(local_store + replicator), or an in-memory SQLite database with no network.
+The caches and the recent-contact index below sit in front of any backend.
+"""
+import logging
+import time
+from datetime import datetime, timedelta, timezone
 from typing import Optional
-from app.services.supabase import supabase
 
+from app import config
+from app.config import (
+    SEARCH_LIMIT, SAME_LEAD_WINDOW_MINUTES, LEAD_CACHE_TTL_SECONDS, LEAD_CACHE_MAX_USERS,
+    LEAD_CACHE_MAX_LEADS_PER_USER, LEAD_CACHE_MAX_MESSAGE_LISTS, STORAGE_BACKEND, LOCAL_DB_PATH,
+    SYNC_BATCH_SIZE, SYNC_INTERVAL_SECONDS, SYNC_ID_BLOCK, STATUS_EVENTS_FLUSH_SECONDS, STATUS_EVENTS_BATCH_SIZE,
+    STATUS_EVENTS_MAX_PENDING, FUNNEL_COHORT_WEEKS
+)
+from app.services.funnel import funnel_stats
+from app.services.lead_cache import LeadCache
+from app.services.lead_events import LeadEventLog
+from app.services.recent_contacts import RecentContacts
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# Card views re-read the same lead many times; mutators below keep this current
+lead_cache = LeadCache(
+    max_users=LEAD_CACHE_MAX_USERS,
+    max_leads_per_user=LEAD_CACHE_MAX_LEADS_PER_USER,
+    max_message_lists=LEAD_CACHE_MAX_MESSAGE_LISTS,
+    ttl_seconds=LEAD_CACHE_TTL_SECONDS
+)
+
+# Every mutation bumps updated_at, so each one refreshes the lead's same-contact window
+recent_contacts = RecentContacts(SAME_LEAD_WINDOW_MINUTES * 60)
+
+ROW_BUCKETS = (0, 1, 5, 15, 50, 200, 1000, 5000)
+
+# Lead fields a user can edit by hand (the field name comes from callback data)
+EDITABLE_FIELDS = ("brand", "request", "contact_name", "dates")
+
+
+def _row_count(result) -> Optional[int]:
+    """Rows in a database call's result; None for scalars and aggregates."""
+    if isinstance(result, list):
+        return len(result)
+    if result is None:
+        return 0
+    if isinstance(result, dict) and "id" in result:
+        return 1
+    return None
+
+
+# Every public call below: latency, errors and rows returned, labelled call=<function>
+timed = metrics.timed(
+    metrics.histogram("crm_db_call_seconds", "Database call latency (including cache hits) by function"),
+    metrics.counter("crm_db_errors_total", "Database calls that raised, by function"),
+    metrics.histogram("crm_db_rows", "Rows returned per database call", ROW_BUCKETS),
+    _row_count
+)
+
+
+def _written(lead_id: int, row: Optional[dict]) -> Optional[dict]:
+    """Write a mutation's returned row through to the caches (or drop the lead if none came back)."""
+    if row:
+        lead_cache.put_lead(row)
+        recent_contacts.touch(row)
+    else:
+        lead_cache.invalidate(lead_id)
+    return row
+
+
+def _open_store():
+    """The backend for STORAGE_BACKEND (Supabase is only imported when it is used) and its replicator."""
+    if STORAGE_BACKEND == "supabase":
+        from app.services.supabase_store import SupabaseStore
+        return SupabaseStore(), None
+
+    from app.services.local_store import LocalStore
+    if STORAGE_BACKEND == "memory":
+        return LocalStore(None), None
+    if STORAGE_BACKEND != "sqlite":
+        raise ValueError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r} (supabase, sqlite or memory)")
+
+    if not config.SUPABASE_URL:
+        logger.warning("STORAGE_BACKEND=sqlite without SUPABASE_URL: leads stay on this machine only")
+        return LocalStore(LOCAL_DB_PATH), None
+
+    from app.services.replicator import OutboxReplicator
+    local = LocalStore(LOCAL_DB_PATH, track_changes=True)
+    return local, OutboxReplicator(local, SYNC_BATCH_SIZE, SYNC_INTERVAL_SECONDS, SYNC_ID_BLOCK)
+
+
+store, replicator = _open_store()
+
+
+def _remote_change(rows: list[dict]):
+    """Lead rows replaced by their Supabase version (sync conflicts): drop what we cached for them."""
+    for row in rows:
+        lead_cache.invalidate(row["id"])
+        _written(row["id"], row)
+
+
+store.on_remote_change = _remote_change
 
+# Lead history for /stats funnel timing; mutators append, inserts go out in batches
+status_events = LeadEventLog(
+    store.insert_events, STATUS_EVENTS_FLUSH_SECONDS, STATUS_EVENTS_BATCH_SIZE, STATUS_EVENTS_MAX_PENDING
+)
+
+
+async def start_storage():
+    """Open the backend; with replication, copy Supabase on first start and begin syncing.
+
+    Only one process replicates (config.LOCAL_SYNC); cluster workers sharing
+    the file wait for its first copy before taking updates. Every process
+    makes sure ids for new rows are reserved in Supabase.
+    """
+    syncing = replicator is not None and config.LOCAL_SYNC
+    if replicator is not None and not syncing:
+        await replicator.wait_hydrated()
+    await store.start()
+    if syncing:
+        await replicator.hydrate()
+    if replicator is not None:
+        try:
+            await replicator.ensure_ids()
+        except Exception as e:
+            if not min((await store.ids_left()).values()):
+                raise
+            logger.warning(f"Could not reserve more ids in Supabase ({e}), using the ones left")
+    if syncing:
+        replicator.start()
+
+
+async def close_storage():
+    await status_events.close()
+    if replicator is not None:
+        await replicator.stop()
+    await store.close()
+
+
+def _message_rows(raw_messages: list[dict]) -> list[dict]:
+    return [{"raw_text": msg["text"], "forward_date": msg.get("forward_date")} for msg in raw_messages]
+
+
+@timed
 async def create_lead(
     user_id: int,
     contact_telegram_id: Optional[int],
@@ -13,8 +156,8 @@ async def create_lead(
     request: Optional[str],
     dates: Optional[str],
     raw_messages: list[dict]
-) -> int:
-    """Create a new lead with messages."""
+) -> dict:
+    """Create a new lead with messages. Returns the inserted row."""
     lead_data = {
         "user_id": user_id,
         "contact_telegram_id": contact_telegram_id,
@@ -26,214 +169,237 @@ async def create_lead(
         "status": "new"
     }
 
-    result = supabase.table("leads").insert(lead_data).execute()
-    lead_id = result.data[0]["id"]
-
+    token = lead_cache.begin()
+    lead, messages = await store.insert_lead(lead_data, _message_rows(raw_messages))
     if raw_messages:
-        messages_data = [
-            {
-                "lead_id": lead_id,
-                "raw_text": msg["text"],
-                "forward_date": msg.get("forward_date")
-            }
-            for msg in raw_messages
-        ]
-        supabase.table("lead_messages").insert(messages_data).execute()
-
-    return lead_id
-
-
-async def add_messages_to_lead(lead_id: int, raw_messages: list[dict]):
-    """Add messages to existing lead and update timestamp."""
+        lead_cache.put_messages(lead["id"], messages, token)
+    status_events.record(lead["id"], user_id, "created", "new", lead["created_at"])
+    return _written(lead["id"], lead)
+
+
+@timed
+async def create_leads(user_id: int, leads: list[dict]) -> list[dict]:
+    """Create many leads at once (bulk import). Returns the inserted rows in order.
+
+    Each item has the create_lead fields plus raw_messages, and may carry
+    created_at/updated_at. Rows are not put in the caches: imports are old leads.
+    """
+    columns = ("contact_telegram_id", "contact_name", "contact_username", "brand", "request", "dates")
+    now = datetime.utcnow().isoformat()
+    lead_data = [
+        {
+            "user_id": user_id,
+            **{column: lead.get(column) for column in columns},
+            "status": "new",
+            "created_at": lead.get("created_at") or now,
+            "updated_at": lead.get("updated_at") or now
+        }
+        for lead in leads
+    ]
+    if replicator is not None:
+        # A large import can need more ids than the replicator keeps in reserve
+        await replicator.ensure_ids(len(leads) + sum(len(lead["raw_messages"]) for lead in leads))
+    rows = await store.insert_leads(lead_data, [_message_rows(lead["raw_messages"]) for lead in leads])
+    for row in rows:
+        status_events.record(row["id"], user_id, "created", "new", row["created_at"])
+    return rows
+
+
+@timed
+async def add_messages_to_lead(lead_id: int, raw_messages: list[dict]) -> Optional[dict]:
+    """Add messages to existing lead and update timestamp. Returns the updated row."""
+    row = await store.add_messages(lead_id, _message_rows(raw_messages))
     if raw_messages:
-        messages_data = [
-            {
-                "lead_id": lead_id,
-                "raw_text": msg["text"],
-                "forward_date": msg.get("forward_date")
-            }
-            for msg in raw_messages
-        ]
-        supabase.table("lead_messages").insert(messages_data).execute()
-
-    supabase.table("leads").update({
-        "updated_at": datetime.utcnow().isoformat()
-    }).eq("id", lead_id).execute()
+        lead_cache.invalidate(lead_id)
+    return _written(lead_id, row)
 
 
+@timed
 async def update_lead_parsed_data(
     lead_id: int,
     brand: Optional[str],
     request: Optional[str],
     contact_name: Optional[str],
     dates: Optional[str]
-):
-    """Update lead with re-parsed data."""
+) -> Optional[dict]:
+    """Update lead with re-parsed data. Returns the updated row."""
     update_data = {
         "brand": brand,
         "request": request,
-        "dates": dates,
-        "updated_at": datetime.utcnow().isoformat()
+        "dates": dates
     }
 
     if contact_name:
         update_data["contact_name"] = contact_name
 
-    supabase.table("leads").update(update_data).eq("id", lead_id).execute()
+    return _written(lead_id, await store.update_lead(lead_id, None, update_data))
 
 
+@timed
 async def get_lead(lead_id: int, user_id: int) -> Optional[dict]:
     """Get lead by ID (only if belongs to user)."""
-    result = supabase.table("leads")\
-        .select("*")\
-        .eq("id", lead_id)\
-        .eq("user_id", user_id)\
-        .execute()
-    return result.data[0] if result.data else None
+    lead = lead_cache.get_lead(user_id, lead_id)
+    if lead is not None:
+        return lead
+
+    token = lead_cache.begin()
+    lead = await store.fetch_lead(lead_id, user_id)
+    if lead is not None:
+        lead_cache.put_lead(lead, token)
+    return lead
 
 
+@timed
 async def get_lead_messages(lead_id: int) -> list[dict]:
     """Get all messages for a lead."""
-    result = supabase.table("lead_messages")\
-        .select("*")\
-        .eq("lead_id", lead_id)\
-        .order("created_at")\
-        .execute()
-    return result.data
-
-
-async def update_lead_status(lead_id: int, user_id: int, status: str):
-    """Update lead status (only if belongs to user)."""
-    supabase.table("leads").update({
-        "status": status,
-        "updated_at": datetime.utcnow().isoformat()
-    }).eq("id", lead_id).eq("user_id", user_id).execute()
-
-
-async def toggle_lead_hot(lead_id: int, user_id: int) -> bool:
-    """Toggle is_hot flag for a lead. Returns new value."""
-    # Get current value
-    result = supabase.table("leads")\
-        .select("is_hot")\
-        .eq("id", lead_id)\
-        .eq("user_id", user_id)\
-        .single()\
-        .execute()
-    
-    current = result.data.get("is_hot", False) if result.data else False
-    new_value = not current
-    
-    supabase.table("leads").update({
-        "is_hot": new_value,
-        "updated_at": datetime.utcnow().isoformat()
-    }).eq("id", lead_id).eq("user_id", user_id).execute()
-    
-    return new_value
-
-
-async def update_lead_field(lead_id: int, user_id: int, field: str, value: str):
-    """Update a specific lead field (only if belongs to user)."""
-    supabase.table("leads").update({
-        field: value,
-        "updated_at": datetime.utcnow().isoformat()
-    }).eq("id", lead_id).eq("user_id", user_id).execute()
+    messages = lead_cache.get_messages(lead_id)
+    if messages is not None:
+        return messages
+
+    token = lead_cache.begin()
+    messages = await store.fetch_messages(lead_id)
+    lead_cache.put_messages(lead_id, messages, token)
+    return messages
+
+
+@timed
+async def update_lead_status(lead_id: int, user_id: int, status: str) -> Optional[dict]:
+    """Update lead status (only if belongs to user). Returns the updated row."""
+    row = await store.update_lead(lead_id, user_id, {"status": status})
+    if row:
+        status_events.record(lead_id, user_id, "status", status, row["updated_at"])
+    return _written(lead_id, row)
+
+
+@timed
+async def toggle_lead_hot(lead_id: int, user_id: int) -> Optional[dict]:
+    """Atomically toggle is_hot (only if belongs to user). Returns the updated row."""
+    row = await store.toggle_hot(lead_id, user_id)
+    if row:
+        status_events.record(lead_id, user_id, "hot", "true" if row["is_hot"] else "false", row["updated_at"])
+    return _written(lead_id, row)
+
+
+@timed
+async def update_lead_field(lead_id: int, user_id: int, field: str, value: str) -> Optional[dict]:
+    """Update a specific lead field (only if belongs to user). Returns the updated row.
+
+    Fields outside EDITABLE_FIELDS are rejected with None, like a missing lead.
+    """
+    if field not in EDITABLE_FIELDS:
+        logger.warning(f"Rejected edit of lead {lead_id} field {field!r}")
+        return None
+    row = await store.update_lead(lead_id, user_id, {field: value})
+    if row:
+        status_events.record(lead_id, user_id, "edit", field, row["updated_at"])
+    return _written(lead_id, row)
 
 
+@timed
 async def get_leads_by_status(user_id: int, status: Optional[str] = None) -> list[dict]:
     """Get user's leads, optionally filtered by status."""
-    query = supabase.table("leads").select("*").eq("user_id", user_id)
+    return await store.leads_by_status(user_id, status)
+
+
+@timed
+async def get_leads_page(
+    user_id: int,
+    limit: int,
+    after: Optional[tuple] = None,
+    before: Optional[tuple] = None,
+    offset: int = 0
+) -> list[dict]:
+    """Get one page of user's leads for the list view.
+
+    Leads are ordered by status (STATUS_ORDER), then most recently updated.
+    after/before are (status_rank, updated_at, id) cursors taken from the
+    last/first row of the neighbouring page; without a cursor, offset is used.
+    """
+    return await store.leads_page(user_id, limit, after, before, offset)
 
-    if status:
-        query = query.eq("status", status)
 
-    result = query.order("updated_at", desc=True).execute()
-    return result.data
+@timed
+async def get_hot_leads(user_id: int, limit: int) -> list[dict]:
+    """Get user's hot leads for the top of the list view."""
+    return await store.hot_leads(user_id, limit)
 
 
-async def search_leads(user_id: int, query: str) -> list[dict]:
-    """Search user's leads by brand or contact name."""
-    search_pattern = f"%{query}%"
+@timed
+async def count_leads(user_id: int) -> int:
+    """Count user's leads without fetching any rows."""
+    return await store.count_leads(user_id)
 
-    result = supabase.table("leads")\
-        .select("*")\
-        .eq("user_id", user_id)\
-        .or_(f"brand.ilike.{search_pattern},contact_name.ilike.{search_pattern},contact_username.ilike.{search_pattern}")\
-        .order("updated_at", desc=True)\
-        .execute()
 
-    return result.data
+@timed
+async def search_leads(user_id: int, query: str, limit: int = SEARCH_LIMIT) -> list[dict]:
+    """Search user's leads and their original messages, best matches first."""
+    return await store.search(user_id, query, limit)
 
 
+@timed
 async def get_recent_lead_by_contact(
     user_id: int,
     contact_telegram_id: Optional[int],
     contact_name: Optional[str],
     minutes: int = 30
 ) -> Optional[dict]:
-    """Find recent lead from same contact within time window (for this user)."""
+    """Find recent lead from same contact within time window (for this user).
+
+    With Supabase, answered from the in-process recent_contacts index once it
+    is warm; only the matching lead row is read (usually from lead_cache).
+    """
+    if recent_contacts.ready and minutes * 60 <= recent_contacts.window:
+        lead_id = recent_contacts.lookup(user_id, contact_telegram_id, contact_name)
+        return await get_lead(lead_id, user_id) if lead_id else None
+
     cutoff_time = (datetime.utcnow() - timedelta(minutes=minutes)).isoformat()
+    return await store.recent_lead(user_id, contact_telegram_id, contact_name, cutoff_time)
+
+
+@timed
+async def warm_recent_contacts() -> int:
+    """Load leads updated inside the same-lead window into recent_contacts (all users).
+
+    Local backends stay cold: their indexed lookup reads the shared file, which
+    also sees leads written by the importer and other processes.
+    """
+    if STORAGE_BACKEND != "supabase":
+        return 0
+    cutoff_time = (datetime.utcnow() - timedelta(seconds=recent_contacts.window)).isoformat()
+    rows = await store.recent_leads(cutoff_time)
+    return recent_contacts.load((row, _timestamp(row["updated_at"])) for row in rows)
 
-    if contact_telegram_id:
-        result = supabase.table("leads")\
-            .select("*")\
-            .eq("user_id", user_id)\
-            .eq("contact_telegram_id", contact_telegram_id)\
-            .gte("updated_at", cutoff_time)\
-            .order("updated_at", desc=True)\
-            .limit(1)\
-            .execute()
-    elif contact_name:
-        result = supabase.table("leads")\
-            .select("*")\
-            .eq("user_id", user_id)\
-            .eq("contact_name", contact_name)\
-            .gte("updated_at", cutoff_time)\
-            .order("updated_at", desc=True)\
-            .limit(1)\
-            .execute()
-    else:
-        return None
 
-    return result.data[0] if result.data else None
+def _timestamp(value: str) -> float:
+    """Epoch seconds for a timestamptz string (naive values are UTC)."""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
 
 
+@timed
 async def get_stats(user_id: int) -> dict:
     """Get conversion statistics for user."""
-    leads_result = supabase.table("leads")\
-        .select("status")\
-        .eq("user_id", user_id)\
-        .execute()
-
-    status_counts = {}
-    for lead in leads_result.data:
-        status = lead["status"]
-        status_counts[status] = status_counts.get(status, 0) + 1
-
-    total_leads = len(leads_result.data)
-
-    # Get message count for user's leads
-    leads_ids = supabase.table("leads")\
-        .select("id")\
-        .eq("user_id", user_id)\
-        .execute()
-
-    total_messages = 0
-    if leads_ids.data:
-        lead_ids_list = [l["id"] for l in leads_ids.data]
-        for lid in lead_ids_list:
-            msg_result = supabase.table("lead_messages")\
-                .select("id", count="exact")\
-                .eq("lead_id", lid)\
-                .execute()
-            total_messages += msg_result.count or 0
-
-    return {
-        "total_leads": total_leads,
-        "total_messages": total_messages,
-        "by_status": status_counts
-    }
+    return await store.stats(user_id)
+
+
+@timed
+async def get_export_chunk(user_id: int, after_id: int, limit: int) -> list[dict]:
+    """Next `limit` of user's leads by id (keyset after after_id), each with its "messages" list."""
+    return await store.export_chunk(user_id, after_id, limit)
+
+
+@timed
+async def get_funnel_stats(user_id: int) -> dict:
+    """Stage timing, transitions and weekly cohorts from user's status history (see app.services.funnel)."""
+    # Include events still waiting in the batch, e.g. a status changed just before /stats
+    await status_events.flush()
+    history = await store.status_history(user_id)
+    return funnel_stats(history, time.time(), FUNNEL_COHORT_WEEKS)
 
 
+@timed
 async def get_all_messages_text(lead_id: int) -> str:
     """Get all messages combined as text for re-parsing."""
     messages = await get_lead_messages(lead_id)
@@ -0,0 +1,176 @@
+"""Background queue for AI enrichment of leads that were saved with raw messages."""
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+from app.services.state_store import StateStore
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+jobs_pending = metrics.gauge("crm_enrichment_jobs_pending", "Enrichment jobs queued or running")
+jobs_done = metrics.counter("crm_enrichment_jobs_total", "Finished enrichment jobs by outcome")
+job_wait = metrics.histogram("crm_enrichment_wait_seconds", "Time from submit until a job starts")
+job_duration = metrics.histogram("crm_enrichment_duration_seconds", "Time spent running a job")
+
+
+class EnrichmentQueue:
+    """Runs per-lead jobs on a fixed number of workers.
+
+    Jobs for the same lead run one at a time in submit order; different leads
+    run in parallel up to `concurrency`. With a StateStore every job is persisted
+    until it finishes, so jobs interrupted by a restart run again after restore().
+
+    A job that raises is retried up to `max_attempts` times, `retry_delay`
+    seconds later and doubling; the lead's later jobs wait for it. When the
+    last attempt fails, on_give_up(lead_id, job) is called.
+    """
+
+    namespace = "enrichment"
+
+    def __init__(
+        self,
+        handler: Callable[[int, dict], Awaitable[None]],
+        concurrency: int,
+        store: Optional[StateStore] = None,
+        max_attempts: int = 1,
+        retry_delay: float = 5.0,
+        on_give_up: Optional[Callable[[int, dict], Awaitable[None]]] = None
+    ):
+        self.handler = handler
+        self.concurrency = concurrency
+        self.store = store
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.on_give_up = on_give_up
+
+        # lead_id -> deque of (seq, job, submitted_at); a lead is in _ready at most once
+        self._jobs: dict[int, deque] = {}
+        self._ready: asyncio.Queue[int] = asyncio.Queue()
+        self._running: set[int] = set()
+        self._seq = itertools.count()
+        self._workers: list[asyncio.Task] = []
+        self._retries: set[asyncio.TimerHandle] = set()
+        self._pending = 0
+
+        jobs_pending.fn = lambda: self._pending
+
+    def __len__(self) -> int:
+        return self._pending
+
+    def start(self):
+        """Spawn the worker tasks (needs a running loop)."""
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        # Jobs waiting for a retry stay persisted and run again after restore()
+        for handle in self._retries:
+            handle.cancel()
+        self._retries.clear()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, lead_id: int, job: dict):
+        """Queue a job for lead_id; it runs after any earlier job for the same lead."""
+        seq = next(self._seq)
+        if self.store is not None:
+            self.store.set(self.namespace, f"{lead_id}:{seq}", job)
+        self._enqueue(lead_id, seq, job)
+
+    def restore(self) -> int:
+        """Re-queue jobs persisted before a restart, in their original order."""
+        if self.store is None:
+            return 0
+
+        saved = []
+        for key, job in self.store.items(self.namespace):
+            lead_id, seq = key.split(":")
+            saved.append((int(seq), int(lead_id), key, job))
+        saved.sort()
+
+        # Renumber so new submits sort after restored jobs next time
+        for _, lead_id, key, job in saved:
+            self.store.delete(self.namespace, key)
+            self.submit(lead_id, job)
+        return len(saved)
+
+    def _enqueue(self, lead_id: int, seq: int, job: dict):
+        queue = self._jobs.get(lead_id)
+        if queue is None:
+            queue = self._jobs[lead_id] = deque()
+            if lead_id not in self._running:
+                self._ready.put_nowait(lead_id)
+        queue.append((seq, job, time.monotonic()))
+        self._pending += 1
+
+    async def _worker(self):
+        while True:
+            lead_id = await self._ready.get()
+            queue = self._jobs[lead_id]
+            seq, job, submitted_at = queue.popleft()
+            if not queue:
+                del self._jobs[lead_id]
+
+            self._running.add(lead_id)
+            job_wait.observe(time.monotonic() - submitted_at)
+            started = time.monotonic()
+            attempt = job.get("attempt", 1)
+            failed = retry = False
+            try:
+                await self.handler(lead_id, job)
+                jobs_done.inc(outcome="ok")
+            except asyncio.CancelledError:
+                # Shutting down: the persisted job runs again after restore()
+                raise
+            except Exception:
+                failed = True
+                retry = attempt < self.max_attempts
+                jobs_done.inc(outcome="retry" if retry else "error")
+                logger.exception(
+                    f"Enrichment job {job.get('kind')} failed for lead {lead_id} (attempt {attempt}/{self.max_attempts})"
+                )
+            finally:
+                job_duration.observe(time.monotonic() - started)
+                if not retry:
+                    self._running.discard(lead_id)
+                    self._pending -= 1
+
+            if retry:
+                # The lead stays "running" so its later jobs keep waiting behind this one
+                self._schedule_retry(lead_id, seq, {**job, "attempt": attempt + 1})
+                continue
+
+            if failed and self.on_give_up is not None:
+                try:
+                    await self.on_give_up(lead_id, job)
+                except Exception:
+                    logger.exception(f"Failed to clean up after enrichment job for lead {lead_id}")
+
+            if self.store is not None:
+                self.store.delete(self.namespace, f"{lead_id}:{seq}")
+
+            # Jobs submitted for this lead while it was running go back in line
+            if lead_id in self._jobs:
+                self._ready.put_nowait(lead_id)
+
+    def _schedule_retry(self, lead_id: int, seq: int, job: dict):
+        if self.store is not None:
+            self.store.set(self.namespace, f"{lead_id}:{seq}", job)
+        delay = self.retry_delay * 2 ** (job["attempt"] - 2)
+        loop = asyncio.get_running_loop()
+        handle = loop.call_later(delay, lambda: self._retry(handle, lead_id, seq, job))
+        self._retries.add(handle)
+
+    def _retry(self, handle: asyncio.TimerHandle, lead_id: int, seq: int, job: dict):
+        """Put a retried job back at the head of its lead's queue."""
+        self._retries.discard(handle)
+        self._running.discard(lead_id)
+        queue = self._jobs.setdefault(lead_id, deque())
+        queue.appendleft((seq, job, time.monotonic()))
+        self._ready.put_nowait(lead_id)
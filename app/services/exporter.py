@@ -0,0 +1,149 @@
+"""Export a user's leads with their original messages to CSV or XLSX.
+
+Leads are read EXPORT_CHUNK_SIZE at a time by id (keyset) and written as they
+arrive, one row per message, so memory does not grow with the number of leads.
+"""
+import asyncio
+import csv
+import logging
+import os
+import re
+from datetime import datetime, timezone
+
+from app.config import EXPORT_CHUNK_SIZE, STATUS_NAMES
+from app.services.database import get_export_chunk
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("csv", "xlsx")
+
+LEAD_COLUMNS = (
+    "lead_id", "status", "is_hot", "brand", "request", "dates",
+    "contact_name", "contact_username", "contact_telegram_id",
+    "message_count", "created_at", "updated_at"
+)
+MESSAGE_COLUMNS = ("message_id", "forward_date", "message_text")
+COLUMNS = LEAD_COLUMNS + MESSAGE_COLUMNS
+
+# Excel and LibreOffice evaluate cells starting with these as formulas
+FORMULA_PREFIXES = ("=", "+", "-", "@")
+
+XLSX_MAX_CELL_CHARS = 32767
+# Control characters XML (and so openpyxl) cannot store
+_XML_ILLEGAL = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+rows_exported = metrics.counter("crm_export_rows_total", "Rows written to lead exports by format")
+
+
+def lead_rows(lead: dict) -> list[tuple]:
+    """One row per message (a lead without messages still gets one row)."""
+    head = (
+        lead["id"], STATUS_NAMES.get(lead.get("status"), lead.get("status")), bool(lead.get("is_hot")),
+        lead.get("brand"), lead.get("request"), lead.get("dates"),
+        lead.get("contact_name"), lead.get("contact_username"), lead.get("contact_telegram_id"),
+        lead.get("message_count"), lead.get("created_at"), lead.get("updated_at")
+    )
+    messages = lead.get("messages") or [{}]
+    return [head + (m.get("id"), m.get("forward_date"), m.get("raw_text")) for m in messages]
+
+
+def _safe_text(value):
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+class CsvWriter:
+    def __init__(self, path: str):
+        # utf-8-sig: Excel detects the encoding (Cyrillic) from the BOM
+        self.file = open(path, "w", newline="", encoding="utf-8-sig")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(COLUMNS)
+
+    def write(self, rows: list[tuple]):
+        self.writer.writerows([tuple(_safe_text(value) for value in row) for row in rows])
+
+    def close(self):
+        self.file.close()
+
+    def abort(self):
+        self.file.close()
+
+
+class XlsxWriter:
+    """openpyxl in write-only mode: rows go to a temporary file, not a sheet kept in memory."""
+
+    def __init__(self, path: str):
+        try:
+            from openpyxl import Workbook
+        except ImportError:
+            raise RuntimeError('XLSX export needs openpyxl: pip install openpyxl') from None
+        self.path = path
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet("leads")
+        self.sheet.append(COLUMNS)
+
+    def write(self, rows: list[tuple]):
+        for row in rows:
+            self.sheet.append([self._cell(value) for value in row])
+
+    @staticmethod
+    def _cell(value):
+        if not isinstance(value, str):
+            return value
+        return _safe_text(_XML_ILLEGAL.sub("", value)[:XLSX_MAX_CELL_CHARS])
+
+    def close(self):
+        self.workbook.save(self.path)
+
+    def abort(self):
+        self.workbook.close()
+
+
+def open_writer(path: str, fmt: str):
+    if fmt == "csv":
+        return CsvWriter(path)
+    if fmt == "xlsx":
+        return XlsxWriter(path)
+    raise ValueError(f"Unknown export format {fmt!r} ({', '.join(FORMATS)})")
+
+
+def export_filename(user_id: int, fmt: str) -> str:
+    return f"leads_{user_id}_{datetime.now(timezone.utc):%Y-%m-%d_%H%M%S}.{fmt}"
+
+
+async def export_leads(user_id: int, path: str, fmt: str, chunk_size: int = EXPORT_CHUNK_SIZE) -> tuple[int, int]:
+    """Write all of user's leads to `path`; returns (leads, rows).
+
+    File writes run in a thread, so a large export does not stall other updates.
+    A failed export leaves no file behind.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    writer = await asyncio.to_thread(open_writer, path, fmt)
+    leads = rows = after_id = 0
+    try:
+        while True:
+            chunk = await get_export_chunk(user_id, after_id, chunk_size)
+            if not chunk:
+                break
+            chunk_rows = [row for lead in chunk for row in lead_rows(lead)]
+            await asyncio.to_thread(writer.write, chunk_rows)
+            leads += len(chunk)
+            rows += len(chunk_rows)
+            rows_exported.inc(len(chunk_rows), format=fmt)
+            after_id = chunk[-1]["id"]
+            if len(chunk) < chunk_size:
+                break
+        await asyncio.to_thread(writer.close)
+    except BaseException:
+        writer.abort()
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+
+    logger.info(f"Exported {leads} leads ({rows} rows) for user {user_id} to {path}")
+    return leads, rows
@@ -0,0 +1,120 @@
+"""Funnel timing for /stats, computed with NumPy over a user's status history.
+
+The input is columnar (lead_id, status, at) as returned by the stores'
+status_history(): one entry per lead creation ("new") and status change.
+A stay is the time between a lead entering a status and its next change;
+the last stay of each lead is still open.
+"""
+from itertools import repeat
+
+import numpy as np
+
+from app.config import STATUSES
+
+STAGES = list(STATUSES)  # Pipeline order, "new" first
+DAY = 24 * 3600
+WEEK = 7 * DAY
+# 1970-01-01 was a Thursday; shifting by three days makes weeks start on Monday
+WEEK_SHIFT = 3 * DAY
+
+_STAGE_INDEX = {status: i for i, status in enumerate(STAGES)}
+_CONTRACT = _STAGE_INDEX["contract"]
+_LOST = _STAGE_INDEX["lost"]
+
+
+def funnel_stats(history: dict, now: float, cohort_weeks: int) -> dict:
+    """Dwell-time percentiles per stage, transition counts and weekly cohort conversion.
+
+    Returns {"events", "stages": [{status, stays, p50, p90, open, open_p50}],
+    "transitions": [(from, to, count)] most frequent first,
+    "cohorts": [{week_start, leads, contract, lost}] oldest first}.
+    """
+    count = len(history["lead_id"])
+    codes = np.fromiter(map(_STAGE_INDEX.get, history["status"], repeat(-1)), dtype=np.int16, count=count)
+    lead_ids = np.asarray(history["lead_id"], dtype=np.int64)
+    times = np.asarray(history["at"], dtype=np.float64)
+
+    known = codes >= 0
+    codes, lead_ids, times = codes[known], lead_ids[known], times[known]
+
+    # By lead, then time; at equal times the creation ("new") comes first
+    order = np.lexsort((codes != 0, times, lead_ids))
+    codes, lead_ids, times = codes[order], lead_ids[order], times[order]
+
+    # Setting the status a lead already has does not start a new stay
+    starts = np.ones(codes.size, dtype=bool)
+    starts[1:] = lead_ids[1:] != lead_ids[:-1]
+    changed = starts.copy()
+    changed[1:] |= codes[1:] != codes[:-1]
+    codes, lead_ids, times = codes[changed], lead_ids[changed], times[changed]
+    starts = starts[changed]
+
+    # Stay i closes when event i + 1 belongs to the same lead
+    closed = ~starts[1:]
+    stay_codes = codes[:-1][closed]
+    next_codes = codes[1:][closed]
+    dwell = (times[1:] - times[:-1])[closed]
+
+    ends = np.ones(codes.size, dtype=bool)
+    ends[:-1] = starts[1:]
+    open_codes = codes[ends]
+    open_age = now - times[ends]
+
+    return {
+        "events": int(codes.size),
+        "stages": _stages(stay_codes, dwell, open_codes, open_age),
+        "transitions": _transitions(stay_codes, next_codes),
+        "cohorts": _cohorts(codes, times, starts, now, cohort_weeks)
+    }
+
+
+def _stages(stay_codes: np.ndarray, dwell: np.ndarray, open_codes: np.ndarray, open_age: np.ndarray) -> list[dict]:
+    stages = []
+    for i, status in enumerate(STAGES):
+        stays = dwell[stay_codes == i]
+        ages = open_age[open_codes == i]
+        p50, p90 = np.percentile(stays, (50, 90)) if stays.size else (None, None)
+        stages.append({
+            "status": status,
+            "stays": int(stays.size),
+            "p50": None if p50 is None else float(p50),
+            "p90": None if p90 is None else float(p90),
+            "open": int(ages.size),
+            "open_p50": float(np.median(ages)) if ages.size else None
+        })
+    return stages
+
+
+def _transitions(stay_codes: np.ndarray, next_codes: np.ndarray) -> list[tuple[str, str, int]]:
+    n = len(STAGES)
+    matrix = np.bincount(stay_codes.astype(np.int64) * n + next_codes, minlength=n * n).reshape(n, n)
+    nonzero = np.flatnonzero(matrix)
+    ranked = nonzero[np.argsort(-matrix.flat[nonzero], kind="stable")]
+    return [(STAGES[k // n], STAGES[k % n], int(matrix.flat[k])) for k in ranked]
+
+
+def _cohorts(codes: np.ndarray, times: np.ndarray, starts: np.ndarray, now: float, weeks: int) -> list[dict]:
+    """Leads by the week they were created, and how many of them ever reached contract / lost."""
+    if not codes.size:
+        return []
+    first = np.flatnonzero(starts)
+    reached_contract = np.maximum.reduceat((codes == _CONTRACT).astype(np.int8), first)
+    reached_lost = np.maximum.reduceat((codes == _LOST).astype(np.int8), first)
+
+    current = int((now + WEEK_SHIFT) // WEEK)
+    offset = current - np.floor((times[first] + WEEK_SHIFT) / WEEK).astype(np.int64)
+    recent = (offset >= 0) & (offset < weeks)
+    slot = weeks - 1 - offset[recent]
+
+    leads = np.bincount(slot, minlength=weeks)
+    contract = np.bincount(slot, weights=reached_contract[recent], minlength=weeks)
+    lost = np.bincount(slot, weights=reached_lost[recent], minlength=weeks)
+    return [
+        {
+            "week_start": float((current - (weeks - 1 - i)) * WEEK - WEEK_SHIFT),
+            "leads": int(leads[i]),
+            "contract": int(contract[i]),
+            "lost": int(lost[i])
+        }
+        for i in range(weeks)
+    ]
@@ -0,0 +1,239 @@
+"""Rule-based lead field extraction that runs before the LLM."""
+import re
+from typing import Optional
+
+# Fields at or above this confidence are trusted without asking the LLM
+CONFIDENCE_THRESHOLD = 0.8
+
+# Guesses (an unknown domain's label, a capitalized word after "компания") stay
+# below the threshold, so the LLM still gets the last word on them
+GUESS_CONFIDENCE = 0.6
+
+# Known domains -> brand names; other domains fall back to their capitalized label
+DOMAIN_BRANDS = {
+    "ozon.ru": "Ozon",
+    "wildberries.ru": "Wildberries",
+    "wb.ru": "Wildberries",
+    "lamoda.ru": "Lamoda",
+    "yandex.ru": "Яндекс",
+    "ya.ru": "Яндекс",
+    "market.yandex.ru": "Яндекс Маркет",
+    "sber.ru": "Сбер",
+    "sberbank.ru": "Сбер",
+    "tbank.ru": "Т-Банк",
+    "tinkoff.ru": "Т-Банк",
+    "alfabank.ru": "Альфа-Банк",
+    "vtb.ru": "ВТБ",
+    "mts.ru": "МТС",
+    "megafon.ru": "МегаФон",
+    "beeline.ru": "Билайн",
+    "skillbox.ru": "Skillbox",
+    "geekbrains.ru": "GeekBrains",
+    "netology.ru": "Нетология",
+    "skyeng.ru": "Skyeng",
+    "litres.ru": "Литрес",
+    "kinopoisk.ru": "Кинопоиск",
+    "ivi.ru": "ivi",
+    "okko.tv": "Okko",
+    "samokat.ru": "Самокат",
+    "vkusvill.ru": "ВкусВилл",
+    "perekrestok.ru": "Перекрёсток",
+    "goldapple.ru": "Золотое Яблоко",
+    "letu.ru": "Л'Этуаль",
+    "aviasales.ru": "Aviasales",
+    "avito.ru": "Авито",
+    "hh.ru": "hh.ru",
+}
+KNOWN_BRANDS = set(DOMAIN_BRANDS.values())
+
+# Links that say nothing about the brand (social networks, forms, shorteners)
+GENERIC_DOMAINS = {
+    "t.me", "telegram.me", "telegram.org", "instagram.com", "youtube.com", "youtu.be",
+    "vk.com", "vk.ru", "tiktok.com", "facebook.com", "twitter.com", "x.com",
+    "google.com", "docs.google.com", "drive.google.com", "forms.gle", "disk.yandex.ru",
+    "bit.ly", "clck.ru", "taplink.cc", "linktr.ee", "wa.me", "mail.ru", "gmail.com",
+}
+
+MONTH = (
+    r"(?:январ[ьяе]|феврал[ьяе]|март[ае]?|апрел[ьяе]|ма[йяе]|июн[ьяе]|июл[ьяе]|"
+    r"август[ае]?|сентябр[ьяе]|октябр[ьяе]|ноябр[ьяе]|декабр[ьяе])"
+)
+PREFIX = r"(?:(?:до|с|к|по|от)\s+)?"
+
+DATE_PATTERNS = [
+    # до 15 марта, 10-15 марта 2026, с 1 по 7 июня
+    re.compile(
+        PREFIX + r"\b\d{1,2}(?:\s*[-–—]\s*\d{1,2}|\s+по\s+\d{1,2})?\s+" + MONTH + r"(?:\s+\d{4})?\b",
+        re.IGNORECASE
+    ),
+    # 12.02.2026, 12.02.26, до 12.02, 12/02/2026
+    re.compile(PREFIX + r"\b(\d{1,2})[./](\d{2})(?:[./](\d{4}|\d{2}))?\b", re.IGNORECASE),
+    # 2026-02-12
+    re.compile(r"\b\d{4}-\d{2}-\d{2}\b"),
+    # в марте, в конце мая
+    re.compile(r"\bв\s+(?:(?:начале|середине|конце)\s+)?" + MONTH + r"\b", re.IGNORECASE),
+    # Q1, 2 квартал
+    re.compile(r"\b(?:Q[1-4]|[1-4]\s*(?:-?й)?\s*квартал[еа]?)\b", re.IGNORECASE),
+]
+
+# Numbers that look like dd.mm but are not dates: "версия 2.10", "12.50 руб"
+VERSION_BEFORE_RE = re.compile(r"\b(?:верси[яиюей]|релиз|сборк[аиуе]|обновлени[еяю]|v|ver|build)\.?\s*$", re.IGNORECASE)
+NUMBER_AFTER_RE = re.compile(r"[.,]\d|\s*(?:%|₽|\$|€|руб|р\.|тыс|млн|[кk]\b)", re.IGNORECASE)
+
+# Vague timing the rules cannot pin down; leave these to the LLM
+RELATIVE_DATE_RE = re.compile(
+    r"\b(?:завтра|послезавтра|недел[юияе]|месяц[ае]?|скоро|сезон|праздник|выходны[хе])\b",
+    re.IGNORECASE
+)
+
+# Not preceded by "@": the domain of an e-mail address is usually an agency or a mail host
+URL_RE = re.compile(
+    r"(?<![\w@.-])(?:https?://)?(?:www\.)?((?:[a-z0-9-]+\.)+(?:ru|com|io|store|shop|net|org|app|tv|co|me|pro|online|рф))\b",
+    re.IGNORECASE
+)
+QUOTED_BRAND_RE = re.compile(
+    r"(?:бренд|компани|магазин|сервис|проект|марк)[а-яё]*\s+[«\"“]([^»\"”\n]{2,40})[»\"”]",
+    re.IGNORECASE
+)
+NAMED_BRAND_RE = re.compile(
+    r"(?i:бренд|компани|магазин|сервис)(?i:[а-яё]*)\s+([A-ZА-ЯЁ][\w&'’-]+(?:\s+[A-ZА-ЯЁ][\w&'’-]+)?)"
+)
+MENTION_RE = re.compile(r"(?<![\w@])@([A-Za-z][A-Za-z0-9_]{4,31})\b")
+# Suffixes that mark a brand account rather than a person's
+BRAND_ACCOUNT_RE = re.compile(r"[_]?(official|shop|store|brand|russia|ru|team)$", re.IGNORECASE)
+INTRO_NAME_RE = re.compile(
+    r"\b(?i:меня зовут|на связи)\s+([А-ЯЁA-Z][а-яёa-z]+(?:\s+[А-ЯЁA-Z][а-яёa-z]+)?)"
+)
+
+FORMATS = [
+    (re.compile(r"интеграц", re.IGNORECASE), "Интеграция"),
+    (re.compile(r"обзор", re.IGNORECASE), "Обзор"),
+    (re.compile(r"коллаб", re.IGNORECASE), "Коллаборация"),
+    (re.compile(r"бартер", re.IGNORECASE), "Бартер"),
+    (re.compile(r"амбассадор", re.IGNORECASE), "Амбассадорство"),
+    (re.compile(r"реклам", re.IGNORECASE), "Реклама"),
+]
+PLACEMENTS = [
+    (re.compile(r"\b(?:reels|рилс)", re.IGNORECASE), "Reels"),
+    (re.compile(r"\b(?:stories|сторис|историях)", re.IGNORECASE), "Stories"),
+    (re.compile(r"\b(?:youtube|ютуб)", re.IGNORECASE), "YouTube"),
+    (re.compile(r"\b(?:shorts|шортс)", re.IGNORECASE), "Shorts"),
+    (re.compile(r"\b(?:tiktok|тикток)", re.IGNORECASE), "TikTok"),
+    (re.compile(r"\b(?:telegram|телеграм|тг[- ]канал)", re.IGNORECASE), "Telegram"),
+    (re.compile(r"\b(?:пост|публикац)", re.IGNORECASE), "пост"),
+]
+
+
+def extract_fields(text: str, contact_hint: Optional[str] = None) -> dict[str, tuple[Optional[str], float]]:
+    """Extract brand/request/contact/dates as (value, confidence) pairs."""
+    return {
+        "brand": _brand(text),
+        "request": _request(text),
+        "contact": _contact(text, contact_hint),
+        "dates": _dates(text),
+    }
+
+
+def is_confident(fields: dict[str, tuple[Optional[str], float]], threshold: float = CONFIDENCE_THRESHOLD) -> bool:
+    """True if every field is trusted enough to skip the LLM."""
+    return all(confidence >= threshold for _, confidence in fields.values())
+
+
+def _brand(text: str) -> tuple[Optional[str], float]:
+    match = QUOTED_BRAND_RE.search(text)
+    if match:
+        return match.group(1).strip(), 0.9
+
+    for match in URL_RE.finditer(text):
+        domain = match.group(1).lower()
+        if domain in GENERIC_DOMAINS or any(domain.endswith("." + g) for g in GENERIC_DOMAINS):
+            continue
+        if domain in DOMAIN_BRANDS:
+            return DOMAIN_BRANDS[domain], 0.95
+        # Strip subdomains we know (shop.brand.ru -> brand.ru)
+        parts = domain.split(".")
+        root = ".".join(parts[-2:])
+        if root in DOMAIN_BRANDS:
+            return DOMAIN_BRANDS[root], 0.9
+        return parts[-2].capitalize(), GUESS_CONFIDENCE
+
+    match = NAMED_BRAND_RE.search(text)
+    if match:
+        name = match.group(1).strip()
+        return name, 0.9 if name in KNOWN_BRANDS else GUESS_CONFIDENCE
+
+    # @brand_official is a brand account; a bare @name may just be the manager
+    for match in MENTION_RE.finditer(text):
+        username = match.group(1)
+        stripped = BRAND_ACCOUNT_RE.sub("", username)
+        if stripped and stripped != username:
+            return stripped.replace("_", " ").title(), 0.7
+    match = MENTION_RE.search(text)
+    if match:
+        return match.group(1).replace("_", " ").title(), 0.5
+
+    return None, 0.0
+
+
+def _request(text: str) -> tuple[Optional[str], float]:
+    fmt = next((name for pattern, name in FORMATS if pattern.search(text)), None)
+    placement = next((name for pattern, name in PLACEMENTS if pattern.search(text)), None)
+
+    if fmt and placement:
+        return f"{fmt} в {placement}", 0.8
+    if fmt:
+        return fmt, 0.6
+    if placement:
+        return f"Реклама в {placement}", 0.5
+    return None, 0.0
+
+
+def _contact(text: str, contact_hint: Optional[str]) -> tuple[Optional[str], float]:
+    match = INTRO_NAME_RE.search(text)
+    if match:
+        return match.group(1), 0.9
+    if contact_hint:
+        return contact_hint, 0.85
+    return None, 0.0
+
+
+def _dates(text: str) -> tuple[Optional[str], float]:
+    spans, rejected = [], False
+    for pattern in DATE_PATTERNS:
+        for match in pattern.finditer(text):
+            if pattern is DATE_PATTERNS[1] and not _valid_numeric_date(match, text):
+                rejected = True
+                continue
+            spans.append((match.start(), match.end()))
+
+    # Keep the longest match where patterns overlap, in text order
+    spans.sort(key=lambda span: (span[0], -(span[1] - span[0])))
+    found, last_end = [], -1
+    for start, end in spans:
+        if start >= last_end:
+            found.append(text[start:end].strip())
+            last_end = end
+
+    if found:
+        return ", ".join(dict.fromkeys(found)), 0.9
+    if RELATIVE_DATE_RE.search(text):
+        return None, 0.3
+    if rejected:
+        # "5.03" or "2.10" could still be a date
+        return None, 0.5
+    # No date-like tokens at all: "no dates" is a safe answer
+    return None, 0.85
+
+
+def _valid_numeric_date(match: re.Match, text: str) -> bool:
+    """dd.mm with a plausible day and month that is not a version number, price or decimal.
+
+    Without a year or a preposition ("до 5.03") both parts must have two digits.
+    """
+    day, month = int(match.group(1)), int(match.group(2))
+    if not (1 <= day <= 31 and 1 <= month <= 12):
+        return False
+    if VERSION_BEFORE_RE.search(text, 0, match.start()) or NUMBER_AFTER_RE.match(text, match.end()):
+        return False
+    has_prefix = match.group(0)[0].isalpha()
+    return bool(match.group(3)) or has_prefix or len(match.group(1)) == 2
@@ -0,0 +1,148 @@
+"""In-process cache for lead rows and message lists."""
+import itertools
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from app.utils import metrics
+
+lookups = metrics.counter("crm_lead_cache_lookups_total", "Lead cache lookups by kind (lead/messages) and result")
+cached_leads = metrics.gauge("crm_lead_cache_leads", "Lead rows held by the lead cache")
+cached_message_lists = metrics.gauge("crm_lead_cache_message_lists", "Message lists held by the lead cache")
+
+
+class LeadCache:
+    """Per-user LRU of lead rows plus a shared LRU of message lists, both with a TTL.
+
+    Size is bounded by entry counts: at most `max_users` users with
+    `max_leads_per_user` rows each, and `max_message_lists` message lists.
+    Reads started before a write to the same lead are not stored (see begin()),
+    so a slow SELECT cannot put an older row back after a mutation.
+    """
+
+    def __init__(self, max_users: int, max_leads_per_user: int, max_message_lists: int, ttl_seconds: float):
+        self.max_users = max_users
+        self.max_leads_per_user = max_leads_per_user
+        self.max_message_lists = max_message_lists
+        self.ttl_seconds = ttl_seconds
+
+        self._leads: OrderedDict[int, OrderedDict[int, tuple[float, dict]]] = OrderedDict()
+        self._messages: OrderedDict[int, tuple[float, list]] = OrderedDict()
+        # lead_id -> sequence number of its last write, so reads older than a write are not stored
+        self._written: OrderedDict[int, int] = OrderedDict()
+        self._written_floor = 0  # last write dropped from _written; older reads are refused for any lead
+        self._seq = itertools.count(1)
+        self._lead_count = 0
+
+        cached_leads.fn = lambda: self._lead_count
+        cached_message_lists.fn = lambda: len(self._messages)
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0
+
+    def begin(self) -> int:
+        """Token to pass to put_*() after a read, marking when the read started."""
+        return next(self._seq)
+
+    def get_lead(self, user_id: int, lead_id: int) -> Optional[dict]:
+        user = self._leads.get(user_id)
+        entry = user.get(lead_id) if user is not None else None
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                self._drop_lead(user_id, lead_id)
+            lookups.inc(kind="lead", result="miss")
+            return None
+
+        user.move_to_end(lead_id)
+        self._leads.move_to_end(user_id)
+        lookups.inc(kind="lead", result="hit")
+        return dict(entry[1])
+
+    def put_lead(self, row: dict, token: Optional[int] = None):
+        """Store a row (write-through when token is None, read-through otherwise)."""
+        if not self.enabled or row.get("user_id") is None:
+            return
+        lead_id, user_id = row["id"], row["user_id"]
+        if token is None:
+            self._mark_written(lead_id)
+        elif self._written_after(lead_id, token):
+            return
+
+        user = self._leads.get(user_id)
+        if user is None:
+            user = self._leads[user_id] = OrderedDict()
+        if lead_id not in user:
+            self._lead_count += 1
+        user[lead_id] = (time.monotonic() + self.ttl_seconds, dict(row))
+        user.move_to_end(lead_id)
+        self._leads.move_to_end(user_id)
+
+        if len(user) > self.max_leads_per_user:
+            user.popitem(last=False)
+            self._lead_count -= 1
+        while len(self._leads) > self.max_users:
+            _, evicted = self._leads.popitem(last=False)
+            self._lead_count -= len(evicted)
+
+    def get_messages(self, lead_id: int) -> Optional[list]:
+        entry = self._messages.get(lead_id)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._messages[lead_id]
+            lookups.inc(kind="messages", result="miss")
+            return None
+
+        self._messages.move_to_end(lead_id)
+        lookups.inc(kind="messages", result="hit")
+        return list(entry[1])
+
+    def put_messages(self, lead_id: int, messages: list, token: int):
+        if not self.enabled or self._written_after(lead_id, token):
+            return
+        self._messages[lead_id] = (time.monotonic() + self.ttl_seconds, list(messages))
+        self._messages.move_to_end(lead_id)
+        while len(self._messages) > self.max_message_lists:
+            self._messages.popitem(last=False)
+
+    def invalidate(self, lead_id: int, user_id: Optional[int] = None):
+        """Forget a lead's row and messages after a write not covered by put_lead()."""
+        self._mark_written(lead_id)
+        self._messages.pop(lead_id, None)
+        if user_id is not None:
+            self._drop_lead(user_id, lead_id)
+        else:
+            for user in list(self._leads):
+                self._drop_lead(user, lead_id)
+
+    def clear(self):
+        self._leads.clear()
+        self._messages.clear()
+        self._lead_count = 0
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "lead_hits": lookups.get(kind="lead", result="hit"),
+            "lead_misses": lookups.get(kind="lead", result="miss"),
+            "messages_hits": lookups.get(kind="messages", result="hit"),
+            "messages_misses": lookups.get(kind="messages", result="miss"),
+            "leads": self._lead_count,
+            "message_lists": len(self._messages),
+        }
+
+    def _drop_lead(self, user_id: int, lead_id: int):
+        user = self._leads.get(user_id)
+        if user is not None and user.pop(lead_id, None) is not None:
+            self._lead_count -= 1
+            if not user:
+                del self._leads[user_id]
+
+    def _written_after(self, lead_id: int, token: int) -> bool:
+        return self._written.get(lead_id, self._written_floor) > token
+
+    def _mark_written(self, lead_id: int):
+        self._written[lead_id] = next(self._seq)
+        self._written.move_to_end(lead_id)
+        while len(self._written) > self.max_message_lists:
+            _, self._written_floor = self._written.popitem(last=False)
@@ -0,0 +1,92 @@
+"""Append-only lead history (lead_status_events), written in batches."""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+events_written = metrics.counter("crm_status_events_total", "Lead history events by outcome")
+events_pending = metrics.gauge("crm_status_events_pending", "Lead history events not yet written")
+
+
+class LeadEventLog:
+    """Buffers event rows and writes them with one insert per `flush_interval`.
+
+    Mutators only append to a list; a flush starts `flush_interval` after the
+    first buffered event, or at once when `batch_size` are waiting. Rows from a
+    failed write go back to the buffer (the oldest are dropped past
+    `max_pending`), so losing the database for a while loses no history.
+    """
+
+    def __init__(
+        self,
+        write: Callable[[list[dict]], Awaitable[None]],
+        flush_interval: float,
+        batch_size: int,
+        max_pending: int
+    ):
+        self.write = write
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self._pending: list[dict] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+        events_pending.fn = lambda: len(self._pending)
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def record(self, lead_id: int, user_id: int, kind: str, value: Optional[str], at: str):
+        """Queue one event; `at` is the lead's updated_at after the change."""
+        self._pending.append({"lead_id": lead_id, "user_id": user_id, "kind": kind, "value": value, "created_at": at})
+        if len(self._pending) >= self.batch_size:
+            self._cancel_timer()
+            self._start_flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.flush_interval, self._start_flush)
+
+    def _cancel_timer(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+    def _start_flush(self):
+        self._flush_handle = None
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self.flush())
+
+    async def flush(self):
+        """Write everything buffered so far (batch_size rows per insert)."""
+        async with self._lock:
+            while self._pending:
+                batch, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+                try:
+                    await self.write(batch)
+                except Exception as e:
+                    events_written.inc(len(batch), outcome="retry")
+                    self._pending = batch + self._pending
+                    dropped = len(self._pending) - self.max_pending
+                    if dropped > 0:
+                        events_written.inc(dropped, outcome="dropped")
+                        del self._pending[:dropped]
+                    logger.warning(f"Failed to write {len(batch)} lead history events ({e}), will retry")
+                    if self._flush_handle is None:
+                        self._flush_handle = asyncio.get_running_loop().call_later(
+                            self.flush_interval, self._start_flush
+                        )
+                    return
+                events_written.inc(len(batch), outcome="ok")
+
+    async def close(self):
+        """Write what is buffered (best effort)."""
+        self._cancel_timer()
+        if self._flush_task is not None:
+            await self._flush_task
+        await self.flush()
+        if self._pending:
+            logger.warning(f"{len(self._pending)} lead history events were not written")
@@ -0,0 +1,245 @@
+"""Execution layer for LLM calls: concurrency limits, pacing, retries, circuit breaker."""
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import openai
+
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS = {408, 409, 429}
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 20.0
+
+queue_wait = metrics.histogram("crm_llm_queue_wait_seconds", "Time LLM calls wait for a slot and rate budget")
+latency = metrics.histogram("crm_llm_latency_seconds", "LLM request latency per attempt")
+requests = metrics.counter("crm_llm_requests_total", "LLM attempts by outcome")
+in_flight = metrics.gauge("crm_llm_in_flight", "LLM requests currently running")
+
+
+class LLMUnavailableError(Exception):
+    """The LLM cannot be used right now; callers should fall back."""
+
+
+class CircuitOpenError(LLMUnavailableError):
+    """The circuit breaker is open."""
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at `rate` tokens per second."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float = 1):
+        """Wait until `amount` tokens are available and take them (FIFO)."""
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self._tokens < amount:
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= amount
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures; lets one probe through after `reset_timeout`.
+
+    Only outages count as failures: calls that ran out of retries on
+    timeouts, connection errors, 429 or 5xx responses.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def end_probe(self):
+        """The probe call ended; without a recorded outcome the next caller probes again."""
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.warning(f"LLM circuit breaker open after {self.failures} failures")
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+
+class LLMRunner:
+    """Runs LLM calls under global and per-user limits, RPM/TPM pacing and retries."""
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        per_user_concurrency: int,
+        rpm: float,
+        tpm: float,
+        max_retries: int,
+        breaker: CircuitBreaker
+    ):
+        self.per_user_concurrency = per_user_concurrency
+        self.max_retries = max_retries
+        self.breaker = breaker
+        self._global = asyncio.Semaphore(max_concurrency)
+        self._per_user: dict[int, list] = {}  # user_id -> [semaphore, users]
+        self._requests = TokenBucket(rpm / 60, max(1.0, rpm / 60))
+        # A full minute of tokens: long threads are charged their whole estimate, not one second's worth
+        self._tokens = TokenBucket(tpm / 60, tpm)
+        self._in_flight = 0
+        in_flight.fn = lambda: self._in_flight
+
+    async def run(self, call: Callable[[], Awaitable[T]], user_id: Optional[int] = None, tokens: int = 1000) -> T:
+        """Run call() with limits and retries. Raises LLMUnavailableError when it should fall back."""
+        probe = self.breaker.state == "half_open"
+        if not self.breaker.allow():
+            requests.inc(outcome="circuit_open")
+            raise CircuitOpenError("LLM circuit breaker is open")
+
+        try:
+            return await self._run(call, user_id, tokens)
+        finally:
+            # A cancelled probe must not leave the breaker waiting for it forever
+            if probe:
+                self.breaker.end_probe()
+
+    async def _run(self, call: Callable[[], Awaitable[T]], user_id: Optional[int], tokens: int) -> T:
+        attempt = 0
+        while True:
+            try:
+                result = await self._attempt(call, user_id, tokens)
+            except Exception as e:
+                retry_after = self._retry_after(e)
+                if retry_after is None:
+                    # A bad request (context length, auth) says nothing about the service being down
+                    requests.inc(outcome="error")
+                    raise
+
+                attempt += 1
+                if attempt > self.max_retries:
+                    requests.inc(outcome="exhausted")
+                    self.breaker.record_failure()
+                    raise LLMUnavailableError(f"LLM failed after {attempt} attempts: {e}") from e
+
+                requests.inc(outcome="retry")
+                delay = max(retry_after, random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt)))
+                logger.info(f"LLM call failed ({e.__class__.__name__}), retry {attempt} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            requests.inc(outcome="ok")
+            self.breaker.record_success()
+            return result
+
+    async def _attempt(self, call: Callable[[], Awaitable[T]], user_id: Optional[int], tokens: int) -> T:
+        queued_at = time.monotonic()
+        async with self._user_slot(user_id), self._global:
+            await self._requests.acquire()
+            await self._tokens.acquire(tokens)
+            queue_wait.observe(time.monotonic() - queued_at)
+
+            started = time.monotonic()
+            self._in_flight += 1
+            try:
+                return await call()
+            finally:
+                self._in_flight -= 1
+                latency.observe(time.monotonic() - started)
+
+    def _user_slot(self, user_id: Optional[int]):
+        if user_id is None:
+            return _NullSlot()
+        return _UserSlot(self, user_id)
+
+    @staticmethod
+    def _retry_after(error: Exception) -> Optional[float]:
+        """Seconds to wait before retrying, or None if the error is not retryable."""
+        if isinstance(error, openai.APIConnectionError):
+            return 0.0
+        if isinstance(error, openai.APIStatusError):
+            if error.status_code in RETRYABLE_STATUS or error.status_code >= 500:
+                header = error.response.headers.get("retry-after")
+                try:
+                    return float(header) if header else 0.0
+                except ValueError:
+                    return 0.0
+        return None
+
+
+class _NullSlot:
+    async def __aenter__(self):
+        return None
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class _UserSlot:
+    """Per-user semaphore that is dropped once no call for the user is pending."""
+
+    def __init__(self, runner: LLMRunner, user_id: int):
+        self.runner = runner
+        self.user_id = user_id
+
+    async def __aenter__(self):
+        entry = self.runner._per_user.get(self.user_id)
+        if entry is None:
+            entry = self.runner._per_user[self.user_id] = [asyncio.Semaphore(self.runner.per_user_concurrency), 0]
+        entry[1] += 1
+        try:
+            await entry[0].acquire()
+        except BaseException:
+            self._release_user(entry)
+            raise
+        return None
+
+    async def __aexit__(self, *exc):
+        entry = self.runner._per_user[self.user_id]
+        entry[0].release()
+        self._release_user(entry)
+        return False
+
+    def _release_user(self, entry: list):
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self.runner._per_user[self.user_id]
@@ -0,0 +1,796 @@
+"""Lead storage in a local SQLite (WAL) database, with an outbox for replication.
+
+Same interface as SupabaseStore. Every write also records the changed lead,
+message or history event in the `outbox` table inside the same transaction, so
+nothing is lost if the process stops before app.services.replicator pushed it
+to Supabase.
+With path=None the database lives in memory and nothing is replicated: the
+whole bot runs without network access (tests, benchmarks, local development).
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from app.config import STATUS_ORDER
+from app.services.search import DEFAULT_THRESHOLD, trigrams
+
+logger = logging.getLogger(__name__)
+
+LEAD_COLUMNS = (
+    "id", "user_id", "contact_telegram_id", "contact_name", "contact_username", "brand",
+    "request", "dates", "status", "is_hot", "created_at", "updated_at", "message_count"
+)
+MESSAGE_COLUMNS = ("id", "lead_id", "raw_text", "forward_date", "created_at")
+EVENT_COLUMNS = ("id", "lead_id", "user_id", "kind", "value", "created_at")
+# Tables whose ids come from blocks reserved in Supabase when replicating (reserve_ids, migration 0012)
+ID_TABLES = ("leads", "lead_messages", "lead_status_events")
+LEAD_LIST_COLUMNS = "id, brand, status, is_hot, status_rank, updated_at"
+SEARCH_COLUMNS = ("id", "brand", "contact_name", "contact_username", "status", "is_hot")
+# Lead fields matched by search
+SEARCH_FIELDS = ("brand", "contact_name", "contact_username", "request")
+SEARCH_INDEXED_KEY = "search_indexed"
+# Postings counted per trigram when picking the rarest one to drive the exact-match probe
+GRAM_COUNT_CAP = 1000
+
+# Mirrors status_rank in app/migrations/0003_status_rank.sql
+STATUS_RANK_SQL = "case status {} else {} end".format(
+    " ".join(f"when '{status}' then {rank}" for rank, status in enumerate(STATUS_ORDER)),
+    len(STATUS_ORDER)
+)
+
+# Message matches rank below lead field matches, as in the search_leads RPC
+MESSAGE_MATCH_WEIGHT = 0.5
+SNIPPET_CHARS = 80
+
+SCHEMA = f"""
+create table if not exists leads (
+    id integer primary key autoincrement,
+    user_id integer not null,
+    contact_telegram_id integer,
+    contact_name text,
+    contact_username text,
+    brand text,
+    request text,
+    dates text,
+    status text not null default 'new',
+    is_hot integer not null default 0,
+    created_at text not null,
+    updated_at text not null,
+    message_count integer not null default 0,
+    status_rank integer generated always as ({STATUS_RANK_SQL}) stored
+);
+create index if not exists leads_user_page_idx on leads(user_id, status_rank, updated_at desc, id desc);
+create index if not exists leads_user_updated_idx on leads(user_id, updated_at desc);
+create index if not exists leads_user_contact_tg_idx on leads(user_id, contact_telegram_id, updated_at desc);
+create index if not exists leads_user_contact_name_idx on leads(user_id, contact_name, updated_at desc);
+create index if not exists leads_updated_at_idx on leads(updated_at);
+create index if not exists leads_user_id_idx on leads(user_id, id);
+
+create table if not exists lead_messages (
+    id integer primary key autoincrement,
+    lead_id integer not null references leads(id),
+    raw_text text not null,
+    forward_date text,
+    created_at text not null
+);
+create index if not exists lead_messages_lead_idx on lead_messages(lead_id, id);
+
+create table if not exists lead_status_events (
+    id integer primary key autoincrement,
+    lead_id integer not null references leads(id),
+    user_id integer not null,
+    kind text not null,
+    value text,
+    created_at text not null
+);
+create index if not exists lead_status_events_user_idx on lead_status_events(user_id, kind, lead_id, created_at);
+
+create table if not exists outbox (
+    seq integer primary key autoincrement,
+    kind text not null,
+    row_id integer not null
+);
+
+create table if not exists meta (
+    key text primary key,
+    value text not null
+);
+
+-- Trigrams of lead fields and messages, written with the rows by whichever process
+-- writes them (cluster workers, the importer, the replicator)
+create table if not exists search_grams (
+    user_id integer not null,
+    gram text not null,
+    kind text not null,
+    row_id integer not null,
+    primary key (user_id, gram, kind, row_id)
+) without rowid;
+create index if not exists search_grams_row_idx on search_grams(kind, row_id);
+
+-- Id blocks reserved in Supabase; shared by every process writing this file
+create table if not exists id_ranges (
+    tbl text not null,
+    next_id integer not null,
+    end_id integer not null
+);
+"""
+
+
+def now_iso() -> str:
+    return _iso(datetime.now(timezone.utc))
+
+
+def normalize_timestamp(value: Optional[str]) -> Optional[str]:
+    """Fixed-width UTC ISO string, so timestamps compare correctly as text."""
+    if value is None:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return _iso(parsed)
+
+
+def _iso(value: datetime) -> str:
+    return value.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+
+def _lead(row: Optional[sqlite3.Row]) -> Optional[dict]:
+    if row is None:
+        return None
+    lead = dict(row)
+    if "is_hot" in lead:
+        lead["is_hot"] = bool(lead["is_hot"])
+    return lead
+
+
+class LocalStore:
+    """Lead rows and messages in SQLite; reads never leave the machine.
+
+    All SQL runs on one thread, so writes are serialized without locks. Search
+    matches trigrams of lead fields and messages kept in the `search_grams`
+    table, updated in the same transaction as the rows. `track_changes` records writes in the outbox for replication;
+    new rows then take their ids from the `id_ranges` blocks reserved in Supabase,
+    so they cannot collide with rows inserted there directly.
+    """
+
+    def __init__(self, path: Optional[str], track_changes: bool = False):
+        self.path = path
+        self.track_changes = track_changes
+        # Called with lead rows changed by apply_remote (conflict resolution), to refresh caches
+        self.on_remote_change: Optional[Callable[[list[dict]], None]] = None
+        # Called after a write added outbox entries
+        self.on_change: Optional[Callable[[], None]] = None
+        self.outbox_pending = 0
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="local-store")
+        self._conn = self._open()
+
+    def _open(self) -> sqlite3.Connection:
+        if self.path:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        # Cluster workers share the file: wait for each other's write locks
+        conn = sqlite3.connect(self.path or ":memory:", check_same_thread=False, timeout=30)
+        conn.row_factory = sqlite3.Row
+        if self.path:
+            conn.execute("pragma journal_mode=wal")
+            conn.execute("pragma synchronous=normal")
+        conn.executescript(SCHEMA)
+        conn.commit()
+        self.outbox_pending = conn.execute("select count(*) from outbox").fetchone()[0]
+        return conn
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    async def start(self):
+        """Index rows of a file written before search_grams existed (once per file)."""
+        leads, messages = await self._run(self._index_existing)
+        if leads:
+            logger.info(f"Local store: indexed {leads} leads, {messages} messages in {self.path or 'memory'}")
+
+    def _index_existing(self) -> tuple[int, int]:
+        with self._conn:
+            # Taking the write lock first: a sibling process starting at the same time skips this
+            if not self._conn.execute(
+                "insert or ignore into meta (key, value) values (?, '1')", (SEARCH_INDEXED_KEY,)
+            ).rowcount:
+                return 0, 0
+            leads = self._conn.execute(f"select id, user_id, {', '.join(SEARCH_FIELDS)} from leads").fetchall()
+            for lead in leads:
+                self._index_lead(lead)
+            messages = self._conn.execute(
+                "select m.id, m.raw_text, l.user_id from lead_messages m join leads l on l.id = m.lead_id"
+            ).fetchall()
+            for message in messages:
+                self._index_message(message["user_id"], message)
+        return len(leads), len(messages)
+
+    async def close(self):
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=False)
+
+    # === Writes ===
+
+    async def insert_lead(self, lead: dict, messages: list[dict]) -> tuple[dict, list[dict]]:
+        row, message_rows = await self._run(self._insert_lead, lead, messages)
+        self._changed()
+        return row, message_rows
+
+    def _insert_lead(self, lead: dict, messages: list[dict]) -> tuple[dict, list[dict]]:
+        with self._conn:
+            return self._insert_one(lead, messages, now_iso())
+
+    async def insert_leads(self, leads: list[dict], messages: list[list[dict]]) -> list[dict]:
+        """Insert many leads (messages[i] belongs to leads[i]) in one transaction."""
+        rows = await self._run(self._insert_leads, leads, messages)
+        self._changed()
+        return rows
+
+    def _insert_leads(self, leads: list[dict], messages: list[list[dict]]) -> list[dict]:
+        now = now_iso()
+        with self._conn:
+            return [self._insert_one(lead, lead_messages, now)[0] for lead, lead_messages in zip(leads, messages)]
+
+    def _insert_one(self, lead: dict, messages: list[dict], now: str) -> tuple[dict, list[dict]]:
+        """Insert a lead and its messages inside the caller's transaction."""
+        values = {**lead, "id": self._next_id("leads"), "message_count": len(messages)}
+        values["created_at"] = normalize_timestamp(lead.get("created_at")) or now
+        values["updated_at"] = normalize_timestamp(lead.get("updated_at")) or now
+        columns = ", ".join(values)
+        cursor = self._conn.execute(
+            f"insert into leads ({columns}) values ({', '.join('?' * len(values))})",
+            tuple(values.values())
+        )
+        lead_id = cursor.lastrowid
+        self._track("lead", lead_id)
+        message_rows = self._insert_messages(lead_id, values["user_id"], messages, now)
+        row = _lead(self._conn.execute("select * from leads where id = ?", (lead_id,)).fetchone())
+        self._index_lead(row)
+        return row, message_rows
+
+    def _insert_messages(self, lead_id: int, user_id: int, messages: list[dict], now: str) -> list[dict]:
+        rows = []
+        for message in messages:
+            cursor = self._conn.execute(
+                "insert into lead_messages (id, lead_id, raw_text, forward_date, created_at) values (?, ?, ?, ?, ?)",
+                (
+                    self._next_id("lead_messages"), lead_id, message["raw_text"],
+                    normalize_timestamp(message.get("forward_date")), now
+                )
+            )
+            self._track("message", cursor.lastrowid)
+            rows.append({
+                "id": cursor.lastrowid,
+                "lead_id": lead_id,
+                "raw_text": message["raw_text"],
+                "forward_date": normalize_timestamp(message.get("forward_date")),
+                "created_at": now
+            })
+            self._index_message(user_id, rows[-1])
+        return rows
+
+    async def add_messages(self, lead_id: int, messages: list[dict]) -> Optional[dict]:
+        row = await self._run(self._add_messages, lead_id, messages)
+        if row is not None:
+            self._changed()
+        return row
+
+    def _add_messages(self, lead_id: int, messages: list[dict]) -> Optional[dict]:
+        now = now_iso()
+        with self._conn:
+            row = self._conn.execute(
+                "update leads set updated_at = ?, message_count = message_count + ? where id = ? returning *",
+                (now, len(messages), lead_id)
+            ).fetchone()
+            if row is None:
+                return None
+            self._track("lead", lead_id)
+            self._insert_messages(lead_id, row["user_id"], messages, now)
+            return _lead(row)
+
+    async def update_lead(self, lead_id: int, user_id: Optional[int], values: dict) -> Optional[dict]:
+        row = await self._run(self._update_lead, lead_id, user_id, values)
+        if row is not None:
+            self._changed()
+        return row
+
+    def _update_lead(self, lead_id: int, user_id: Optional[int], values: dict) -> Optional[dict]:
+        # Column names go into the statement: never take them from outside LEAD_COLUMNS
+        assert values.keys() <= set(LEAD_COLUMNS), f"Unknown lead columns {set(values) - set(LEAD_COLUMNS)}"
+        values = {**values, "updated_at": now_iso()}
+        assignments = ", ".join(f"{column} = ?" for column in values)
+        sql = f"update leads set {assignments} where id = ?"
+        params = [*values.values(), lead_id]
+        if user_id is not None:
+            sql += " and user_id = ?"
+            params.append(user_id)
+        with self._conn:
+            row = self._conn.execute(sql + " returning *", params).fetchone()
+            if row is not None:
+                self._track("lead", lead_id)
+                if not values.keys().isdisjoint(SEARCH_FIELDS):
+                    self._index_lead(row)
+        return _lead(row)
+
+    async def toggle_hot(self, lead_id: int, user_id: int) -> Optional[dict]:
+        row = await self._run(self._toggle_hot, lead_id, user_id)
+        if row is not None:
+            self._changed()
+        return row
+
+    def _toggle_hot(self, lead_id: int, user_id: int) -> Optional[dict]:
+        with self._conn:
+            row = self._conn.execute(
+                "update leads set is_hot = not is_hot, updated_at = ? where id = ? and user_id = ? returning *",
+                (now_iso(), lead_id, user_id)
+            ).fetchone()
+            if row is not None:
+                self._track("lead", lead_id)
+        return _lead(row)
+
+    async def insert_events(self, events: list[dict]):
+        """Append lead_status_events rows (app.services.lead_events batches them)."""
+        await self._run(self._insert_events, events)
+        self._changed()
+
+    def _insert_events(self, events: list[dict]):
+        with self._conn:
+            for event in events:
+                cursor = self._conn.execute(
+                    "insert into lead_status_events (id, lead_id, user_id, kind, value, created_at)"
+                    " values (?, ?, ?, ?, ?, ?)",
+                    (
+                        self._next_id("lead_status_events"),
+                        event["lead_id"], event["user_id"], event["kind"], event["value"],
+                        normalize_timestamp(event["created_at"]) or now_iso()
+                    )
+                )
+                self._track("event", cursor.lastrowid)
+
+    def _next_id(self, table: str) -> Optional[int]:
+        """An id from the reserved blocks (None: SQLite assigns one, when not replicating)."""
+        if not self.track_changes:
+            return None
+        row = self._conn.execute(
+            "update id_ranges set next_id = next_id + 1"
+            " where rowid = (select rowid from id_ranges where tbl = ? and next_id <= end_id order by next_id limit 1)"
+            " returning next_id - 1",
+            (table,)
+        ).fetchone()
+        if row is None:
+            raise RuntimeError(f"No reserved {table} ids left; more are reserved once Supabase is reachable")
+        return row[0]
+
+    def _track(self, kind: str, row_id: int):
+        if self.track_changes:
+            self._conn.execute("insert into outbox (kind, row_id) values (?, ?)", (kind, row_id))
+            self.outbox_pending += 1
+
+    def _changed(self):
+        if self.track_changes and self.on_change is not None:
+            self.on_change()
+
+    # === Reads ===
+
+    async def fetch_lead(self, lead_id: int, user_id: int) -> Optional[dict]:
+        return await self._run(self._one, "select * from leads where id = ? and user_id = ?", (lead_id, user_id))
+
+    async def fetch_messages(self, lead_id: int) -> list[dict]:
+        return await self._run(self._all, "select * from lead_messages where lead_id = ? order by id", (lead_id,))
+
+    async def leads_by_status(self, user_id: int, status: Optional[str]) -> list[dict]:
+        if status:
+            return await self._run(
+                self._all,
+                "select * from leads where user_id = ? and status = ? order by updated_at desc",
+                (user_id, status)
+            )
+        return await self._run(
+            self._all, "select * from leads where user_id = ? order by updated_at desc", (user_id,)
+        )
+
+    async def leads_page(
+        self,
+        user_id: int,
+        limit: int,
+        after: Optional[tuple],
+        before: Optional[tuple],
+        offset: int
+    ) -> list[dict]:
+        sql = f"select {LEAD_LIST_COLUMNS} from leads where user_id = ?"
+        params: list = [user_id]
+
+        backwards = before is not None
+        cursor = after if after is not None else before
+        if cursor is not None:
+            rank, updated_at, lead_id = cursor
+            updated_at = normalize_timestamp(updated_at)
+            rank_op, time_op = (">", "<") if not backwards else ("<", ">")
+            sql += (
+                f" and (status_rank {rank_op} ?"
+                f" or (status_rank = ? and updated_at {time_op} ?)"
+                f" or (status_rank = ? and updated_at = ? and id {time_op} ?))"
+            )
+            params += [rank, rank, updated_at, rank, updated_at, lead_id]
+
+        if backwards:
+            sql += " order by status_rank desc, updated_at asc, id asc"
+        else:
+            sql += " order by status_rank asc, updated_at desc, id desc"
+        sql += " limit ? offset ?"
+        params += [limit, offset if cursor is None else 0]
+
+        rows = await self._run(self._all, sql, params)
+        if backwards:
+            rows.reverse()
+        return rows
+
+    async def hot_leads(self, user_id: int, limit: int) -> list[dict]:
+        return await self._run(
+            self._all,
+            f"select {LEAD_LIST_COLUMNS} from leads where user_id = ? and is_hot order by updated_at desc limit ?",
+            (user_id, limit)
+        )
+
+    async def count_leads(self, user_id: int) -> int:
+        row = await self._run(self._one, "select count(*) as n from leads where user_id = ?", (user_id,))
+        return row["n"]
+
+    async def search(self, user_id: int, query: str, limit: int) -> list[dict]:
+        """Trigram matches on lead fields and messages, best first (like the search_leads RPC)."""
+        grams = sorted(trigrams(query))
+        if not grams:
+            return []
+
+        # Enough leads holding every trigram: they all rank 1.0, so any `limit` of them is the top
+        exact = await self._run(self._exact_hits, user_id, grams, limit)
+        if len(exact) == limit:
+            best = {lead_id: 1.0 for lead_id in exact}
+            snippet_message = {lead_id: message_id for lead_id, message_id in exact.items() if message_id}
+        else:
+            best, snippet_message = await self._scored_hits(user_id, grams)
+
+        ranked = sorted(best, key=best.get, reverse=True)[:limit]
+        if not ranked:
+            return []
+        rows = await self._run(self._search_rows, ranked, [snippet_message.get(i) for i in ranked])
+        for row in rows:
+            row["rank"] = best[row["id"]]
+            if row["snippet"]:
+                row["snippet"] = _snippet(row["snippet"], query)
+        return rows
+
+    async def _scored_hits(self, user_id: int, grams: list[str]) -> tuple[dict[int, float], dict[int, int]]:
+        """Best score per lead over its fields and messages, and the matching message to quote."""
+        best: dict[int, float] = {}
+        snippet_message: dict[int, int] = {}
+        for hit in await self._run(self._search_hits, user_id, grams):
+            score = hit["hits"] / len(grams)
+            if hit["kind"] == "message":
+                score *= MESSAGE_MATCH_WEIGHT
+                snippet_message.setdefault(hit["lead_id"], hit["row_id"])
+            best[hit["lead_id"]] = max(score, best.get(hit["lead_id"], 0.0))
+        return best, snippet_message
+
+    def _exact_hits(self, user_id: int, grams: list[str], limit: int) -> dict[int, Optional[int]]:
+        """Up to `limit` leads whose fields hold every query trigram -> a matching message id (or None).
+
+        Walks the postings of the rarest trigram and probes the primary key for
+        the others, so it stops after `limit` hits instead of scoring every match.
+        """
+        counts = {
+            gram: self._conn.execute(
+                "select count(*) from (select 1 from search_grams"
+                " where user_id = ? and gram = ? and kind = 'lead' limit ?)",
+                (user_id, gram, GRAM_COUNT_CAP)
+            ).fetchone()[0]
+            for gram in grams
+        }
+        rarest = min(grams, key=counts.get)
+        if not counts[rarest]:
+            return {}
+        others = [gram for gram in grams if gram != rarest]
+        probes = "".join(
+            " and exists (select 1 from search_grams x"
+            " where x.user_id = g.user_id and x.gram = ? and x.kind = 'lead' and x.row_id = g.row_id)"
+            for _ in others
+        )
+        lead_ids = [row[0] for row in self._conn.execute(
+            f"select g.row_id from search_grams g where g.user_id = ? and g.gram = ? and g.kind = 'lead'{probes} limit ?",
+            (user_id, rarest, *others, limit)
+        )]
+
+        placeholders = ", ".join("?" * len(grams))
+        hits = {}
+        for lead_id in lead_ids:
+            message = self._conn.execute(
+                "select m.id from lead_messages m where m.lead_id = ?"
+                " and (select count(*) from search_grams x where x.user_id = ? and x.kind = 'message'"
+                f" and x.row_id = m.id and x.gram in ({placeholders})) >= ?"
+                " order by m.id limit 1",
+                (lead_id, user_id, *grams, DEFAULT_THRESHOLD * len(grams))
+            ).fetchone()
+            hits[lead_id] = message[0] if message else None
+        return hits
+
+    def _search_hits(self, user_id: int, grams: list[str]) -> list[dict]:
+        """Lead and message rows holding at least DEFAULT_THRESHOLD of the query trigrams, best first."""
+        return self._all(
+            "with hits as ("
+            "  select kind, row_id, count(*) as hits from search_grams"
+            f"  where user_id = ? and gram in ({', '.join('?' * len(grams))})"
+            "  group by kind, row_id having count(*) >= ?"
+            ")"
+            " select h.kind, h.row_id, h.hits, coalesce(m.lead_id, h.row_id) as lead_id from hits h"
+            " left join lead_messages m on h.kind = 'message' and m.id = h.row_id"
+            " order by h.hits desc",
+            (user_id, *grams, DEFAULT_THRESHOLD * len(grams))
+        )
+
+    def _search_rows(self, lead_ids: list[int], message_ids: list[Optional[int]]) -> list[dict]:
+        rows = []
+        for lead_id, message_id in zip(lead_ids, message_ids):
+            lead = _lead(self._conn.execute(
+                f"select {', '.join(SEARCH_COLUMNS)} from leads where id = ?", (lead_id,)
+            ).fetchone())
+            if lead is None:
+                continue
+            message = self._conn.execute(
+                "select raw_text from lead_messages where id = ?", (message_id,)
+            ).fetchone() if message_id else None
+            lead["snippet"] = message["raw_text"] if message else None
+            rows.append(lead)
+        return rows
+
+    async def recent_lead(
+        self,
+        user_id: int,
+        contact_telegram_id: Optional[int],
+        contact_name: Optional[str],
+        since: str
+    ) -> Optional[dict]:
+        if contact_telegram_id:
+            column, value = "contact_telegram_id", contact_telegram_id
+        elif contact_name:
+            column, value = "contact_name", contact_name
+        else:
+            return None
+        return await self._run(
+            self._one,
+            f"select * from leads where user_id = ? and {column} = ? and updated_at >= ?"
+            " order by updated_at desc limit 1",
+            (user_id, value, normalize_timestamp(since))
+        )
+
+    async def recent_leads(self, since: str) -> list[dict]:
+        return await self._run(
+            self._all,
+            "select id, user_id, contact_telegram_id, contact_name, updated_at from leads where updated_at >= ?",
+            (normalize_timestamp(since),)
+        )
+
+    async def stats(self, user_id: int) -> dict:
+        rows = await self._run(
+            self._all,
+            "select status, count(*) as leads, sum(message_count) as messages from leads"
+            " where user_id = ? group by status",
+            (user_id,)
+        )
+        return {
+            "total_leads": sum(r["leads"] for r in rows),
+            "total_messages": sum(r["messages"] or 0 for r in rows),
+            "by_status": {r["status"]: r["leads"] for r in rows}
+        }
+
+    async def export_chunk(self, user_id: int, after_id: int, limit: int) -> list[dict]:
+        return await self._run(self._export_chunk, user_id, after_id, limit)
+
+    def _export_chunk(self, user_id: int, after_id: int, limit: int) -> list[dict]:
+        leads = self._all("select * from leads where user_id = ? and id > ? order by id limit ?", (user_id, after_id, limit))
+        if not leads:
+            return []
+        by_id = {lead["id"]: lead for lead in leads}
+        for lead in leads:
+            lead["messages"] = []
+        placeholders = ", ".join("?" * len(by_id))
+        rows = self._conn.execute(
+            f"select * from lead_messages where lead_id in ({placeholders}) order by lead_id, id", list(by_id)
+        )
+        for row in rows:
+            by_id[row["lead_id"]]["messages"].append(dict(row))
+        return leads
+
+    async def status_history(self, user_id: int) -> dict:
+        """Status events as columns: lead_id, status, at (epoch seconds), in no particular order."""
+        return await self._run(self._status_history, user_id)
+
+    def _status_history(self, user_id: int) -> dict:
+        rows = self._conn.execute(
+            "select lead_id, value, (julianday(created_at) - 2440587.5) * 86400.0 from lead_status_events"
+            " where user_id = ? and kind in ('created', 'status')",
+            (user_id,)
+        ).fetchall()
+        lead_ids, statuses, times = zip(*rows) if rows else ((), (), ())
+        return {"lead_id": list(lead_ids), "status": list(statuses), "at": list(times)}
+
+    def _one(self, sql: str, params) -> Optional[dict]:
+        return _lead(self._conn.execute(sql, params).fetchone())
+
+    def _all(self, sql: str, params) -> list[dict]:
+        return [_lead(row) for row in self._conn.execute(sql, params).fetchall()]
+
+    # === Search index (inside the caller's transaction) ===
+
+    def _index_lead(self, lead):
+        text = " ".join(lead[field] or "" for field in SEARCH_FIELDS)
+        self._index("lead", lead["id"], lead["user_id"], text)
+
+    def _index_message(self, user_id: int, message):
+        self._index("message", message["id"], user_id, message["raw_text"])
+
+    def _index(self, kind: str, row_id: int, user_id: int, text: str):
+        self._conn.execute("delete from search_grams where kind = ? and row_id = ?", (kind, row_id))
+        self._conn.executemany(
+            "insert into search_grams (user_id, gram, kind, row_id) values (?, ?, ?, ?)",
+            [(user_id, gram, kind, row_id) for gram in trigrams(text)]
+        )
+
+    # === Replication (app.services.replicator) ===
+
+    async def outbox_batch(self, limit: int) -> tuple[int, list[dict], list[dict], list[dict]]:
+        """Up to `limit` outbox entries as (last seq, current lead rows, message rows, event rows)."""
+        return await self._run(self._outbox_batch, limit)
+
+    def _outbox_batch(self, limit: int) -> tuple[int, list[dict], list[dict], list[dict]]:
+        entries = self._conn.execute("select seq, kind, row_id from outbox order by seq limit ?", (limit,)).fetchall()
+        if not entries:
+            return 0, [], [], []
+
+        # Several changes to one lead replicate as its current row
+        lead_ids = sorted({e["row_id"] for e in entries if e["kind"] == "lead"})
+        message_ids = sorted({e["row_id"] for e in entries if e["kind"] == "message"})
+        leads = self._rows_by_id("leads", LEAD_COLUMNS, lead_ids)
+        messages = self._rows_by_id("lead_messages", MESSAGE_COLUMNS, message_ids)
+        event_ids = [e["row_id"] for e in entries if e["kind"] == "event"]
+        events = self._rows_by_id("lead_status_events", EVENT_COLUMNS, event_ids)
+        return entries[-1]["seq"], leads, messages, events
+
+    def _rows_by_id(self, table: str, columns: tuple, ids: list[int]) -> list[dict]:
+        if not ids:
+            return []
+        placeholders = ", ".join("?" * len(ids))
+        rows = self._conn.execute(
+            f"select {', '.join(columns)} from {table} where id in ({placeholders}) order by id", ids
+        ).fetchall()
+        return [_lead(row) for row in rows]
+
+    async def outbox_done(self, last_seq: int):
+        """Drop entries up to last_seq; changes recorded meanwhile have higher seqs and stay."""
+        removed = await self._run(self._outbox_done, last_seq)
+        self.outbox_pending = max(0, self.outbox_pending - removed)
+
+    def _outbox_done(self, last_seq: int) -> int:
+        with self._conn:
+            return self._conn.execute("delete from outbox where seq <= ?", (last_seq,)).rowcount
+
+    async def apply_remote(self, leads: list[dict], messages: list[dict]) -> list[dict]:
+        """Store rows read from Supabase where they are newer than ours; returns the changed leads."""
+        changed = await self._run(self._apply_remote, leads, messages)
+        if changed and self.on_remote_change is not None:
+            self.on_remote_change(changed)
+        return changed
+
+    def _apply_remote(self, leads: list[dict], messages: list[dict]) -> list[dict]:
+        lead_columns = ", ".join(LEAD_COLUMNS)
+        lead_updates = ", ".join(f"{c} = excluded.{c}" for c in LEAD_COLUMNS if c != "id")
+        changed = []
+        with self._conn:
+            for lead in leads:
+                values = {c: lead.get(c) for c in LEAD_COLUMNS}
+                values["created_at"] = normalize_timestamp(values["created_at"]) or now_iso()
+                values["updated_at"] = normalize_timestamp(values["updated_at"]) or now_iso()
+                values["is_hot"] = bool(values["is_hot"])
+                values["status"] = values["status"] or "new"
+                values["message_count"] = values["message_count"] or 0
+                row = self._conn.execute(
+                    f"insert into leads ({lead_columns}) values ({', '.join('?' * len(LEAD_COLUMNS))})"
+                    f" on conflict (id) do update set {lead_updates}"
+                    " where leads.updated_at < excluded.updated_at returning *",
+                    tuple(values.values())
+                ).fetchone()
+                if row is not None:
+                    changed.append(_lead(row))
+                    self._index_lead(row)
+
+            self._conn.executemany(
+                f"insert or ignore into lead_messages ({', '.join(MESSAGE_COLUMNS)}) values (?, ?, ?, ?, ?)",
+                [
+                    (
+                        m["id"], m["lead_id"], m["raw_text"], normalize_timestamp(m.get("forward_date")),
+                        normalize_timestamp(m.get("created_at")) or now_iso()
+                    )
+                    for m in messages
+                ]
+            )
+
+            # Messages can arrive in a later page than their lead
+            lead_ids = sorted({m["lead_id"] for m in messages})
+            owners = {r["id"]: r["user_id"] for r in self._rows_by_id("leads", ("id", "user_id"), lead_ids)}
+            for message in messages:
+                if message["lead_id"] in owners:
+                    self._index_message(owners[message["lead_id"]], message)
+        return changed
+
+    async def apply_remote_events(self, events: list[dict]):
+        """Store lead_status_events rows read from Supabase (first start), keeping their ids."""
+        def write():
+            with self._conn:
+                self._conn.executemany(
+                    f"insert or ignore into lead_status_events ({', '.join(EVENT_COLUMNS)}) values (?, ?, ?, ?, ?, ?)",
+                    [
+                        (
+                            e["id"], e["lead_id"], e["user_id"], e["kind"], e["value"],
+                            normalize_timestamp(e["created_at"]) or now_iso()
+                        )
+                        for e in events
+                    ]
+                )
+        await self._run(write)
+
+    async def ids_left(self) -> dict[str, int]:
+        """Unused reserved ids per table."""
+        rows = await self._run(
+            self._all,
+            "select tbl, sum(end_id - next_id + 1) as n from id_ranges where next_id <= end_id group by tbl",
+            ()
+        )
+        return {table: 0 for table in ID_TABLES} | {r["tbl"]: r["n"] for r in rows}
+
+    async def max_ids(self) -> dict[str, int]:
+        """Highest id per table, so reserved blocks start above rows that exist here."""
+        def read():
+            return {
+                table: self._conn.execute(f"select coalesce(max(id), 0) from {table}").fetchone()[0]
+                for table in ID_TABLES
+            }
+        return await self._run(read)
+
+    async def add_id_ranges(self, starts: dict[str, int], count: int):
+        """Store blocks of `count` ids per table (from reserve_ids) and drop used-up ones."""
+        def write():
+            with self._conn:
+                self._conn.executemany(
+                    "insert into id_ranges (tbl, next_id, end_id) values (?, ?, ?)",
+                    [(table, start, start + count - 1) for table, start in starts.items()]
+                )
+                self._conn.execute("delete from id_ranges where next_id > end_id")
+        await self._run(write)
+
+    async def get_meta(self, key: str) -> Optional[str]:
+        row = await self._run(self._one, "select value from meta where key = ?", (key,))
+        return row["value"] if row else None
+
+    async def set_meta(self, key: str, value: str):
+        def write():
+            with self._conn:
+                self._conn.execute(
+                    "insert into meta (key, value) values (?, ?) on conflict (key) do update set value = excluded.value",
+                    (key, value)
+                )
+        await self._run(write)
+
+
+def _snippet(text: str, query: str) -> str:
+    """A short window of text around the first query word it contains."""
+    lowered = text.lower()
+    positions = [p for p in (lowered.find(word) for word in query.lower().split()) if p >= 0]
+    start = max(0, min(positions) - SNIPPET_CHARS // 4) if positions else 0
+    snippet = text[start:start + SNIPPET_CHARS].replace("\n", " ")
+    return ("…" if start else "") + snippet + ("…" if start + SNIPPET_CHARS < len(text) else "")
@@ -0,0 +1,140 @@
+"""Content-addressed cache for AI parse results."""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# Expired rows are purged from the persistent tier every this many writes
+PURGE_EVERY_PUTS = 100
+
+WHITESPACE_RE = re.compile(r"\s+")
+
+lookups = metrics.counter("crm_parse_cache_lookups_total", "Parse cache lookups by result (memory/disk hit, miss)")
+
+
+def normalize(text: str) -> str:
+    """Normalize text so trivially different copies of a pitch share a key."""
+    return WHITESPACE_RE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def cache_key(text: str, prompt_version: str) -> str:
+    """Key = hash of prompt version and normalized text."""
+    payload = f"{prompt_version}\0{normalize(text)}".encode()
+    return hashlib.sha256(payload).hexdigest()
+
+
+class ParseCache:
+    """Two-tier cache: in-memory LRU in front of an optional SQLite table with TTL."""
+
+    def __init__(self, path: Optional[str], max_entries: int, ttl_seconds: float):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._memory: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="parse-cache")
+        self._puts = 0
+
+        if path:
+            self._open()
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("pragma journal_mode=wal")
+        self._conn.execute(
+            "create table if not exists parse_cache ("
+            " key text primary key,"
+            " value text not null,"
+            " expires_at real not null)"
+        )
+        self._purge_expired()
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "memory_hits": lookups.get(result="memory_hit"),
+            "disk_hits": lookups.get(result="disk_hit"),
+            "misses": lookups.get(result="miss"),
+            "memory_entries": len(self._memory),
+        }
+
+    async def get(self, key: str) -> Optional[dict]:
+        now = time.time()
+
+        entry = self._memory.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > now:
+                self._memory.move_to_end(key)
+                lookups.inc(result="memory_hit")
+                return dict(value)
+            del self._memory[key]
+
+        if self._conn is not None:
+            loop = asyncio.get_running_loop()
+            row = await loop.run_in_executor(self._executor, self._read, key, now)
+            if row is not None:
+                value, expires_at = json.loads(row[0]), row[1]
+                self._remember(key, value, expires_at)
+                lookups.inc(result="disk_hit")
+                return dict(value)
+
+        lookups.inc(result="miss")
+        return None
+
+    async def put(self, key: str, value: dict):
+        expires_at = time.time() + self.ttl_seconds
+        self._remember(key, value, expires_at)
+
+        if self._conn is not None:
+            self._puts += 1
+            purge = self._puts % PURGE_EVERY_PUTS == 0
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(
+                self._executor, self._write, key, json.dumps(value, ensure_ascii=False), expires_at, purge
+            )
+
+    def _remember(self, key: str, value: dict, expires_at: float):
+        self._memory[key] = (expires_at, dict(value))
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _read(self, key: str, now: float) -> Optional[tuple]:
+        return self._conn.execute(
+            "select value, expires_at from parse_cache where key = ? and expires_at > ?",
+            (key, now)
+        ).fetchone()
+
+    def _write(self, key: str, value: str, expires_at: float, purge: bool):
+        with self._conn:
+            self._conn.execute(
+                "insert into parse_cache (key, value, expires_at) values (?, ?, ?) "
+                "on conflict (key) do update set value = excluded.value, expires_at = excluded.expires_at",
+                (key, value, expires_at)
+            )
+        if purge:
+            self._purge_expired()
+
+    def _purge_expired(self):
+        with self._conn:
+            deleted = self._conn.execute(
+                "delete from parse_cache where expires_at <= ?", (time.time(),)
+            ).rowcount
+        if deleted:
+            logger.info(f"Evicted {deleted} expired parse cache entries")
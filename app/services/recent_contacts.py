@@ -0,0 +1,135 @@
+"""Sliding-window index of leads recently touched per (user, contact)."""
+import time
+from typing import Iterable, Optional
+
+from app.utils import metrics
+
+# Expiry granularity: entries are dropped at most this long after they leave the window
+SLOT_SECONDS = 60.0
+
+lookups = metrics.counter("crm_recent_contacts_lookups_total", "Recent-contact lookups by result (hit/miss/cold)")
+indexed_keys = metrics.gauge("crm_recent_contacts_keys", "Contacts with a lead touched inside the window")
+
+
+class RecentContacts:
+    """Answers "which lead did this user last touch for this contact within the window?".
+
+    Keys are (user_id, "id", telegram_id) and (user_id, "name", contact_name),
+    mirroring how get_recent_lead_by_contact matches. Each key maps to the
+    leads touched for it and when. Expiry uses a time wheel of `SLOT_SECONDS`
+    slots covering the window: advancing the wheel only visits keys touched one
+    full turn ago, so cost is proportional to expiring entries, not index size.
+    The index is authoritative only once `ready` (after a warm-up load).
+    """
+
+    def __init__(self, window_seconds: float, slot_seconds: float = SLOT_SECONDS):
+        self.window = window_seconds
+        self.slot_seconds = slot_seconds
+        self.ready = False
+
+        self._entries: dict[tuple, dict[int, float]] = {}  # key -> {lead_id: touched_at}
+        self._lead_keys: dict[int, tuple] = {}  # lead_id -> keys it is indexed under
+        self._slots: list[set] = [set() for _ in range(int(window_seconds // slot_seconds) + 2)]
+        self._tick: Optional[int] = None
+
+        indexed_keys.fn = lambda: len(self._entries)
+
+    @staticmethod
+    def keys(user_id: int, telegram_id: Optional[int], name: Optional[str]) -> tuple:
+        keys = []
+        if telegram_id:
+            keys.append((user_id, "id", telegram_id))
+        if name:
+            keys.append((user_id, "name", name))
+        return tuple(keys)
+
+    def touch(self, lead: dict, at: Optional[float] = None):
+        """Record that a lead row was written (or updated) at `at` (default: now)."""
+        now = time.time()
+        at = now if at is None else at
+        self._advance(now)
+
+        lead_id = lead["id"]
+        keys = self.keys(lead["user_id"], lead.get("contact_telegram_id"), lead.get("contact_name"))
+
+        # The contact changed (e.g. AI or user edit): the old keys no longer match this lead
+        for key in self._lead_keys.get(lead_id, ()):
+            if key not in keys:
+                self._forget(key, lead_id)
+
+        if at <= now - self.window:
+            self._lead_keys.pop(lead_id, None)
+            return
+
+        slot = self._slots[int(at // self.slot_seconds) % len(self._slots)]
+        for key in keys:
+            leads = self._entries.setdefault(key, {})
+            leads[lead_id] = max(at, leads.get(lead_id, at))
+            slot.add(key)
+        self._lead_keys[lead_id] = keys
+
+    def load(self, leads: Iterable[tuple[dict, float]]) -> int:
+        """Warm the index from (row, updated_at timestamp) pairs and mark it ready."""
+        count = 0
+        for lead, at in leads:
+            self.touch(lead, at)
+            count += 1
+        self.ready = True
+        return count
+
+    def lookup(self, user_id: int, telegram_id: Optional[int], name: Optional[str]) -> Optional[int]:
+        """Most recently touched lead for the contact inside the window, or None."""
+        if not self.ready:
+            lookups.inc(result="cold")
+            return None
+
+        now = time.time()
+        self._advance(now)
+        # Same precedence as the database query: telegram id if known, else the name
+        keys = self.keys(user_id, telegram_id, None if telegram_id else name)
+        leads = self._entries.get(keys[0]) if keys else None
+
+        cutoff = now - self.window
+        best = max(
+            ((at, lead_id) for lead_id, at in (leads or {}).items() if at > cutoff),
+            default=None
+        )
+        lookups.inc(result="hit" if best else "miss")
+        return best[1] if best else None
+
+    def _advance(self, now: float):
+        """Turn the wheel to `now`, expiring entries in the slots passed over."""
+        current = int(now // self.slot_seconds)
+        if self._tick is None:
+            self._tick = current
+            return
+
+        cutoff = now - self.window
+        # Visiting more than one full turn would only repeat slots
+        start = max(self._tick + 1, current - len(self._slots) + 1)
+        for tick in range(start, current + 1):
+            slot = self._slots[tick % len(self._slots)]
+            for key in slot:
+                leads = self._entries.get(key)
+                if leads is None:
+                    continue
+                for lead_id, at in list(leads.items()):
+                    if at <= cutoff:
+                        self._forget(key, lead_id)
+            slot.clear()
+        self._tick = max(self._tick, current)
+
+    def _forget(self, key: tuple, lead_id: int):
+        leads = self._entries.get(key)
+        if leads is None or leads.pop(lead_id, None) is None:
+            return
+        if not leads:
+            del self._entries[key]
+
+        keys = self._lead_keys.get(lead_id)
+        if keys is not None:
+            remaining = tuple(k for k in keys if k != key)
+            if remaining:
+                self._lead_keys[lead_id] = remaining
+            else:
+                del self._lead_keys[lead_id]
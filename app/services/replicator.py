@@ -0,0 +1,190 @@
+"""Write-behind replication of the local store's outbox to Supabase."""
+import asyncio
+import logging
+from typing import Optional
+
+from app.services.local_store import LEAD_COLUMNS, MESSAGE_COLUMNS, EVENT_COLUMNS, ID_TABLES, LocalStore
+from app.services.supabase import supabase, execute
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# Rows per request (PostgREST caps responses at 1000)
+PAGE_SIZE = 1000
+RETRY_MAX_SECONDS = 60.0
+HYDRATED_KEY = "hydrated"
+# How often a worker that does not replicate checks whether the initial copy finished
+HYDRATE_POLL_SECONDS = 1.0
+
+batches = metrics.counter("crm_sync_batches_total", "Outbox batches pushed to Supabase by outcome")
+conflicts = metrics.counter(
+    "crm_sync_conflicts_total", "Local rows not written to Supabase by kind (newer remote row / id collision)"
+)
+outbox_pending = metrics.gauge("crm_sync_outbox_pending", "Local changes not yet replicated to Supabase")
+
+
+class OutboxReplicator:
+    """Pushes outbox batches through the sync_leads and sync_lead_events RPCs (migration 0012).
+
+    Batches carry full current rows with their local ids, so a batch retried
+    after a timeout just writes the same rows again. Supabase keeps whichever
+    lead row has the newer updated_at; rows rejected that way come back in the
+    RPC result and the local copy is overwritten with the Supabase row.
+    Pushes wait `interval` after a change, so bursts of writes share a batch.
+
+    Local ids come from blocks of `id_block` reserved with reserve_ids; an id
+    that still turns out to belong to another user's row is logged and counted,
+    never written over.
+    """
+
+    def __init__(self, store: LocalStore, batch_size: int, interval: float, id_block: int):
+        self.store = store
+        self.batch_size = batch_size
+        self.interval = interval
+        self.id_block = id_block
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._reserve_lock = asyncio.Lock()
+        store.on_change = self._wake.set
+        outbox_pending.fn = lambda: store.outbox_pending
+
+    async def hydrate(self) -> int:
+        """First start: copy all leads, messages and history from Supabase."""
+        if await self.store.get_meta(HYDRATED_KEY):
+            return 0
+
+        leads = await _fetch_all("leads", LEAD_COLUMNS)
+        messages = await _fetch_all("lead_messages", MESSAGE_COLUMNS)
+        for i in range(0, len(leads), PAGE_SIZE):
+            await self.store.apply_remote(leads[i:i + PAGE_SIZE], [])
+        for i in range(0, len(messages), PAGE_SIZE):
+            await self.store.apply_remote([], messages[i:i + PAGE_SIZE])
+        events = await _fetch_all("lead_status_events", EVENT_COLUMNS)
+        await self.store.apply_remote_events(events)
+        await self.store.set_meta(HYDRATED_KEY, "1")
+        logger.info(f"Copied {len(leads)} leads, {len(messages)} messages and {len(events)} events from Supabase")
+        return len(leads)
+
+    async def ensure_ids(self, needed: int = 0):
+        """Reserve another block of ids in Supabase when fewer than half a block (or `needed`) are left."""
+        async with self._reserve_lock:
+            left = await self.store.ids_left()
+            if min(left.values()) >= max(self.id_block // 2, needed):
+                return
+            count = max(self.id_block, needed)
+            result = await execute(supabase.rpc("reserve_ids", {
+                "p_count": count,
+                "p_after": await self.store.max_ids()
+            }))
+            await self.store.add_id_ranges({table: result.data[table] for table in ID_TABLES}, count)
+            logger.info(f"Reserved {count} ids per table in Supabase")
+
+    async def wait_hydrated(self):
+        """For processes sharing the file with the replicating one: wait until its copy finished."""
+        while not await self.store.get_meta(HYDRATED_KEY):
+            await asyncio.sleep(HYDRATE_POLL_SECONDS)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop after pushing what is already in the outbox (best effort)."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        self._task = None
+        try:
+            await self.push()
+        except Exception:
+            logger.warning(f"{self.store.outbox_pending} local changes left for the next start")
+
+    async def _run(self):
+        delay = self.interval
+        while True:
+            if delay > self.interval:
+                # Supabase is failing: new writes do not shorten the backoff
+                await asyncio.sleep(delay)
+            else:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+                except asyncio.TimeoutError:
+                    pass
+                # Let a burst of writes land in the same batch
+                await asyncio.sleep(self.interval)
+            self._wake.clear()
+
+            try:
+                while await self.push():
+                    pass
+                await self.ensure_ids()
+                delay = self.interval
+            except Exception as e:
+                delay = min(max(delay * 2, 2 * self.interval), RETRY_MAX_SECONDS)
+                logger.warning(
+                    f"Supabase sync failed ({e}), {self.store.outbox_pending} changes pending,"
+                    f" retry in {delay:.0f}s"
+                )
+
+    async def push(self) -> bool:
+        """Push one batch; False when the outbox is empty."""
+        last_seq, leads, messages, events = await self.store.outbox_batch(self.batch_size)
+        if not last_seq:
+            return False
+
+        try:
+            result = await execute(supabase.rpc("sync_leads", {
+                "p_leads": [_remote_lead(lead) for lead in leads],
+                "p_messages": messages
+            }))
+            event_result = None
+            if events:
+                event_result = await execute(supabase.rpc("sync_lead_events", {"p_events": events}))
+        except Exception:
+            batches.inc(outcome="error")
+            raise
+
+        data = result.data or {}
+        collisions = data.get("collisions") or []
+        _report_collisions("lead", collisions)
+        _report_collisions("message", data.get("message_collisions") or [])
+        if event_result is not None:
+            _report_collisions("lead history", (event_result.data or {}).get("collisions") or [])
+
+        rejected = [lead_id for lead_id in data.get("conflicts") or [] if lead_id not in collisions]
+        if rejected:
+            conflicts.inc(len(rejected), kind="newer")
+            remote = await execute(supabase.table("leads").select(", ".join(LEAD_COLUMNS)).in_("id", rejected))
+            await self.store.apply_remote(remote.data, [])
+
+        await self.store.outbox_done(last_seq)
+        batches.inc(outcome="ok")
+        return True
+
+
+def _report_collisions(what: str, ids: list[int]):
+    """Local rows whose id Supabase already uses for another user's or lead's row: kept local, never overwritten."""
+    if ids:
+        conflicts.inc(len(ids), kind="id_collision")
+        logger.error(f"Supabase already has other rows with {what} ids {sorted(ids)}; those local rows were not synced")
+
+
+def _remote_lead(lead: dict) -> dict:
+    # message_count is kept by Supabase's own trigger
+    return {column: lead[column] for column in LEAD_COLUMNS if column != "message_count"}
+
+
+async def _fetch_all(table: str, columns: tuple) -> list[dict]:
+    rows, last_id = [], 0
+    while True:
+        result = await execute(
+            supabase.table(table)
+            .select(", ".join(columns))
+            .gt("id", last_id)
+            .order("id")
+            .limit(PAGE_SIZE)
+        )
+        rows.extend(result.data)
+        if len(result.data) < PAGE_SIZE:
+            return rows
+        last_id = result.data[-1]["id"]
@@ -0,0 +1,26 @@
+"""Trigram matching for lead search (mirrors pg_trgm semantics in-process)."""
+import re
+
+WORD_RE = re.compile(r"\w+")
+
+# Minimum share of query trigrams a document must contain to match
+DEFAULT_THRESHOLD = 0.5
+
+
+def trigrams(text: str) -> set[str]:
+    """Split text into pg_trgm-style trigrams: lowercase words padded with spaces."""
+    result = set()
+    for word in WORD_RE.findall(text.lower()):
+        padded = f"  {word} "
+        for i in range(len(padded) - 2):
+            result.add(padded[i:i + 3])
+    return result
+
+
+def word_similarity(query: str, text: str) -> float:
+    """Share of the query's trigrams found in text (like pg_trgm word_similarity)."""
+    query_grams = trigrams(query)
+    if not query_grams:
+        return 0.0
+    return len(query_grams & trigrams(text)) / len(query_grams)
+
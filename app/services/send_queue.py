@@ -0,0 +1,244 @@
+"""Outbound Telegram queue: flood limits, edit coalescing and no-op edit skipping."""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from pydantic import BaseModel
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import EditMessageReplyMarkup, EditMessageText, TelegramMethod
+from aiogram.types import Message
+
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# Methods that post into a chat and count against Telegram's flood limits
+LIMITED_PREFIXES = ("Send", "Edit", "Copy", "Forward")
+COALESCED_METHODS = (EditMessageText, EditMessageReplyMarkup)
+
+TEXT_FIELDS = ("text", "parse_mode", "entities", "link_preview_options", "disable_web_page_preview")
+MARKUP_FIELDS = ("reply_markup",)
+
+# Messages whose last sent content is remembered for skipping unchanged edits
+MAX_TRACKED_MESSAGES = 10_000
+# Idle per-chat buckets are dropped once more chats than this are tracked
+MAX_IDLE_CHATS = 1_000
+
+outcomes = metrics.counter(
+    "crm_send_queue_total", "Outbound requests by outcome (sent/coalesced/unchanged/retried/failed)"
+)
+waiting = metrics.gauge("crm_send_queue_waiting", "Outbound requests waiting for a rate-limit slot")
+delay = metrics.histogram("crm_send_queue_delay_seconds", "Time outbound requests waited for a slot")
+
+
+class TokenBucket:
+    """`rate` requests per second with bursts of up to `burst`, as reservations (GCRA).
+
+    `reserve()` books the next slot and returns when it starts, so waiters are
+    served in the order they reserved without holding a lock while sleeping.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.interval = 1.0 / rate
+        self.tolerance = (burst - 1) * self.interval
+        self._tat = 0.0  # Theoretical arrival time of the next request
+
+    def reserve(self, now: float) -> float:
+        start = max(now, self._tat - self.tolerance)
+        self._tat = max(self._tat, start) + self.interval
+        return start
+
+    def pause(self, until: float):
+        """No slot starts before `until` (Telegram's retry_after)."""
+        self._tat = max(self._tat, until + self.tolerance)
+
+    def idle(self, now: float) -> bool:
+        return self._tat <= now
+
+
+class _PendingEdit:
+    __slots__ = ("method", "future")
+
+    def __init__(self, method: TelegramMethod):
+        self.method = method
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class SendQueue(BaseRequestMiddleware):
+    """Request middleware that paces every chat-bound Bot API call.
+
+    Each call waits for a per-chat slot (Telegram allows about one message per
+    second in a chat) and then a global one (about 30 per second per bot). A
+    429 pauses the chat for `retry_after` and the call is retried. While an edit
+    of a message waits, newer edits of the same message replace it: only the
+    latest is sent and every caller gets its result. Edits that would not change
+    the last content this process sent are answered locally.
+
+    Other methods (answerCallbackQuery, getUpdates, ...) pass through untouched.
+    """
+
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: int = 1, max_retries: int = 3):
+        self.global_bucket = TokenBucket(global_rate, burst=max(1, int(global_rate)))
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+
+        self._chats: OrderedDict[Any, TokenBucket] = OrderedDict()
+        self._pending: dict[tuple, _PendingEdit] = {}
+        # (chat_id, message_id) -> {"text": fingerprint, "markup": fingerprint, "message": last Message}
+        self._sent: OrderedDict[tuple, dict] = OrderedDict()
+        self._waiting = 0
+        waiting.fn = lambda: self._waiting
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Bot,
+        method: TelegramMethod
+    ) -> Any:
+        # The request chain returns the method's result (e.g. a Message), not the raw response
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or not type(method).__name__.startswith(LIMITED_PREFIXES):
+            return await make_request(bot, method)
+
+        if isinstance(method, COALESCED_METHODS) and method.message_id is not None:
+            return await self._edit(make_request, bot, method)
+        return await self._send(make_request, bot, method)
+
+    async def _edit(self, make_request, bot: Bot, method: TelegramMethod) -> Any:
+        key = (type(method).__name__, method.chat_id, method.message_id)
+        pending = self._pending.get(key)
+        if pending is not None:
+            # An older edit of this message is still waiting: send ours in its place
+            pending.method = method
+            outcomes.inc(outcome="coalesced")
+            return await asyncio.shield(pending.future)
+
+        unchanged = self._unchanged(method)
+        if unchanged is not None:
+            outcomes.inc(outcome="unchanged")
+            return unchanged
+
+        pending = self._pending[key] = _PendingEdit(method)
+        try:
+            await self._wait_for_slot(method.chat_id)
+        except BaseException:
+            # Cancelled while waiting: callers coalesced into this edit are cancelled too
+            pending.future.cancel()
+            raise
+        finally:
+            del self._pending[key]
+
+        # Edits that arrived while waiting may have made it a no-op again
+        unchanged = self._unchanged(pending.method)
+        if unchanged is not None:
+            outcomes.inc(outcome="unchanged")
+            pending.future.set_result(unchanged)
+            return unchanged
+
+        try:
+            result = await self._request(make_request, bot, pending.method)
+        except BaseException as e:
+            pending.future.set_exception(e)
+            # Coalesced callers see the error; the future must not warn if nobody did
+            pending.future.exception()
+            raise
+        pending.future.set_result(result)
+        return result
+
+    async def _send(self, make_request, bot: Bot, method: TelegramMethod) -> Any:
+        await self._wait_for_slot(method.chat_id)
+        return await self._request(make_request, bot, method)
+
+    async def _request(self, make_request, bot: Bot, method: TelegramMethod) -> Any:
+        """Send once a slot was taken; on a 429 pause the chat and queue up again."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                result = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    outcomes.inc(outcome="failed")
+                    raise
+                logger.warning(f"Flood limit in chat {method.chat_id}, retrying in {e.retry_after}s")
+                outcomes.inc(outcome="retried")
+                self._chat_bucket(method.chat_id).pause(time.monotonic() + e.retry_after)
+                await self._wait_for_slot(method.chat_id)
+                continue
+            except Exception:
+                # The message may no longer look like what we remember
+                self._sent.pop((method.chat_id, getattr(method, "message_id", None)), None)
+                raise
+            outcomes.inc(outcome="sent")
+            self._remember(method, result)
+            return result
+
+    async def _wait_for_slot(self, chat_id):
+        self._waiting += 1
+        started = time.monotonic()
+        try:
+            # Chat first, so a busy chat does not hold global slots while it waits
+            await self._sleep_until(self._chat_bucket(chat_id).reserve(started))
+            await self._sleep_until(self.global_bucket.reserve(time.monotonic()))
+        finally:
+            self._waiting -= 1
+            delay.observe(time.monotonic() - started)
+
+    @staticmethod
+    async def _sleep_until(at: float):
+        pause = at - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is not None:
+            self._chats.move_to_end(chat_id)
+            return bucket
+
+        # Least recently used first: drop buckets that have fully refilled
+        now = time.monotonic()
+        while len(self._chats) >= MAX_IDLE_CHATS:
+            oldest = next(iter(self._chats.values()))
+            if not oldest.idle(now):
+                break
+            self._chats.popitem(last=False)
+        bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _unchanged(self, method: TelegramMethod) -> Optional[Message]:
+        """The last result for an edit that would leave the message as this process last sent it."""
+        sent = self._sent.get((method.chat_id, method.message_id))
+        if sent is None or sent["markup"] != _fingerprint(method, MARKUP_FIELDS):
+            return None
+        if isinstance(method, EditMessageText) and sent["text"] != _fingerprint(method, TEXT_FIELDS):
+            return None
+        return sent["message"]
+
+    def _remember(self, method: TelegramMethod, result):
+        if not isinstance(result, Message):
+            return
+        key = (method.chat_id, result.message_id)
+        sent = self._sent.pop(key, None) or {"text": None}
+        if hasattr(method, "text"):
+            sent["text"] = _fingerprint(method, TEXT_FIELDS)
+        sent["markup"] = _fingerprint(method, MARKUP_FIELDS)
+        sent["message"] = result
+        self._sent[key] = sent
+        if len(self._sent) > MAX_TRACKED_MESSAGES:
+            self._sent.popitem(last=False)
+
+
+def _fingerprint(method: TelegramMethod, fields: tuple) -> str:
+    return repr(tuple(_plain(getattr(method, field, None)) for field in fields))
+
+
+def _plain(value):
+    if isinstance(value, BaseModel):
+        return value.model_dump(exclude_none=True)
+    if isinstance(value, list):
+        return [_plain(item) for item in value]
+    return value
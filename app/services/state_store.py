@@ -0,0 +1,222 @@
+"""Durable bot state: FSM storage and pending buffers backed by SQLite (WAL)."""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+logger = logging.getLogger(__name__)
+
+_DELETED = object()
+
+
+class StateStore:
+    """Namespaced key/value store with in-memory reads and coalesced writes.
+
+    Reads and writes hit a dict, so per-update cost is a few dict operations.
+    Changed keys are serialized and written to SQLite in one transaction at
+    most every `flush_interval` seconds. With path=None nothing is persisted.
+    """
+
+    def __init__(self, path: Optional[str], flush_interval: float = 0.05):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._data: dict[str, dict[str, Any]] = {}
+        self._dirty: set[tuple[str, str]] = set()
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        # SQLite work stays on one thread so writes are serialized
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-store")
+
+        if path:
+            self._open()
+            self._load()
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("pragma journal_mode=wal")
+        self._conn.execute("pragma synchronous=normal")
+        self._conn.execute(
+            "create table if not exists state ("
+            " namespace text not null,"
+            " key text not null,"
+            " value text not null,"
+            " primary key (namespace, key))"
+        )
+        self._conn.commit()
+
+    def _load(self):
+        rows = self._conn.execute("select namespace, key, value from state").fetchall()
+        for namespace, key, value in rows:
+            self._data.setdefault(namespace, {})[key] = json.loads(value)
+        if rows:
+            logger.info(f"Restored {len(rows)} state entries from {self.path}")
+
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        return self._data.get(namespace, {}).get(key, default)
+
+    def set(self, namespace: str, key: str, value: Any):
+        """Store value; it is serialized at flush time, so later in-place changes are kept too."""
+        self._data.setdefault(namespace, {})[key] = value
+        self._mark_dirty(namespace, key)
+
+    def delete(self, namespace: str, key: str):
+        if self._data.get(namespace, {}).pop(key, _DELETED) is not _DELETED:
+            self._mark_dirty(namespace, key)
+
+    def items(self, namespace: str) -> list[tuple[str, Any]]:
+        return list(self._data.get(namespace, {}).items())
+
+    def keys(self, namespace: str) -> list[str]:
+        return list(self._data.get(namespace, {}))
+
+    def _mark_dirty(self, namespace: str, key: str):
+        if self._conn is None:
+            return
+        self._dirty.add((namespace, key))
+        if self._flush_handle is None and (self._flush_task is None or self._flush_task.done()):
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self.flush_interval, self._start_flush)
+
+    def _start_flush(self):
+        self._flush_handle = None
+        self._flush_task = asyncio.create_task(self.flush())
+
+    async def flush(self):
+        """Write all changed keys in a single transaction."""
+        if self._conn is None or not self._dirty:
+            return
+
+        dirty, self._dirty = self._dirty, set()
+        upserts, deletes = [], []
+        for namespace, key in dirty:
+            value = self._data.get(namespace, {}).get(key, _DELETED)
+            if value is _DELETED:
+                deletes.append((namespace, key))
+            else:
+                upserts.append((namespace, key, json.dumps(value, ensure_ascii=False)))
+
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self._write, upserts, deletes)
+        except Exception:
+            logger.exception("Failed to persist bot state")
+            self._dirty |= dirty
+
+        # Keys changed while we were writing get their own flush
+        if self._dirty and self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.flush_interval, self._start_flush)
+
+    def _write(self, upserts: list[tuple], deletes: list[tuple]):
+        with self._conn:
+            if upserts:
+                self._conn.executemany(
+                    "insert into state (namespace, key, value) values (?, ?, ?) "
+                    "on conflict (namespace, key) do update set value = excluded.value",
+                    upserts
+                )
+            if deletes:
+                self._conn.executemany("delete from state where namespace = ? and key = ?", deletes)
+
+    async def close(self):
+        """Flush pending writes and close the database."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._flush_task is not None:
+            await self._flush_task
+        await self.flush()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        self._executor.shutdown(wait=False)
+
+
+class StoredDict(MutableMapping):
+    """Dict view over one StateStore namespace; tuple keys are JSON-encoded."""
+
+    def __init__(self, store: StateStore, namespace: str):
+        self.store = store
+        self.namespace = namespace
+
+    @staticmethod
+    def _encode(key) -> str:
+        return json.dumps(list(key) if isinstance(key, tuple) else key)
+
+    @staticmethod
+    def _decode(raw: str):
+        key = json.loads(raw)
+        return tuple(key) if isinstance(key, list) else key
+
+    def __getitem__(self, key):
+        value = self.store.get(self.namespace, self._encode(key), _DELETED)
+        if value is _DELETED:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.store.set(self.namespace, self._encode(key), value)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.store.delete(self.namespace, self._encode(key))
+
+    def __contains__(self, key) -> bool:
+        return self.store.get(self.namespace, self._encode(key), _DELETED) is not _DELETED
+
+    def __iter__(self):
+        return iter([self._decode(k) for k in self.store.keys(self.namespace)])
+
+    def __len__(self) -> int:
+        return len(self.store.keys(self.namespace))
+
+
+class FSMStorage(BaseStorage):
+    """aiogram FSM storage on top of StateStore."""
+
+    namespace = "fsm"
+
+    def __init__(self, store: StateStore):
+        self.store = store
+        self.key_builder = DefaultKeyBuilder(with_destiny=True)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = self._record(key)
+        record["state"] = state.state if isinstance(state, State) else state
+        self._save(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return self._record(key)["state"]
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        record = self._record(key)
+        record["data"] = dict(data)
+        self._save(key, record)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        return dict(self._record(key)["data"])
+
+    async def close(self) -> None:
+        await self.store.close()
+
+    def _record(self, key: StorageKey) -> dict:
+        record = self.store.get(self.namespace, self.key_builder.build(key))
+        return dict(record) if record else {"state": None, "data": {}}
+
+    def _save(self, key: StorageKey, record: dict):
+        storage_key = self.key_builder.build(key)
+        if record["state"] is None and not record["data"]:
+            self.store.delete(self.namespace, storage_key)
+        else:
+            self.store.set(self.namespace, storage_key, record)
@@ -1,6 +1,12 @@
 """Supabase client initialization."""
+import asyncio
 import os
-from supabase import create_client, Client
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from supabase import create_client, Client, ClientOptions
+
+from app.config import DB_MAX_WORKERS, DB_TIMEOUT_SECONDS
 
 url = os.getenv("SUPABASE_URL")
 key = os.getenv("SUPABASE_KEY")
@@ -15,4 +21,22 @@ if not url or not key:
         f".env file exists: {env_exists}"
     )
 
-supabase: Client = create_client(url, key)
+# One keep-alive connection per executor thread, shared by every query
+http_client = httpx.Client(
+    timeout=DB_TIMEOUT_SECONDS,
+    limits=httpx.Limits(
+        max_connections=DB_MAX_WORKERS,
+        max_keepalive_connections=DB_MAX_WORKERS
+    )
+)
+
+supabase: Client = create_client(url, key, options=ClientOptions(httpx_client=http_client))
+
+# The Supabase client is synchronous: queries run here instead of on the event loop
+executor = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix="supabase")
+
+
+async def execute(query):
+    """Run a query builder's blocking execute() in the database thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, query.execute)
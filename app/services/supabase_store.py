@@ -0,0 +1,434 @@
+"""Lead storage in Supabase (PostgREST), one round-trip per call."""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Optional
+
+from postgrest import ReturnMethod
+from postgrest.exceptions import APIError
+
+from app.services.search import word_similarity
+from app.services.supabase import supabase, execute
+
+logger = logging.getLogger(__name__)
+
+# PostgREST / Postgres error codes for "function does not exist"
+MISSING_FUNCTION_CODES = ("PGRST202", "42883")
+
+# Lead ids per in_() filter, keeps the request URL well under proxy limits
+STATS_ID_CHUNK_SIZE = 200
+
+# Columns needed to render the /leads list (plus keyset cursor fields)
+LEAD_LIST_COLUMNS = "id, brand, status, is_hot, status_rank, updated_at"
+
+# Columns returned by /search (same shape as the search_leads RPC rows)
+SEARCH_COLUMNS = "id, brand, contact_name, contact_username, status, is_hot"
+
+# Rows the ilike fallback scans before ranking in Python
+SEARCH_FALLBACK_SCAN = 200
+
+# Compare-and-set attempts for the toggle fallback before giving up
+TOGGLE_CAS_ATTEMPTS = 3
+
+# Rows per request when paging (PostgREST caps responses at 1000)
+PAGE_SIZE = 1000
+
+# Message rows per insert request in bulk imports
+INSERT_CHUNK_SIZE = 1000
+
+
+class SupabaseStore:
+    """Lead rows and messages in Supabase. Used by app.services.database."""
+
+    def __init__(self):
+        # Flipped off after the first "missing function" error so we stop retrying the RPC
+        self._stats_rpc_available = True
+        self._search_rpc_available = True
+        self._toggle_rpc_available = True
+        self._history_rpc_available = True
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def insert_lead(self, lead: dict, messages: list[dict]) -> tuple[dict, list[dict]]:
+        """Insert a lead and its messages; returns both as stored."""
+        result = await execute(supabase.table("leads").insert(lead))
+        row = result.data[0]
+        if not messages:
+            return row, []
+
+        result = await execute(supabase.table("lead_messages").insert(
+            [{**message, "lead_id": row["id"]} for message in messages]
+        ))
+        # The row was returned before the messages (and the message_count trigger) went in
+        row["message_count"] = len(messages)
+        return row, result.data
+
+    async def insert_leads(self, leads: list[dict], messages: list[list[dict]]) -> list[dict]:
+        """Insert many leads with one request, then their messages in INSERT_CHUNK_SIZE-row requests."""
+        result = await execute(supabase.table("leads").insert(leads))
+        rows = result.data
+
+        message_rows = [
+            {**message, "lead_id": row["id"]}
+            for row, lead_messages in zip(rows, messages)
+            for message in lead_messages
+        ]
+        for i in range(0, len(message_rows), INSERT_CHUNK_SIZE):
+            await execute(supabase.table("lead_messages").insert(message_rows[i:i + INSERT_CHUNK_SIZE]))
+
+        for row, lead_messages in zip(rows, messages):
+            row["message_count"] = len(lead_messages)
+        return rows
+
+    async def add_messages(self, lead_id: int, messages: list[dict]) -> Optional[dict]:
+        """Append messages and bump updated_at; returns the lead row."""
+        if messages:
+            await execute(supabase.table("lead_messages").insert(
+                [{**message, "lead_id": lead_id} for message in messages]
+            ))
+        return await self.update_lead(lead_id, None, {})
+
+    async def insert_events(self, events: list[dict]):
+        """Append lead_status_events rows (app.services.lead_events batches them)."""
+        await execute(supabase.table("lead_status_events").insert(events, returning=ReturnMethod.minimal))
+
+    async def update_lead(self, lead_id: int, user_id: Optional[int], values: dict) -> Optional[dict]:
+        """Set values and updated_at (scoped to user_id unless None); returns the row."""
+        query = supabase.table("leads").update({
+            **values,
+            "updated_at": datetime.utcnow().isoformat()
+        }).eq("id", lead_id)
+        if user_id is not None:
+            query = query.eq("user_id", user_id)
+        result = await execute(query)
+        return result.data[0] if result.data else None
+
+    async def toggle_hot(self, lead_id: int, user_id: int) -> Optional[dict]:
+        if self._toggle_rpc_available:
+            try:
+                result = await execute(supabase.rpc("toggle_lead_hot", {
+                    "p_lead_id": lead_id,
+                    "p_user_id": user_id
+                }))
+                return result.data[0] if result.data else None
+            except APIError as e:
+                if e.code not in MISSING_FUNCTION_CODES:
+                    raise
+                logger.warning("toggle_lead_hot RPC is missing, falling back to compare-and-set")
+                self._toggle_rpc_available = False
+
+        return await self._toggle_hot_cas(lead_id, user_id)
+
+    async def _toggle_hot_cas(self, lead_id: int, user_id: int) -> Optional[dict]:
+        """Toggle via read + conditional update; a concurrent toggle makes the update miss and retry."""
+        for _ in range(TOGGLE_CAS_ATTEMPTS):
+            result = await execute(
+                supabase.table("leads")
+                .select("is_hot")
+                .eq("id", lead_id)
+                .eq("user_id", user_id)
+            )
+            if not result.data:
+                return None
+
+            current = result.data[0]["is_hot"]
+            query = (
+                supabase.table("leads")
+                .update({
+                    "is_hot": not current,
+                    "updated_at": datetime.utcnow().isoformat()
+                })
+                .eq("id", lead_id)
+                .eq("user_id", user_id)
+            )
+            query = query.is_("is_hot", "null") if current is None else query.eq("is_hot", current)
+            result = await execute(query)
+            if result.data:
+                return result.data[0]
+
+        raise RuntimeError(f"Could not toggle is_hot for lead {lead_id}: concurrent updates")
+
+    async def fetch_lead(self, lead_id: int, user_id: int) -> Optional[dict]:
+        result = await execute(
+            supabase.table("leads")
+            .select("*")
+            .eq("id", lead_id)
+            .eq("user_id", user_id)
+        )
+        return result.data[0] if result.data else None
+
+    async def fetch_messages(self, lead_id: int) -> list[dict]:
+        result = await execute(
+            supabase.table("lead_messages")
+            .select("*")
+            .eq("lead_id", lead_id)
+            .order("created_at")
+        )
+        return result.data
+
+    async def leads_by_status(self, user_id: int, status: Optional[str]) -> list[dict]:
+        query = supabase.table("leads").select("*").eq("user_id", user_id)
+        if status:
+            query = query.eq("status", status)
+        result = await execute(query.order("updated_at", desc=True))
+        return result.data
+
+    async def leads_page(
+        self,
+        user_id: int,
+        limit: int,
+        after: Optional[tuple],
+        before: Optional[tuple],
+        offset: int
+    ) -> list[dict]:
+        query = supabase.table("leads").select(LEAD_LIST_COLUMNS).eq("user_id", user_id)
+
+        backwards = before is not None
+        if after is not None:
+            query = query.or_(_keyset_filter(after, ("gt", "lt", "lt")))
+        elif backwards:
+            query = query.or_(_keyset_filter(before, ("lt", "gt", "gt")))
+
+        query = (
+            query
+            .order("status_rank", desc=backwards)
+            .order("updated_at", desc=not backwards)
+            .order("id", desc=not backwards)
+        )
+
+        if after is None and not backwards and offset:
+            query = query.range(offset, offset + limit - 1)
+        else:
+            query = query.limit(limit)
+
+        result = await execute(query)
+        rows = result.data
+        if backwards:
+            rows.reverse()
+        return rows
+
+    async def hot_leads(self, user_id: int, limit: int) -> list[dict]:
+        result = await execute(
+            supabase.table("leads")
+            .select(LEAD_LIST_COLUMNS)
+            .eq("user_id", user_id)
+            .eq("is_hot", True)
+            .order("updated_at", desc=True)
+            .limit(limit)
+        )
+        return result.data
+
+    async def count_leads(self, user_id: int) -> int:
+        result = await execute(
+            supabase.table("leads")
+            .select("id", count="exact", head=True)
+            .eq("user_id", user_id)
+        )
+        return result.count or 0
+
+    async def search(self, user_id: int, query: str, limit: int) -> list[dict]:
+        """search_leads RPC (pg_trgm + full-text); without it, ilike ranked by trigram similarity."""
+        if self._search_rpc_available:
+            try:
+                result = await execute(supabase.rpc("search_leads", {
+                    "p_user_id": user_id,
+                    "p_query": query,
+                    "p_limit": limit
+                }))
+                return result.data
+            except APIError as e:
+                if e.code not in MISSING_FUNCTION_CODES:
+                    raise
+                logger.warning("search_leads RPC is missing, falling back to ilike search")
+                self._search_rpc_available = False
+
+        search_pattern = f"%{query}%"
+
+        result = await execute(
+            supabase.table("leads")
+            .select(SEARCH_COLUMNS)
+            .eq("user_id", user_id)
+            .or_(
+                f"brand.ilike.{search_pattern},contact_name.ilike.{search_pattern},"
+                f"contact_username.ilike.{search_pattern}"
+            )
+            .order("updated_at", desc=True)
+            .limit(SEARCH_FALLBACK_SCAN)
+        )
+
+        def score(lead: dict) -> float:
+            fields = (lead.get("brand"), lead.get("contact_name"), lead.get("contact_username"))
+            return max(word_similarity(query, f) for f in fields if f) if any(fields) else 0.0
+
+        return sorted(result.data, key=score, reverse=True)[:limit]
+
+    async def recent_lead(
+        self,
+        user_id: int,
+        contact_telegram_id: Optional[int],
+        contact_name: Optional[str],
+        since: str
+    ) -> Optional[dict]:
+        """Most recently updated lead for the contact (telegram id, else name) since `since`."""
+        query = supabase.table("leads").select("*").eq("user_id", user_id)
+        if contact_telegram_id:
+            query = query.eq("contact_telegram_id", contact_telegram_id)
+        elif contact_name:
+            query = query.eq("contact_name", contact_name)
+        else:
+            return None
+
+        result = await execute(query.gte("updated_at", since).order("updated_at", desc=True).limit(1))
+        return result.data[0] if result.data else None
+
+    async def recent_leads(self, since: str) -> list[dict]:
+        """Contact keys of all users' leads updated since `since`."""
+        rows, offset = [], 0
+        while True:
+            result = await execute(
+                supabase.table("leads")
+                .select("id, user_id, contact_telegram_id, contact_name, updated_at")
+                .gte("updated_at", since)
+                .order("id")
+                .range(offset, offset + PAGE_SIZE - 1)
+            )
+            rows.extend(result.data)
+            if len(result.data) < PAGE_SIZE:
+                return rows
+            offset += PAGE_SIZE
+
+    async def export_chunk(self, user_id: int, after_id: int, limit: int) -> list[dict]:
+        """Up to `limit` of the user's leads with id > after_id, each with its "messages"."""
+        result = await execute(
+            supabase.table("leads")
+            .select("*")
+            .eq("user_id", user_id)
+            .gt("id", after_id)
+            .order("id")
+            .limit(limit)
+        )
+        leads = result.data
+        by_id = {lead["id"]: lead for lead in leads}
+        for lead in leads:
+            lead["messages"] = []
+
+        lead_ids = list(by_id)
+        for i in range(0, len(lead_ids), STATS_ID_CHUNK_SIZE):
+            chunk, last_id = lead_ids[i:i + STATS_ID_CHUNK_SIZE], 0
+            # Keyset over message ids: a chunk of leads can hold more than one response
+            while True:
+                result = await execute(
+                    supabase.table("lead_messages")
+                    .select("*")
+                    .in_("lead_id", chunk)
+                    .gt("id", last_id)
+                    .order("id")
+                    .limit(PAGE_SIZE)
+                )
+                for message in result.data:
+                    by_id[message["lead_id"]]["messages"].append(message)
+                if len(result.data) < PAGE_SIZE:
+                    break
+                last_id = result.data[-1]["id"]
+        return leads
+
+    async def status_history(self, user_id: int) -> dict:
+        """Status events as columns: lead_id, status, at (epoch seconds), in no particular order.
+
+        lead_status_history RPC in one round-trip; without it, paged by id.
+        """
+        if self._history_rpc_available:
+            try:
+                result = await execute(supabase.rpc("lead_status_history", {"p_user_id": user_id}))
+                return result.data
+            except APIError as e:
+                if e.code not in MISSING_FUNCTION_CODES:
+                    raise
+                logger.warning("lead_status_history RPC is missing, falling back to paged reads")
+                self._history_rpc_available = False
+
+        history = {"lead_id": [], "status": [], "at": []}
+        last_id = 0
+        while True:
+            result = await execute(
+                supabase.table("lead_status_events")
+                .select("id, lead_id, value, created_at")
+                .eq("user_id", user_id)
+                .in_("kind", ["created", "status"])
+                .gt("id", last_id)
+                .order("id")
+                .limit(PAGE_SIZE)
+            )
+            for row in result.data:
+                history["lead_id"].append(row["lead_id"])
+                history["status"].append(row["value"])
+                history["at"].append(datetime.fromisoformat(row["created_at"]).timestamp())
+            if len(result.data) < PAGE_SIZE:
+                return history
+            last_id = result.data[-1]["id"]
+
+    async def stats(self, user_id: int) -> dict:
+        if self._stats_rpc_available:
+            try:
+                result = await execute(supabase.rpc("lead_stats", {"p_user_id": user_id}))
+                stats = result.data
+                return {
+                    "total_leads": stats["total_leads"],
+                    "total_messages": stats["total_messages"],
+                    "by_status": stats["by_status"] or {}
+                }
+            except APIError as e:
+                if e.code not in MISSING_FUNCTION_CODES:
+                    raise
+                logger.warning("lead_stats RPC is missing, falling back to batched counts")
+                self._stats_rpc_available = False
+
+        return await self._stats_batched(user_id)
+
+    async def _stats_batched(self, user_id: int) -> dict:
+        """Compute stats with one leads query plus one count per chunk of lead ids."""
+        leads_result = await execute(
+            supabase.table("leads")
+            .select("id, status")
+            .eq("user_id", user_id)
+        )
+
+        status_counts = {}
+        for lead in leads_result.data:
+            status = lead["status"]
+            status_counts[status] = status_counts.get(status, 0) + 1
+
+        lead_ids = [lead["id"] for lead in leads_result.data]
+        chunks = [
+            lead_ids[i:i + STATS_ID_CHUNK_SIZE]
+            for i in range(0, len(lead_ids), STATS_ID_CHUNK_SIZE)
+        ]
+        counts = await asyncio.gather(*(
+            execute(
+                supabase.table("lead_messages")
+                .select("id", count="exact", head=True)
+                .in_("lead_id", chunk)
+            )
+            for chunk in chunks
+        ))
+
+        return {
+            "total_leads": len(lead_ids),
+            "total_messages": sum(c.count or 0 for c in counts),
+            "by_status": status_counts
+        }
+
+
+def _keyset_filter(cursor: tuple, ops: tuple[str, str, str]) -> str:
+    """Build a PostgREST or= filter for rows past a (status_rank, updated_at, id) cursor."""
+    rank, updated_at, lead_id = cursor
+    rank_op, time_op, id_op = ops
+    return (
+        f"status_rank.{rank_op}.{rank},"
+        f"and(status_rank.eq.{rank},updated_at.{time_op}.\"{updated_at}\"),"
+        f"and(status_rank.eq.{rank},updated_at.eq.\"{updated_at}\",id.{id_op}.{lead_id})"
+    )
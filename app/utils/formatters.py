@@ -1,9 +1,17 @@
 """Message formatters for the bot."""
-from app.config import STATUSES, STATUS_NAMES
+from datetime import datetime, timezone
+from typing import Optional
+from app.config import STATUSES, STATUS_NAMES, FUNNEL_TOP_TRANSITIONS
 
 
-def format_lead(lead: dict, message_count: int = 0) -> str:
-    """Format lead info for display."""
+# Shown under a card while the AI parse is still running
+ENRICHING_NOTE = "\n\n⏳ Распознаю бренд, запрос и даты..."
+
+
+def format_lead(lead: dict, message_count: Optional[int] = None, enriching: bool = False) -> str:
+    """Format lead info for display (message count defaults to lead's message_count)."""
+    if message_count is None:
+        message_count = lead.get("message_count") or 0
     status = lead.get("status", "new")
     status_emoji = STATUSES.get(status, "🆕")
     status_name = STATUS_NAMES.get(status, "New")
@@ -27,10 +35,10 @@ def format_lead(lead: dict, message_count: int = 0) -> str:
 📅 Даты: {dates}
 📨 Сообщений: {message_count}
 
-📊 Статус: {status_emoji} {status_name}"""
+📊 Статус: {status_emoji} {status_name}""" + (ENRICHING_NOTE if enriching else "")
 
 
-def format_new_lead(lead: dict, message_count: int) -> str:
+def format_new_lead(lead: dict, message_count: int, enriching: bool = False) -> str:
     """Format new lead announcement."""
     status = lead.get("status", "new")
     status_emoji = STATUSES.get(status, "🆕")
@@ -52,7 +60,7 @@ def format_new_lead(lead: dict, message_count: int) -> str:
 📅 Даты: {dates}
 📨 Сообщений: {message_count}
 
-📊 Статус: {status_emoji} {status_name}"""
+📊 Статус: {status_emoji} {status_name}""" + (ENRICHING_NOTE if enriching else "")
 
 
 def format_lead_short(lead: dict) -> str:
@@ -70,6 +78,21 @@ def format_lead_short(lead: dict) -> str:
     return text
 
 
+def format_search_results(query: str, leads: list[dict]) -> str:
+    """Format ranked search results, with a message snippet when one matched."""
+    result = f"🔍 Результаты по «{query}»:\n\n"
+    for lead in leads:
+        result += format_lead_short(lead) + "\n"
+        snippet = lead.get("snippet")
+        if snippet:
+            result += f"   💬 {snippet}\n"
+
+    if len(result) > 4000:
+        result = result[:4000] + "\n\n... (результаты обрезаны)"
+
+    return result.strip()
+
+
 def format_originals(messages: list[dict]) -> str:
     """Format original messages for display."""
     if not messages:
@@ -88,8 +111,8 @@ def format_originals(messages: list[dict]) -> str:
     return result.strip()
 
 
-def format_stats(stats: dict) -> str:
-    """Format statistics for display."""
+def format_stats(stats: dict, funnel: Optional[dict] = None) -> str:
+    """Format statistics for display, with funnel timing when given."""
     result = "📊 Статистика CRM\n\n"
     result += f"📥 Всего лидов: {stats['total_leads']}\n"
     result += f"📨 Всего сообщений: {stats['total_messages']}\n\n"
@@ -106,9 +129,56 @@ def format_stats(stats: dict) -> str:
         rate = (contracts / total) * 100
         result += f"\n✅ Конверсия в контракт: {rate:.1f}%"
 
+    if funnel and funnel["events"]:
+        result += format_funnel(funnel)
+
     return result
 
 
+def format_duration(seconds: float) -> str:
+    """Short human duration: minutes, hours or days."""
+    if seconds < 3600:
+        return f"{max(seconds // 60, 1):.0f} мин"
+    if seconds < 48 * 3600:
+        return f"{seconds / 3600:.0f} ч"
+    return f"{seconds / 86400:.0f} дн"
+
+
+def format_funnel(funnel: dict, top_transitions: int = FUNNEL_TOP_TRANSITIONS) -> str:
+    """Stage timing, frequent transitions and weekly cohorts (app.services.funnel output)."""
+    result = "\n\n⏱ Время на этапе (медиана / 90%):\n"
+    for stage in funnel["stages"]:
+        status = stage["status"]
+        if status in ("contract", "lost") or not (stage["stays"] or stage["open"]):
+            continue
+        line = f"{STATUSES.get(status, status)} {STATUS_NAMES.get(status, status)}: "
+        if stage["stays"]:
+            line += f"{format_duration(stage['p50'])} / {format_duration(stage['p90'])}"
+        else:
+            line += "—"
+        if stage["open"]:
+            line += f" · сейчас {stage['open']}, ~{format_duration(stage['open_p50'])}"
+        result += line + "\n"
+
+    transitions = funnel["transitions"][:top_transitions]
+    if transitions:
+        result += "\n🔀 Частые переходы:\n"
+        for from_status, to_status, count in transitions:
+            result += f"{STATUSES.get(from_status, from_status)} → {STATUSES.get(to_status, to_status)} {count}\n"
+
+    cohorts = [c for c in funnel["cohorts"] if c["leads"]]
+    if cohorts:
+        result += "\n📅 Лиды по неделям (создано → ✅ / ❌):\n"
+        for cohort in cohorts:
+            week = datetime.fromtimestamp(cohort["week_start"], tz=timezone.utc)
+            rate = cohort["contract"] / cohort["leads"] * 100
+            result += (
+                f"{week:%d.%m}: {cohort['leads']} → {cohort['contract']} ({rate:.0f}%) / {cohort['lost']}\n"
+            )
+
+    return result.rstrip("\n")
+
+
 def format_leads_by_status(leads: list[dict]) -> str:
     """Format leads grouped by status."""
     if not leads:
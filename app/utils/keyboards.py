@@ -20,7 +20,10 @@ def get_lead_keyboard(lead_id: int, is_hot: bool = False) -> InlineKeyboardMarku
 
     # Hot toggle button
     hot_text = "🔥 Важный ✓" if is_hot else "🔥 Важный"
-    hot_button = [InlineKeyboardButton(text=hot_text, callback_data=f"toggle_hot:{lead_id}")]
+    hot_button = [
+        InlineKeyboardButton(text=hot_text, callback_data=f"toggle_hot:{lead_id}"),
+        InlineKeyboardButton(text="🔄 Перепарсить", callback_data=f"reparse:{lead_id}")
+    ]
 
     action_buttons = [
         InlineKeyboardButton(text="📜 Оригиналы", callback_data=f"originals:{lead_id}"),
@@ -0,0 +1,184 @@
+"""In-process metrics: counters, gauges and histograms with optional labels.
+
+Recording is a dict update; nothing is formatted until `render()` is called
+for a /metrics scrape (app/monitoring.py).
+"""
+import bisect
+import functools
+import math
+import time
+from typing import Any, Callable, Optional
+
+# Seconds; also used for sizes when no buckets are given
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY: dict = {}
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+class Counter:
+    """Monotonically increasing value per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(_label_key(labels), 0)
+
+
+class Gauge:
+    """Current value per label set, or a callback evaluated on read."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, fn: Optional[Callable[[], float]] = None):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.values: dict[tuple, float] = {}
+
+    def set(self, value: float, **labels):
+        self.values[_label_key(labels)] = value
+
+    def get(self, **labels) -> float:
+        if self.fn is not None:
+            return self.fn()
+        return self.values.get(_label_key(labels), 0)
+
+
+class Histogram:
+    """Bucketed observations with count and sum per label set."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [bucket counts..., +Inf count, sum]
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        series = self.values.get(key)
+        if series is None:
+            series = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def count(self, **labels) -> int:
+        series = self.values.get(_label_key(labels))
+        return sum(series[:-1]) if series else 0
+
+    def total(self, **labels) -> float:
+        series = self.values.get(_label_key(labels))
+        return series[-1] if series else 0.0
+
+
+def _register(metric):
+    existing = REGISTRY.get(metric.name)
+    if existing is not None:
+        return existing
+    REGISTRY[metric.name] = metric
+    return metric
+
+
+def counter(name: str, help_text: str) -> Counter:
+    """Get or create a counter."""
+    return _register(Counter(name, help_text))
+
+
+def gauge(name: str, help_text: str, fn: Optional[Callable[[], float]] = None) -> Gauge:
+    """Get or create a gauge; fn makes it computed at read time."""
+    return _register(Gauge(name, help_text, fn))
+
+
+def histogram(name: str, help_text: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    """Get or create a histogram."""
+    return _register(Histogram(name, help_text, buckets))
+
+
+def timed(
+    latency: Histogram,
+    errors: Optional[Counter] = None,
+    sizes: Optional[Histogram] = None,
+    size_of: Callable[[Any], Optional[float]] = len
+):
+    """Decorator for async functions: latency, errors and result size labelled call=<function name>."""
+    def decorate(fn):
+        call = fn.__name__
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception:
+                if errors is not None:
+                    errors.inc(call=call)
+                raise
+            finally:
+                latency.observe(time.perf_counter() - started, call=call)
+            if sizes is not None:
+                size = size_of(result)
+                if size is not None:
+                    sizes.observe(size, call=call)
+            return result
+
+        return wrapper
+    return decorate
+
+
+def render() -> str:
+    """All registered metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY.values():
+        lines.append(f"# HELP {metric.name} {_escape_help(metric.help)}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        if isinstance(metric, Histogram):
+            for key, series in sorted(metric.values.items()):
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (math.inf,), series[:-1]):
+                    cumulative += count
+                    le = "+Inf" if bound == math.inf else _number(bound)
+                    lines.append(f"{metric.name}_bucket{_labels(key + (('le', le),))} {cumulative}")
+                lines.append(f"{metric.name}_sum{_labels(key)} {_number(series[-1])}")
+                lines.append(f"{metric.name}_count{_labels(key)} {cumulative}")
+        elif isinstance(metric, Gauge) and metric.fn is not None:
+            lines.append(f"{metric.name} {_number(metric.fn())}")
+        else:
+            for key, value in sorted(metric.values.items()):
+                lines.append(f"{metric.name}{_labels(key)} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def _labels(key: tuple) -> str:
+    if not key:
+        return ""
+    pairs = ",".join(f'{name}="{_escape_label(value)}"' for name, value in key)
+    return "{" + pairs + "}"
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
@@ -0,0 +1,102 @@
+"""Webhook run mode: updates arrive over HTTP on an embedded aiohttp server."""
+import asyncio
+import logging
+import secrets
+import time
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from app.config import (
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_MAX_IN_FLIGHT
+)
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# Telegram accepts 1-100 simultaneous webhook connections
+TELEGRAM_MAX_CONNECTIONS = 100
+
+request_latency = metrics.histogram("crm_webhook_request_seconds", "Webhook update handling time")
+requests_waiting = metrics.gauge("crm_webhook_requests_waiting", "Webhook updates waiting for an in-flight slot")
+
+
+def in_flight_limit(limit: int):
+    """aiohttp middleware: at most `limit` webhook updates are processed at once.
+
+    Extra requests wait for a slot instead of spawning unbounded tasks; Telegram
+    keeps at most max_connections requests open, so the wait queue stays short.
+    """
+    slots = asyncio.Semaphore(limit)
+    waiting = 0
+    requests_waiting.fn = lambda: waiting
+
+    @web.middleware
+    async def middleware(request: web.Request, handler):
+        nonlocal waiting
+        if request.path != WEBHOOK_PATH:
+            return await handler(request)
+
+        started = time.monotonic()
+        waiting += 1
+        try:
+            await slots.acquire()
+        finally:
+            waiting -= 1
+        try:
+            return await handler(request)
+        finally:
+            slots.release()
+            request_latency.observe(time.monotonic() - started)
+
+    return middleware
+
+
+def build_app(dispatcher: Dispatcher, bot: Bot, secret: str) -> web.Application:
+    app = web.Application(middlewares=[in_flight_limit(WEBHOOK_MAX_IN_FLIGHT)])
+
+    # Handle in the request so the in-flight limit covers the whole update
+    SimpleRequestHandler(
+        dispatcher,
+        bot,
+        handle_in_background=False,
+        secret_token=secret
+    ).register(app, path=WEBHOOK_PATH)
+
+    async def healthz(request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok", "mode": "webhook"})
+
+    app.router.add_get("/healthz", healthz)
+    setup_application(app, dispatcher, bot=bot)
+    return app
+
+
+async def run_webhook(dispatcher: Dispatcher, bot: Bot):
+    """Serve the webhook until cancelled; registers it with Telegram if WEBHOOK_URL is set."""
+    if not WEBHOOK_SECRET and not WEBHOOK_URL:
+        raise RuntimeError("Set WEBHOOK_SECRET when the webhook is registered outside the bot (no WEBHOOK_URL)")
+    secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    app = build_app(dispatcher, bot, secret)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    logger.info(f"Webhook server listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+            secret_token=secret,
+            max_connections=min(WEBHOOK_MAX_IN_FLIGHT, TELEGRAM_MAX_CONNECTIONS),
+            allowed_updates=dispatcher.resolve_used_update_types()
+        )
+        logger.info(f"Webhook registered at {WEBHOOK_URL}")
+    else:
+        logger.info("WEBHOOK_URL is not set, expecting the webhook to be registered elsewhere")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
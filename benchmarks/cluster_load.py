@@ -0,0 +1,75 @@
+"""Throughput scaling with WORKERS: the sharded bot against a stub Bot API.
+
+Runs the webhook benchmark (see benchmarks/webhook_load.py) once per worker
+count and reports updates/s and the speedup over a single worker. Updates come
+from distinct users, so they spread evenly over the workers. Scaling is bounded
+by CPU cores: run it on a machine with at least as many cores as workers + 1
+(the front and the load generator need some too).
+
+    python -m benchmarks.cluster_load --workers 1 2 4 --updates 4000
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from aiohttp import ClientSession
+
+from benchmarks import webhook_load
+from benchmarks.webhook_load import StubBotAPI, feed_webhook, make_update, start_stub, wait_ready
+
+
+async def wait_all_workers(session: ClientSession, timeout: float = 120):
+    """/healthz reports "ok" once every worker has started (single-process mode: at once)."""
+    await wait_ready(session, "webhook", timeout)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        async with session.get(f"http://127.0.0.1:{webhook_load.WEBHOOK_PORT}/healthz") as response:
+            if (await response.json())["status"] == "ok":
+                return
+        await asyncio.sleep(0.2)
+    raise RuntimeError("workers did not start")
+
+
+async def run(workers: int, count: int, concurrency: int) -> float:
+    stub = StubBotAPI()
+    stub.expected = count
+    stub_runner = await start_stub(stub)
+    os.environ["WORKERS"] = str(workers)
+    process = await webhook_load.spawn_bot("webhook")
+
+    try:
+        async with ClientSession() as session:
+            await wait_all_workers(session)
+            updates = [make_update(i) for i in range(1, count + 1)]
+
+            started = time.perf_counter()
+            await feed_webhook(session, stub, updates, concurrency)
+            await asyncio.wait_for(stub.done.wait(), timeout=300)
+            elapsed = time.perf_counter() - started
+    finally:
+        process.terminate()
+        await process.wait()
+        await stub_runner.cleanup()
+
+    return count / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100, help="parallel webhook POSTs")
+    args = parser.parse_args()
+
+    print(f"cpu cores: {os.cpu_count()}")
+    print(f"{'workers':>8} {'updates/s':>10} {'speedup':>8}")
+    baseline = None
+    for workers in args.workers:
+        rate = asyncio.run(run(workers, args.updates, args.concurrency))
+        baseline = baseline or rate
+        print(f"{workers:>8} {rate:>10.0f} {rate / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,407 @@
+"""End-to-end benchmark: the real dispatcher against stub Telegram, Supabase and OpenAI.
+
+Imports app.bot in this process, points it at the stubs in benchmarks/stubs.py
+(each with a configurable latency), seeds leads and feeds synthetic Update
+objects through dp.feed_update. Per scenario it reports throughput, p50/p99
+latency and round-trips per update to each service.
+
+Scenarios:
+  forwards  users forward bursts of pitches; latency is last forward -> lead card
+  taps      card button storm (view, hot, status, originals, back) on seeded leads
+  leads     /leads and "next page" deep links for users with --big-leads leads
+  stats     /stats for every seeded user
+  search    /search by brand for small users
+  bigsearch search_leads itself (no Telegram) for users with --big-leads leads;
+            the target is 50 ms at 100k leads:
+            --backend memory --scenario bigsearch --big-users 1 --big-leads 100000
+
+The stubs share this process's CPU, so compare runs with each other rather than
+with production numbers.
+
+    python -m benchmarks.e2e
+    python -m benchmarks.e2e --scenario leads --big-leads 10000 --db-latency 0.02
+    python -m benchmarks.e2e --backend memory --scenario taps --updates 5000
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qs, urlparse
+
+# app.config reads the environment on import: app modules (and benchmarks.stubs,
+# which uses them) are imported only after configure()
+from benchmarks.heuristics_corpus import CORPUS
+
+TOKEN = "123456:benchmark"
+SCENARIOS = ("forwards", "taps", "leads", "stats", "search", "bigsearch")
+BRANDS = ("Ozon", "Nike", "Skillbox", "Самокат", "Nordic Fox", "Лисья Нора", "Goldapple", "Пряжа и Ко")
+# Later messages of a burst; the first one is a pitch from the heuristics corpus
+FOLLOW_UPS = ("Подскажите, пожалуйста, стоимость.", "Ждём ответа!", "Можем созвониться?", "Спасибо 🙏")
+SMALL_USER_BASE = 1000
+BIG_USER_BASE = 9000
+FORWARD_USER_BASE = 100000
+SEED_CHUNK = 1000
+SETTLE_TIMEOUT_SECONDS = 120
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def configure(args, port: int):
+    """Point the bot at the stubs; must run before app.bot is imported."""
+    base = f"http://127.0.0.1:{port}"
+    os.environ.update({
+        "BOT_TOKEN": TOKEN,
+        "TELEGRAM_API_URL": base,
+        "SUPABASE_URL": base,
+        "SUPABASE_KEY": "benchmark",
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_BASE_URL": f"{base}/v1",
+        "STORAGE_BACKEND": args.backend,
+        "STATE_BACKEND": "memory",
+        "PARSE_CACHE_DB_PATH": "",
+        "METRICS_PORT": "0",
+        "LLM_RPM": "1000000",
+        "LLM_TPM": "1000000000",
+    })
+    from app import config
+    if not args.telegram_limits:
+        # Measure the bot, not Telegram's flood limits
+        config.SEND_GLOBAL_PER_SECOND = 1e6
+        config.SEND_CHAT_PER_SECOND = 1e6
+        config.SEND_CHAT_BURST = 1000
+    if args.batch_timeout is not None:
+        config.BATCH_TIMEOUT_SECONDS = args.batch_timeout
+
+
+# === Synthetic updates ===
+
+class Updates:
+    def __init__(self, bot):
+        self.bot = bot
+        self.next_id = 1
+
+    def _wrap(self, key: str, payload: dict):
+        from aiogram.types import Update
+        update_id = self.next_id
+        self.next_id += 1
+        return Update.model_validate({"update_id": update_id, key: payload}, context={"bot": self.bot})
+
+    def _message(self, user_id: int, **fields) -> dict:
+        return {
+            "message_id": self.next_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"},
+            **fields
+        }
+
+    def command(self, user_id: int, text: str):
+        command = text.split()[0]
+        return self._wrap("message", self._message(
+            user_id, text=text, entities=[{"type": "bot_command", "offset": 0, "length": len(command)}]
+        ))
+
+    def forward(self, user_id: int, sender_id: int, sender_name: str, text: str):
+        now = int(time.time())
+        sender = {"id": sender_id, "is_bot": False, "first_name": sender_name}
+        return self._wrap("message", self._message(
+            user_id, text=text, forward_date=now, forward_from=sender,
+            forward_origin={"type": "user", "date": now, "sender_user": sender}
+        ))
+
+    def tap(self, user_id: int, message_id: int, data: str):
+        return self._wrap("callback_query", {
+            "id": str(self.next_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"},
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "card"
+            }
+        })
+
+
+# === Seeding ===
+
+def make_leads(user_id: int, count: int, next_ids: dict, messages_per_lead: int) -> tuple[list, list]:
+    now = datetime.now(timezone.utc)
+    leads, messages = [], []
+    for i in range(count):
+        lead_id = next_ids["lead"]
+        next_ids["lead"] += 1
+        updated = now - timedelta(days=random.uniform(1, 90))
+        brand = random.choice(BRANDS)
+        leads.append({
+            "id": lead_id,
+            "user_id": user_id,
+            "contact_telegram_id": 500000 + lead_id,
+            "contact_name": f"Контакт {lead_id}",
+            "contact_username": f"contact{lead_id}",
+            "brand": f"{brand} {lead_id}",
+            "request": "Интеграция в Reels",
+            "dates": "в марте",
+            "status": random.choice(("new", "new", "replied", "waiting", "negotiating", "contract", "lost")),
+            "is_hot": random.random() < 0.05,
+            "created_at": updated.isoformat(),
+            "updated_at": updated.isoformat(),
+            "message_count": messages_per_lead
+        })
+        for j in range(messages_per_lead):
+            message_id = next_ids["message"]
+            next_ids["message"] += 1
+            messages.append({
+                "id": message_id,
+                "lead_id": lead_id,
+                "raw_text": f"{random.choice(CORPUS)[0]} ({brand})",
+                "forward_date": updated.isoformat(),
+                "created_at": updated.isoformat()
+            })
+    return leads, messages
+
+
+async def seed(backend: str, postgrest, store, leads: list, messages: list):
+    if backend == "supabase":
+        for lead in leads:
+            postgrest.insert("leads", {**lead, "message_count": 0})
+        for message in messages:
+            postgrest.insert("lead_messages", message)
+        return
+    for i in range(0, len(leads), SEED_CHUNK):
+        await store.apply_remote(leads[i:i + SEED_CHUNK], [])
+    for i in range(0, len(messages), SEED_CHUNK):
+        await store.apply_remote([], messages[i:i + SEED_CHUNK])
+
+
+# === Scenarios ===
+
+class Runner:
+    def __init__(self, args, services, telegram):
+        from app.bot import bot, dp, batcher, enrichment
+        self.args = args
+        self.services = services
+        self.telegram = telegram
+        self.bot = bot
+        self.dp = dp
+        self.batcher = batcher
+        self.enrichment = enrichment
+        self.updates = Updates(bot)
+        self.slots = asyncio.Semaphore(args.concurrency)
+        self.small: dict[int, list[int]] = {}  # user id -> lead ids
+        self.big: list[int] = []
+        self.forward_round = 0
+
+    async def feed(self, update) -> float:
+        """Feed one update; returns handler latency in seconds."""
+        async with self.slots:
+            started = time.perf_counter()
+            await self.dp.feed_update(self.bot, update)
+            return time.perf_counter() - started
+
+    async def settle(self):
+        """Wait for batches and AI enrichment started by the scenario to finish."""
+        deadline = time.monotonic() + SETTLE_TIMEOUT_SECONDS
+        while len(self.batcher) or self.batcher._tasks or len(self.enrichment):
+            if time.monotonic() > deadline:
+                raise RuntimeError("background work did not finish")
+            await asyncio.sleep(0.01)
+
+    async def forwards(self) -> tuple[int, list[float]]:
+        users, burst = self.args.forward_users, self.args.burst
+        self.forward_round += 1
+        # New sender ids each round, so no burst is offered as an addition to an earlier lead
+        base = FORWARD_USER_BASE * self.forward_round
+        last_fed: dict[int, float] = {}
+
+        async def user_burst(user_id: int):
+            sample = random.choice(CORPUS)
+            for text in [sample[0]] + [random.choice(FOLLOW_UPS) for _ in range(burst - 1)]:
+                await self.feed(self.updates.forward(user_id, base + user_id, sample[1] or "Sender", text))
+            last_fed[user_id] = time.perf_counter()
+
+        user_ids = [FORWARD_USER_BASE + i for i in range(users)]
+        await asyncio.gather(*(user_burst(u) for u in user_ids))
+        await self.settle()
+        latencies = [self.telegram.sent_at[u] - last_fed[u] for u in user_ids if self.telegram.sent_at.get(u, 0) > last_fed[u]]
+        return users * burst, latencies
+
+    async def taps(self) -> tuple[int, list[float]]:
+        actions = ("view_lead:{}", "toggle_hot:{}", "status:{}:replied", "status:{}:negotiating", "originals:{}", "back:{}")
+        users = list(self.small)
+        updates = []
+        for _ in range(self.args.updates):
+            user_id = random.choice(users)
+            lead_id = random.choice(self.small[user_id])
+            updates.append(self.updates.tap(user_id, lead_id, random.choice(actions).format(lead_id)))
+        return len(updates), await asyncio.gather(*(self.feed(u) for u in updates))
+
+    async def leads(self) -> tuple[int, list[float]]:
+        latencies: list[float] = []
+
+        async def walk(user_id: int):
+            latencies.append(await self.feed(self.updates.command(user_id, "/leads")))
+            for _ in range(self.args.pages - 1):
+                start = next_page_param(self.telegram.last.get(user_id))
+                if start is None:
+                    return
+                latencies.append(await self.feed(self.updates.command(user_id, f"/start {start}")))
+
+        await asyncio.gather(*(walk(u) for u in self.big))
+        return len(latencies), latencies
+
+    async def stats(self) -> tuple[int, list[float]]:
+        users = list(self.small) + self.big
+        updates = [self.updates.command(u, "/stats") for u in users for _ in range(self.args.repeat)]
+        random.shuffle(updates)
+        return len(updates), await asyncio.gather(*(self.feed(u) for u in updates))
+
+    async def search(self) -> tuple[int, list[float]]:
+        users = list(self.small)
+        updates = [
+            self.updates.command(random.choice(users), f"/search {random.choice(BRANDS)}")
+            for _ in range(max(1, self.args.updates // 5))
+        ]
+        return len(updates), await asyncio.gather(*(self.feed(u) for u in updates))
+
+    async def bigsearch(self) -> tuple[int, list[float]]:
+        from app.services.database import search_leads
+        # Brands, a word from the pitches and a misspelling, one call at a time
+        queries = [b.lower() for b in BRANDS] + ["интеграция", "Skilbox"]
+        latencies = []
+        for _ in range(max(1, self.args.updates // 5)):
+            started = time.perf_counter()
+            await search_leads(random.choice(self.big), random.choice(queries))
+            latencies.append(time.perf_counter() - started)
+        return len(latencies), latencies
+
+    async def run(self, name: str) -> dict:
+        before = self.services.snapshot()
+        started = time.perf_counter()
+        count, latencies = await getattr(self, name)()
+        elapsed = time.perf_counter() - started
+        calls = self.services.snapshot() - before
+
+        latencies = sorted(latencies) or [0.0]
+        return {
+            "scenario": name,
+            "updates": count,
+            "updates_per_second": count / elapsed,
+            "p50_ms": statistics.median(latencies) * 1000,
+            "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+            "telegram_per_update": calls["telegram"] / count,
+            "db_per_update": calls["db"] / count,
+            "llm_per_update": calls["llm"] / count,
+        }
+
+
+def next_page_param(message: dict) -> str:
+    """The start parameter of the "next page" button on a /leads message, if any."""
+    if not message:
+        return None
+    for row in message.get("reply_markup", {}).get("inline_keyboard", []):
+        for button in row:
+            url = button.get("url") or ""
+            if "➡" in button.get("text", "") and "start=" in url:
+                return parse_qs(urlparse(url).query)["start"][0]
+    return None
+
+
+async def run(args) -> list[dict]:
+    port = free_port()
+    configure(args, port)
+    from benchmarks.stubs import Services, start_stubs
+
+    services = Services(args.tg_latency, args.db_latency, args.llm_latency)
+    stub_runner, telegram, postgrest, _ = await start_stubs(port, services)
+
+    from app.bot import bot, restore_state
+    from app.services import database
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    try:
+        await restore_state()
+        runner = Runner(args, services, telegram)
+
+        next_ids = {"lead": 1, "message": 1}
+        all_leads, all_messages = [], []
+        for i in range(args.users):
+            user_id = SMALL_USER_BASE + i
+            leads, messages = make_leads(user_id, args.leads, next_ids, 2)
+            runner.small[user_id] = [lead["id"] for lead in leads]
+            all_leads += leads
+            all_messages += messages
+        for i in range(args.big_users):
+            user_id = BIG_USER_BASE + i
+            leads, messages = make_leads(user_id, args.big_leads, next_ids, 1)
+            runner.big.append(user_id)
+            all_leads += leads
+            all_messages += messages
+        await seed(args.backend, postgrest, database.store, all_leads, all_messages)
+
+        scenarios = SCENARIOS if args.scenario == "all" else (args.scenario,)
+        return [await runner.run(name) for name in scenarios]
+    finally:
+        await database.close_storage()
+        await bot.session.close()
+        await stub_runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", choices=SCENARIOS + ("all",), default="all")
+    parser.add_argument("--backend", choices=("supabase", "memory"), default="supabase",
+                        help="supabase = stub PostgREST over HTTP, memory = STORAGE_BACKEND=memory")
+    parser.add_argument("--users", type=int, default=200, help="users with --leads leads each")
+    parser.add_argument("--leads", type=int, default=30)
+    parser.add_argument("--big-users", type=int, default=2, help="users with --big-leads leads each")
+    parser.add_argument("--big-leads", type=int, default=10000)
+    parser.add_argument("--forward-users", type=int, default=200, help="users forwarding in the forwards scenario")
+    parser.add_argument("--burst", type=int, default=5, help="forwards per user")
+    parser.add_argument("--updates", type=int, default=2000, help="card taps (searches: a fifth of this)")
+    parser.add_argument("--pages", type=int, default=20, help="/leads pages walked per big user")
+    parser.add_argument("--repeat", type=int, default=1, help="/stats calls per user")
+    parser.add_argument("--concurrency", type=int, default=64, help="updates in flight")
+    parser.add_argument("--tg-latency", type=float, default=0.03, help="seconds per Bot API call")
+    parser.add_argument("--db-latency", type=float, default=0.01, help="seconds per PostgREST call")
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="seconds per completion")
+    parser.add_argument("--batch-timeout", type=float, default=None, help="override BATCH_TIMEOUT_SECONDS")
+    parser.add_argument("--telegram-limits", action="store_true", help="keep the send queue's flood limits")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print results as JSON lines")
+    parser.add_argument("--verbose", action="store_true", help="keep the bot's INFO logs")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    results = asyncio.run(run(args))
+
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+        return
+
+    print(f"backend={args.backend} latency tg={args.tg_latency * 1000:.0f}ms "
+          f"db={args.db_latency * 1000:.0f}ms llm={args.llm_latency * 1000:.0f}ms\n")
+    print(f"{'scenario':>9} {'updates':>8} {'upd/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'tg/upd':>7} {'db/upd':>7} {'llm/upd':>7}")
+    for r in results:
+        print(
+            f"{r['scenario']:>9} {r['updates']:>8} {r['updates_per_second']:>8.0f} {r['p50_ms']:>8.1f} "
+            f"{r['p99_ms']:>8.1f} {r['telegram_per_update']:>7.2f} {r['db_per_update']:>7.2f} "
+            f"{r['llm_per_update']:>7.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""Heuristic pre-parser benchmark: how many LLM calls the rules save on a sample corpus.
+
+Each sample is a forwarded pitch with the sender name the bot would pass as a
+contact hint and the fields a human would extract. Reports the share of samples
+that skip the LLM, per-field accuracy of confident answers and extraction time.
+
+    python -m benchmarks.heuristics_corpus --verbose
+"""
+import argparse
+import time
+
+from app.services.heuristics import CONFIDENCE_THRESHOLD, extract_fields, is_confident
+
+# (text, contact_hint, expected fields); None means "should not be extracted"
+CORPUS = [
+    (
+        "Добрый день! Меня зовут Анна, я представляю бренд «Лисья Нора». "
+        "Хотим интеграцию в Reels, публикация до 15 марта.",
+        "Анна Смирнова",
+        {"brand": "Лисья Нора", "contact": "Анна", "dates": "до 15 марта"},
+    ),
+    (
+        "Здравствуйте! Компания Ozon, предлагаем рекламу в сторис. Ссылка: https://ozon.ru/promo. Сроки 10-15 апреля",
+        "Марина",
+        {"brand": "Ozon", "contact": "Марина", "dates": "10-15 апреля"},
+    ),
+    (
+        "Привет! Пишу от skillbox.ru, хотим интеграцию в YouTube ролик. Дедлайн 12.02.2026",
+        "Олег",
+        {"brand": "Skillbox", "contact": "Олег", "dates": "12.02.2026"},
+    ),
+    (
+        "Добрый вечер, на связи Екатерина из @goldapple_official. Предлагаем бартер: обзор косметики в рилс.",
+        "Екатерина",
+        {"brand": "Goldapple", "contact": "Екатерина", "dates": None},
+    ),
+    (
+        "Здравствуйте! Интересует реклама в вашем тг-канале, сервис «Самокат». Размещение в марте.",
+        "Самокат PR",
+        {"brand": "Самокат", "contact": "Самокат PR", "dates": "в марте"},
+    ),
+    (
+        "Hi! We'd love a collab, коллаборация с брендом «Nordic Fox», посты в Telegram с 1 по 7 июня.",
+        "Ben",
+        {"brand": "Nordic Fox", "contact": "Ben", "dates": "с 1 по 7 июня"},
+    ),
+    (
+        "Добрый день! Магазин «Пряжа и Ко» ищет блогеров для обзора, в конце мая.",
+        "Ирина",
+        {"brand": "Пряжа и Ко", "contact": "Ирина", "dates": "в конце мая"},
+    ),
+    (
+        "Здравствуйте, хотим разместить рекламу на следующей неделе, подскажите прайс?",
+        "Дмитрий",
+        {"brand": None, "contact": "Дмитрий", "dates": None},
+    ),
+    (
+        "Привет! Мы маленький проект, хотели бы посотрудничать. Когда вам удобно созвониться?",
+        "Саша",
+        {"brand": None, "contact": "Саша", "dates": None},
+    ),
+    (
+        "Добрый день! Ищем амбассадора на Q3, бренд «Северный Ветер», контент в TikTok.",
+        "Полина",
+        {"brand": "Северный Ветер", "contact": "Полина", "dates": "Q3"},
+    ),
+    (
+        "Здравствуйте! Предлагаем интеграцию в Shorts для litres.ru. Выход ролика 2026-04-01.",
+        "Литрес",
+        {"brand": "Литрес", "contact": "Литрес", "dates": "2026-04-01"},
+    ),
+    (
+        "Хотим рекламу в сторис к праздникам, бюджет обсудим. Сайт brightsocks.shop",
+        "Никита",
+        {"brand": "Brightsocks", "contact": "Никита", "dates": None},
+    ),
+    (
+        "Добрый день! Меня зовут Ольга Петрова, компания Lamoda. Интеграция в YouTube до 20.05",
+        "Ольга",
+        {"brand": "Lamoda", "contact": "Ольга Петрова", "dates": "до 20.05"},
+    ),
+    (
+        "Привет) видела твои видео, очень круто! давай что-нибудь придумаем вместе",
+        None,
+        {"brand": None, "contact": None, "dates": None},
+    ),
+    (
+        "Здравствуйте! Сервис Aviasales, реклама в Telegram-посте, публикация 3 марта, https://aviasales.ru",
+        "Aviasales Partners",
+        {"brand": "Aviasales", "contact": "Aviasales Partners", "dates": "3 марта"},
+    ),
+    (
+        "Добрый день! Пишите на ivan@agency-pro.ru, нужен обзор в Reels, публикация 12.03",
+        "Иван",
+        {"brand": None, "contact": "Иван", "dates": "12.03"},
+    ),
+    (
+        "Компания Nike ищет блогеров для интеграции в YouTube, выход ролика 20 апреля.",
+        "Nike Team",
+        {"brand": "Nike", "contact": "Nike Team", "dates": "20 апреля"},
+    ),
+    (
+        "Вышла версия 2.10 нашего приложения fitapp.io, хотим обзор в YouTube.",
+        "Павел",
+        {"brand": "Fitapp", "contact": "Павел", "dates": None},
+    ),
+    (
+        "Предлагаем рекламу в сторис за 12.50 тыс, сервис «Плюшка».",
+        "Вера",
+        {"brand": "Плюшка", "contact": "Вера", "dates": None},
+    ),
+]
+
+
+def run(verbose: bool) -> dict:
+    skipped = 0
+    confident_fields = correct_fields = 0
+    started = time.perf_counter()
+
+    for text, hint, expected in CORPUS:
+        fields = extract_fields(text, hint)
+        if is_confident(fields):
+            skipped += 1
+
+        for field, want in expected.items():
+            value, confidence = fields[field]
+            if confidence < CONFIDENCE_THRESHOLD:
+                continue
+            confident_fields += 1
+            if (value or None) == want:
+                correct_fields += 1
+            elif verbose:
+                print(f"  wrong {field}: got {value!r}, want {want!r} in {text[:50]!r}")
+
+        if verbose:
+            marks = " ".join(f"{f}={v!r}({c:.2f})" for f, (v, c) in fields.items())
+            print(f"{'SKIP' if is_confident(fields) else 'LLM '} {marks}")
+
+    elapsed = time.perf_counter() - started
+    return {
+        "samples": len(CORPUS),
+        "llm_calls_saved": skipped,
+        "confident_fields": confident_fields,
+        "confident_correct": correct_fields,
+        "us_per_sample": elapsed / len(CORPUS) * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--verbose", action="store_true", help="print extracted fields per sample")
+    args = parser.parse_args()
+
+    result = run(args.verbose)
+    print(
+        f"LLM calls saved: {result['llm_calls_saved']}/{result['samples']} "
+        f"({result['llm_calls_saved'] / result['samples']:.0%})"
+    )
+    print(f"Confident fields correct: {result['confident_correct']}/{result['confident_fields']}")
+    print(f"Extraction time: {result['us_per_sample']:.0f} µs per sample")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Event loop lag benchmark: blocking Supabase calls vs the database thread pool.
+
+Simulates N concurrent updates, each running a few queries with a fixed
+round-trip latency, and measures how late a 10 ms ticker wakes up while they run.
+
+    python -m benchmarks.loop_lag --latency 0.05 --queries 3
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "benchmark")
+
+from app.config import DB_MAX_WORKERS  # noqa: E402
+from app.services.supabase import execute  # noqa: E402
+
+TICK_SECONDS = 0.01
+MAX_LAG_SECONDS = 0.1  # Loop counts as responsive while p99 lag stays below this
+
+
+class FakeQuery:
+    """Query builder stand-in whose execute() blocks like a network round-trip."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def execute(self):
+        time.sleep(self.latency)
+        return None
+
+
+async def blocking_update(latency: float, queries: int):
+    """Old behaviour: execute() called directly inside the coroutine."""
+    for _ in range(queries):
+        FakeQuery(latency).execute()
+
+
+async def pooled_update(latency: float, queries: int):
+    """New behaviour: execute() runs in the database thread pool."""
+    for _ in range(queries):
+        await execute(FakeQuery(latency))
+
+
+async def ticker(lags: list[float], stop: asyncio.Event):
+    """Record how late the loop wakes a task that sleeps TICK_SECONDS."""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK_SECONDS)
+        lags.append(time.perf_counter() - started - TICK_SECONDS)
+
+
+async def run_level(update, concurrency: int, latency: float, queries: int) -> dict:
+    """Run one concurrency level and return throughput and lag figures."""
+    lags: list[float] = []
+    stop = asyncio.Event()
+    tick_task = asyncio.create_task(ticker(lags, stop))
+    await asyncio.sleep(TICK_SECONDS)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(update(latency, queries) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await tick_task
+
+    lags = sorted(lags) or [0.0]
+    return {
+        "updates_per_sec": concurrency / elapsed,
+        "p50_lag_ms": statistics.median(lags) * 1000,
+        "p99_lag_ms": lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1000,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds per query round-trip")
+    parser.add_argument("--queries", type=int, default=3, help="Queries per update")
+    parser.add_argument("--levels", default="1,2,4,8,16,32,64", help="Concurrency levels to try")
+    args = parser.parse_args()
+
+    levels = [int(x) for x in args.levels.split(",")]
+    print(f"latency={args.latency * 1000:.0f}ms queries/update={args.queries} DB_MAX_WORKERS={DB_MAX_WORKERS}\n")
+
+    for name, update in (("blocking", blocking_update), ("pooled", pooled_update)):
+        responsive = 0
+        print(f"{name}:")
+        for level in levels:
+            result = await run_level(update, level, args.latency, args.queries)
+            print(
+                f"  {level:>4} concurrent: {result['updates_per_sec']:8.1f} updates/s, "
+                f"lag p50 {result['p50_lag_ms']:7.1f}ms p99 {result['p99_lag_ms']:7.1f}ms"
+            )
+            if result["p99_lag_ms"] < MAX_LAG_SECONDS * 1000:
+                responsive = level
+        print(f"  max concurrency with p99 lag < {MAX_LAG_SECONDS * 1000:.0f}ms: {responsive}\n")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
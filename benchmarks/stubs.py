@@ -0,0 +1,475 @@
+"""Stand-ins for the bot's external services, served from one local aiohttp app.
+
+- Telegram Bot API (/bot<token>/<method>): answers sends and edits with
+  plausible Message objects and remembers the last message per chat.
+- PostgREST (/rest/v1/...): in-memory leads, lead_messages and
+  lead_status_events tables with the filters, ordering, counts and RPCs that
+  app/services/supabase_store.py uses, including the status_rank column and
+  message_count trigger.
+- OpenAI (/v1/chat/completions): returns lead fields as JSON, after any
+  queued error responses (for retry and circuit breaker tests).
+
+Each service waits its configured latency before answering and counts calls,
+so a run can report round-trips per update.
+"""
+import asyncio
+import json
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Optional
+from urllib.parse import unquote
+
+from aiohttp import web
+
+from app.config import STATUS_ORDER
+from app.services.local_store import normalize_timestamp, now_iso
+from app.services.search import DEFAULT_THRESHOLD, trigrams, word_similarity
+
+INT_COLUMNS = {"id", "user_id", "contact_telegram_id", "lead_id", "status_rank", "message_count"}
+TIME_COLUMNS = {"created_at", "updated_at", "forward_date"}
+# Tables and the column each one is indexed by
+OWNER_COLUMNS = {"leads": "user_id", "lead_messages": "lead_id", "lead_status_events": "user_id"}
+
+
+class TrigramIndex:
+    """Inverted trigram index over short documents (the stub search_leads RPC)."""
+
+    def __init__(self):
+        self._postings: dict[str, set] = {}
+        self._docs: dict = {}
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def add(self, doc_id, text: str):
+        """Index (or re-index) a document."""
+        self.remove(doc_id)
+        grams = trigrams(text)
+        self._docs[doc_id] = grams
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(doc_id)
+
+    def remove(self, doc_id):
+        """Drop a document from the index."""
+        grams = self._docs.pop(doc_id, None)
+        if not grams:
+            return
+        for gram in grams:
+            postings = self._postings.get(gram)
+            if postings is not None:
+                postings.discard(doc_id)
+                if not postings:
+                    del self._postings[gram]
+
+    def search(self, query: str, limit: int, threshold: float = DEFAULT_THRESHOLD) -> list[tuple]:
+        """Return up to limit (doc_id, score) pairs, best first."""
+        query_grams = trigrams(query)
+        if not query_grams:
+            return []
+
+        hits = Counter()
+        for gram in query_grams:
+            hits.update(self._postings.get(gram, ()))
+
+        min_hits = threshold * len(query_grams)
+        scored = [
+            (doc_id, count / len(query_grams))
+            for doc_id, count in hits.items()
+            if count >= min_hits
+        ]
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return scored[:limit]
+
+
+class Services:
+    """Latency per service and call counters shared by the three stubs."""
+
+    def __init__(self, telegram_latency: float, db_latency: float, llm_latency: float):
+        self.latency = {"telegram": telegram_latency, "db": db_latency, "llm": llm_latency}
+        self.calls: Counter = Counter()
+        self.methods: Counter = Counter()
+
+    async def hit(self, service: str, method: str):
+        self.calls[service] += 1
+        self.methods[f"{service}.{method}"] += 1
+        if self.latency[service]:
+            await asyncio.sleep(self.latency[service])
+
+    def snapshot(self) -> Counter:
+        return Counter(self.calls)
+
+
+class StubTelegram:
+    """Bot API methods the bot calls; everything else answers True."""
+
+    def __init__(self, services: Services):
+        self.services = services
+        self.next_message_id = 1
+        self.last: dict[int, dict] = {}  # chat id -> last sent or edited message
+        self.sent_at: dict[int, float] = {}  # chat id -> time of the latest sendMessage
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        if request.content_type == "application/json":
+            data = await request.json()
+        else:
+            data = dict(await request.post())
+        await self.services.hit("telegram", method)
+
+        if method == "getme":
+            result = {"id": 1, "is_bot": True, "first_name": "Stub", "username": "stub_bot"}
+        elif method in ("sendmessage", "editmessagetext"):
+            result = self._message(method, data)
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    def _message(self, method: str, data: dict) -> dict:
+        chat_id = int(data["chat_id"])
+        if method == "sendmessage":
+            message_id = self.next_message_id
+            self.next_message_id += 1
+        else:
+            message_id = int(data["message_id"])
+        markup = data.get("reply_markup")
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": data.get("text", ""),
+        }
+        if markup:
+            message["reply_markup"] = json.loads(markup) if isinstance(markup, str) else markup
+        self.last[chat_id] = message
+        if method == "sendmessage":
+            self.sent_at[chat_id] = time.perf_counter()
+        return message
+
+
+class StubPostgREST:
+    """Tables as lists of dicts; enough of PostgREST for the bot's queries."""
+
+    def __init__(self, services: Services):
+        self.services = services
+        self.tables: dict[str, dict[int, dict]] = {table: {} for table in OWNER_COLUMNS}
+        self.next_id = {table: 1 for table in OWNER_COLUMNS}
+        # Row ids by owner column (OWNER_COLUMNS): the stub's only indexes
+        self.by_owner: dict[str, dict[int, list[int]]] = {table: {} for table in OWNER_COLUMNS}
+
+    # === Data ===
+
+    def insert(self, table: str, row: dict) -> dict:
+        row = dict(row)
+        if row.get("id") is None:
+            row["id"] = self.next_id[table]
+        self.next_id[table] = max(self.next_id[table], row["id"] + 1)
+        now = now_iso()
+        row["created_at"] = normalize_timestamp(row.get("created_at")) or now
+        self.by_owner[table].setdefault(row[OWNER_COLUMNS[table]], []).append(row["id"])
+        if table == "leads":
+            row["updated_at"] = normalize_timestamp(row.get("updated_at")) or now
+            for column in ("contact_telegram_id", "contact_name", "contact_username", "brand", "request", "dates"):
+                row.setdefault(column, None)
+            row.setdefault("status", "new")
+            row["is_hot"] = bool(row.get("is_hot"))
+            row["message_count"] = row.get("message_count") or 0
+            row["status_rank"] = _status_rank(row["status"])
+        elif table == "lead_messages":
+            row["forward_date"] = normalize_timestamp(row.get("forward_date"))
+            lead = self.tables["leads"].get(row["lead_id"])
+            if lead is not None:
+                lead["message_count"] += 1
+        self.tables[table][row["id"]] = row
+        return row
+
+    def update(self, row: dict, values: dict):
+        for column, value in values.items():
+            row[column] = normalize_timestamp(value) if column in TIME_COLUMNS else value
+        if "status" in values:
+            row["status_rank"] = _status_rank(row["status"])
+
+    # === HTTP ===
+
+    async def handle(self, request: web.Request) -> web.Response:
+        table = request.match_info["table"]
+        await self.services.hit("db", f"{request.method.lower()} {table}")
+        if table not in self.tables:
+            return _error(404, "42P01", f'relation "{table}" does not exist')
+
+        params = _params(request.query_string)
+        if request.method == "POST":
+            body = await request.json()
+            rows = [self.insert(table, row) for row in (body if isinstance(body, list) else [body])]
+            if "return=minimal" in request.headers.get("Prefer", ""):
+                return web.Response(status=201)
+            return web.json_response(_project(rows, "*"), status=201)
+
+        rows = [row for row in self._candidates(table, params["filters"]) if _matches(row, params["filters"])]
+
+        if request.method == "PATCH":
+            values = await request.json()
+            for row in rows:
+                self.update(row, values)
+            return web.json_response(_project(rows, "*"))
+
+        total = len(rows)
+        for column, desc in reversed(params["order"]):
+            rows.sort(key=lambda row: _sort_key(row.get(column)), reverse=desc)
+        offset = params["offset"]
+        rows = rows[offset:offset + params["limit"]] if params["limit"] is not None else rows[offset:]
+
+        headers = {}
+        if "count=exact" in request.headers.get("Prefer", ""):
+            end = f"{offset}-{offset + len(rows) - 1}" if rows else "*"
+            headers["Content-Range"] = f"{end}/{total}"
+        if request.method == "HEAD":
+            return web.Response(status=200, headers=headers)
+        return web.json_response(_project(rows, params["select"]), headers=headers)
+
+    def _candidates(self, table: str, filters: list) -> list[dict]:
+        """Rows an eq filter on id or the owner column narrows the scan to."""
+        rows = self.tables[table]
+        owner = OWNER_COLUMNS[table]
+        for column, op, value in (f for f in filters if len(f) == 3):
+            if op != "eq":
+                continue
+            if column == "id":
+                return [rows[value]] if value in rows else []
+            if column == owner:
+                return [rows[i] for i in self.by_owner[table].get(value, ())]
+        return list(rows.values())
+
+    async def rpc(self, request: web.Request) -> web.Response:
+        name = request.match_info["name"]
+        await self.services.hit("db", f"rpc {name}")
+        args = await request.json()
+        if name == "lead_stats":
+            return web.json_response(self._stats(args["p_user_id"]))
+        if name == "toggle_lead_hot":
+            lead = self.tables["leads"].get(args["p_lead_id"])
+            if lead is None or lead["user_id"] != args["p_user_id"]:
+                return web.json_response([])
+            self.update(lead, {"is_hot": not lead["is_hot"], "updated_at": now_iso()})
+            return web.json_response([lead])
+        if name == "lead_status_history":
+            return web.json_response(self._history(args["p_user_id"]))
+        if name == "search_leads":
+            return web.json_response(self._search(args["p_user_id"], args["p_query"], args["p_limit"]))
+        return _error(404, "PGRST202", f"Could not find the function public.{name}")
+
+    def _stats(self, user_id: int) -> dict:
+        by_status = Counter()
+        messages = 0
+        for lead_id in self.by_owner["leads"].get(user_id, ()):
+            lead = self.tables["leads"][lead_id]
+            by_status[lead["status"]] += 1
+            messages += lead["message_count"]
+        return {"total_leads": sum(by_status.values()), "total_messages": messages, "by_status": dict(by_status)}
+
+    def _history(self, user_id: int) -> dict:
+        events = self.tables["lead_status_events"]
+        rows = [
+            events[i] for i in self.by_owner["lead_status_events"].get(user_id, ())
+            if events[i]["kind"] in ("created", "status")
+        ]
+        return {
+            "lead_id": [row["lead_id"] for row in rows],
+            "status": [row["value"] for row in rows],
+            "at": [datetime.fromisoformat(row["created_at"]).timestamp() for row in rows]
+        }
+
+    def _search(self, user_id: int, query: str, limit: int) -> list[dict]:
+        """Trigram ranking over lead fields (a rough stand-in for the pg_trgm RPC)."""
+        index = TrigramIndex()
+        leads = {i: self.tables["leads"][i] for i in self.by_owner["leads"].get(user_id, ())}
+        for lead in leads.values():
+            index.add(lead["id"], " ".join(
+                lead.get(f) or "" for f in ("brand", "contact_name", "contact_username", "request")
+            ))
+        hits = []
+        for lead_id, _ in index.search(query, limit):
+            lead = leads[lead_id]
+            rank = word_similarity(query, lead.get("brand") or "")
+            hits.append({
+                **{c: lead[c] for c in ("id", "brand", "contact_name", "contact_username", "status", "is_hot")},
+                "rank": rank,
+                "snippet": None
+            })
+        return hits
+
+
+class StubOpenAI:
+    """Chat completions answering with fixed lead fields."""
+
+    def __init__(self, services: Services):
+        self.services = services
+        self.failures: list[tuple[int, dict]] = []  # (status, headers) to answer with first, oldest first
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            await self.services.hit("llm", "chat.completions")
+        finally:
+            self.in_flight -= 1
+        if self.failures:
+            status, headers = self.failures.pop(0)
+            error = {"error": {"message": f"Stub error {status}", "type": "stub_error", "code": None}}
+            return web.json_response(error, status=status, headers=headers)
+
+        text = body["messages"][-1]["content"]
+        content = json.dumps({
+            "brand": "Stub Brand",
+            "request": text[:60],
+            "contact": None,
+            "dates": "до 1 мая"
+        }, ensure_ascii=False)
+        return web.json_response({
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": len(text) // 3, "completion_tokens": 40, "total_tokens": len(text) // 3 + 40}
+        })
+
+
+async def start_stubs(port: int, services: Services) -> tuple[web.AppRunner, StubTelegram, StubPostgREST, StubOpenAI]:
+    telegram, postgrest, openai = StubTelegram(services), StubPostgREST(services), StubOpenAI(services)
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.router.add_post("/bot{token}/{method}", telegram.handle)
+    app.router.add_post("/rest/v1/rpc/{name}", postgrest.rpc)
+    app.router.add_route("*", "/rest/v1/{table}", postgrest.handle)
+    app.router.add_post("/v1/chat/completions", openai.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner, telegram, postgrest, openai
+
+
+# === PostgREST query parsing ===
+
+def _params(query_string: str) -> dict:
+    params = {"select": "*", "order": [], "limit": None, "offset": 0, "filters": []}
+    for pair in query_string.split("&"):
+        if not pair:
+            continue
+        key, _, value = pair.partition("=")
+        key, value = unquote(key), unquote(value.replace("+", " "))
+        if key == "select":
+            params["select"] = value
+        elif key == "order":
+            for part in value.split(","):
+                column, _, direction = part.partition(".")
+                params["order"].append((column, direction.startswith("desc")))
+        elif key == "limit":
+            params["limit"] = int(value)
+        elif key == "offset":
+            params["offset"] = int(value)
+        elif key == "columns":
+            continue
+        elif key == "or":
+            params["filters"].append(("or", _split(value[1:-1])))
+        else:
+            params["filters"].append(_condition(key, value))
+    return params
+
+
+def _split(expression: str) -> list:
+    """Conditions of an or=(...)/and(...) group; nested groups become ("and"|"or", [...])."""
+    parts, depth, quoted, current = [], 0, False, ""
+    for char in expression:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == "(":
+            depth += 1
+        elif not quoted and char == ")":
+            depth -= 1
+        if char == "," and not depth and not quoted:
+            parts.append(current)
+            current = ""
+        else:
+            current += char
+    parts.append(current)
+
+    conditions = []
+    for part in parts:
+        if part.startswith(("and(", "or(")):
+            group, _, inner = part.partition("(")
+            conditions.append((group, _split(inner[:-1])))
+        else:
+            column, _, rest = part.partition(".")
+            conditions.append(_condition(column, rest))
+    return conditions
+
+
+def _condition(column: str, expression: str) -> tuple:
+    op, _, value = expression.partition(".")
+    if op == "in":
+        values = [v.strip('"') for v in value[1:-1].split(",") if v]
+        return (column, op, [_coerce(column, v) for v in values])
+    return (column, op, _coerce(column, value.strip('"')))
+
+
+def _coerce(column: str, value: str):
+    if value == "null":
+        return None
+    if column in INT_COLUMNS:
+        return int(value)
+    if column in TIME_COLUMNS:
+        return normalize_timestamp(value)
+    if value in ("true", "false") and column == "is_hot":
+        return value == "true"
+    return value
+
+
+def _matches(row: dict, conditions: list, any_of: bool = False) -> bool:
+    results = (_check(row, condition) for condition in conditions)
+    return any(results) if any_of else all(results)
+
+
+def _check(row: dict, condition: tuple) -> bool:
+    if condition[0] in ("and", "or"):
+        return _matches(row, condition[1], any_of=condition[0] == "or")
+    column, op, value = condition
+    actual = row.get(column)
+    if op == "is":
+        return actual is value or actual == value
+    if op == "in":
+        return actual in value
+    if op == "ilike":
+        return actual is not None and value.strip("%*").lower() in actual.lower()
+    if actual is None:
+        return False
+    return {
+        "eq": actual == value, "neq": actual != value,
+        "gt": actual > value, "gte": actual >= value,
+        "lt": actual < value, "lte": actual <= value,
+    }[op]
+
+
+def _sort_key(value) -> tuple:
+    return (value is None, value if value is not None else 0)
+
+
+def _project(rows: list[dict], select: str) -> list[dict]:
+    if select.strip() == "*":
+        return [dict(row) for row in rows]
+    columns = [c.strip() for c in select.split(",")]
+    return [{c: row.get(c) for c in columns} for row in rows]
+
+
+def _status_rank(status: Optional[str]) -> int:
+    return STATUS_ORDER.index(status) if status in STATUS_ORDER else len(STATUS_ORDER)
+
+
+def _error(status: int, code: str, message: str) -> web.Response:
+    return web.json_response({"code": code, "message": message, "details": None, "hint": None}, status=status)
@@ -0,0 +1,206 @@
+"""Update delivery benchmark: webhook vs polling against a stub Bot API.
+
+Starts a stub Telegram Bot API, launches the bot (run.py) against it with
+TELEGRAM_API_URL, and feeds it synthetic /start updates, which the bot answers
+with one sendMessage and no database or AI calls. Latency is measured from
+delivering an update (webhook POST / getUpdates response) to the stub receiving
+the reply for that chat.
+
+    python -m benchmarks.webhook_load --mode webhook --updates 2000 --concurrency 50
+    python -m benchmarks.webhook_load --mode polling --updates 2000
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+from aiohttp import ClientSession, web
+
+TOKEN = "123456:benchmark"
+SECRET = "benchmark-secret"
+STUB_PORT = 8899
+WEBHOOK_PORT = 8898
+USER_ID = 1000
+
+
+def make_update(update_id: int) -> dict:
+    """A private-chat /start message; each update gets its own chat to match replies."""
+    chat_id = USER_ID + update_id
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Load"},
+            "text": "/start",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+        },
+    }
+
+
+class StubBotAPI:
+    """Answers Bot API calls, serves getUpdates from a queue and records reply times."""
+
+    def __init__(self):
+        self.updates: asyncio.Queue = asyncio.Queue()
+        self.sent_at: dict[int, float] = {}
+        self.replied_at: dict[int, float] = {}
+        self.done = asyncio.Event()
+        self.expected = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        data = dict(await request.post()) if request.content_type != "application/json" else await request.json()
+
+        if method == "getme":
+            result = {"id": 1, "is_bot": True, "first_name": "Stub", "username": "stub_bot"}
+        elif method == "getupdates":
+            result = await self._get_updates(float(data.get("timeout", 0) or 0))
+        elif method == "sendmessage":
+            chat_id = int(data["chat_id"])
+            self.replied_at.setdefault(chat_id, time.perf_counter())
+            if len(self.replied_at) >= self.expected:
+                self.done.set()
+            result = {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": data.get("text", ""),
+            }
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def _get_updates(self, timeout: float) -> list:
+        batch = []
+        try:
+            batch.append(await asyncio.wait_for(self.updates.get(), timeout=max(timeout, 0.1)))
+        except asyncio.TimeoutError:
+            return []
+        while not self.updates.empty() and len(batch) < 100:
+            batch.append(self.updates.get_nowait())
+        now = time.perf_counter()
+        for update in batch:
+            self.sent_at[update["message"]["chat"]["id"]] = now
+        return batch
+
+
+async def start_stub(stub: StubBotAPI) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", stub.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", STUB_PORT).start()
+    return runner
+
+
+async def spawn_bot(mode: str) -> asyncio.subprocess.Process:
+    env = {
+        **os.environ,
+        "BOT_TOKEN": TOKEN,
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{STUB_PORT}",
+        "RUN_MODE": mode,
+        "WEBHOOK_HOST": "127.0.0.1",
+        "WEBHOOK_PORT": str(WEBHOOK_PORT),
+        "WEBHOOK_SECRET": SECRET,
+        "STATE_BACKEND": "memory",
+        "PARSE_CACHE_DB_PATH": "",
+        # The stub has no flood limits; measure the bot, not the send queue
+        "SEND_GLOBAL_PER_SECOND": "100000",
+    }
+    env.setdefault("SUPABASE_URL", "http://127.0.0.1:1")
+    env.setdefault("SUPABASE_KEY", "benchmark")
+    env.setdefault("OPENAI_API_KEY", "benchmark")
+    return await asyncio.create_subprocess_exec(
+        sys.executable, "run.py", env=env,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+    )
+
+
+async def wait_ready(session: ClientSession, mode: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if mode == "webhook":
+                async with session.get(f"http://127.0.0.1:{WEBHOOK_PORT}/healthz") as response:
+                    if response.status == 200:
+                        return
+            else:
+                return
+        except OSError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("bot did not start")
+
+
+async def feed_webhook(session: ClientSession, stub: StubBotAPI, updates: list[dict], concurrency: int):
+    url = f"http://127.0.0.1:{WEBHOOK_PORT}/webhook"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+    queue = iter(updates)
+
+    async def worker():
+        for update in queue:
+            stub.sent_at[update["message"]["chat"]["id"]] = time.perf_counter()
+            async with session.post(url, json=update, headers=headers) as response:
+                await response.read()
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def run(mode: str, count: int, concurrency: int) -> dict:
+    stub = StubBotAPI()
+    stub.expected = count
+    stub_runner = await start_stub(stub)
+    process = await spawn_bot(mode)
+
+    try:
+        async with ClientSession() as session:
+            await wait_ready(session, mode)
+            updates = [make_update(i) for i in range(1, count + 1)]
+
+            started = time.perf_counter()
+            if mode == "webhook":
+                await feed_webhook(session, stub, updates, concurrency)
+            else:
+                for update in updates:
+                    stub.updates.put_nowait(update)
+            await asyncio.wait_for(stub.done.wait(), timeout=120)
+            elapsed = time.perf_counter() - started
+    finally:
+        process.terminate()
+        await process.wait()
+        await stub_runner.cleanup()
+
+    latencies = sorted(
+        (stub.replied_at[chat] - stub.sent_at[chat]) * 1000
+        for chat in stub.replied_at if chat in stub.sent_at
+    )
+    return {
+        "updates_per_second": count / elapsed,
+        "p50_ms": statistics.median(latencies),
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=("webhook", "polling", "both"), default="both")
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50, help="parallel webhook POSTs")
+    args = parser.parse_args()
+
+    modes = ("polling", "webhook") if args.mode == "both" else (args.mode,)
+    print(f"{'mode':>8} {'updates/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for mode in modes:
+        result = asyncio.run(run(mode, args.updates, args.concurrency))
+        print(
+            f"{mode:>8} {result['updates_per_second']:>10.0f} "
+            f"{result['p50_ms']:>8.1f} {result['p99_ms']:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
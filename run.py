@@ -3,7 +3,12 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-from app.bot import start_bot
+from app.config import WORKERS
 
 if __name__ == "__main__":
-    asyncio.run(start_bot())
+    if WORKERS > 1:
+        from app.cluster import run_cluster
+        run_cluster(WORKERS)
+    else:
+        from app.bot import start_bot
+        asyncio.run(start_bot())
@@ -0,0 +1,204 @@
+"""LLMRunner against the stub OpenAI server: retries, Retry-After, limits and the circuit breaker."""
+import asyncio
+import socket
+import time
+
+import openai
+import pytest
+from openai import AsyncOpenAI
+
+from app.services import llm_runner
+from app.services.llm_runner import CircuitBreaker, CircuitOpenError, LLMRunner, LLMUnavailableError
+from benchmarks.stubs import Services, start_stubs
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(llm_runner, "BACKOFF_BASE_SECONDS", 0.001)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def make_runner(**overrides) -> LLMRunner:
+    options = dict(max_concurrency=8, per_user_concurrency=2, rpm=60000, tpm=10_000_000, max_retries=3)
+    options.update(overrides)
+    breaker = options.pop("breaker", None) or CircuitBreaker(failure_threshold=2, reset_timeout=0.2)
+    return LLMRunner(breaker=breaker, **options)
+
+
+def with_stub(scenario, llm_latency: float = 0.0):
+    """Run scenario(client, stub, services) with the stub OpenAI server up."""
+    async def main():
+        port = _free_port()
+        services = Services(telegram_latency=0, db_latency=0, llm_latency=llm_latency)
+        runner, _, _, stub = await start_stubs(port, services)
+        client = AsyncOpenAI(api_key="stub", base_url=f"http://127.0.0.1:{port}/v1", max_retries=0, timeout=5)
+        try:
+            return await scenario(client, stub, services)
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    return asyncio.run(main())
+
+
+def completion(client: AsyncOpenAI):
+    return lambda: client.chat.completions.create(model="stub", messages=[{"role": "user", "content": "Привет"}])
+
+
+def test_retries_server_errors_until_success():
+    async def scenario(client, stub, services):
+        runner = make_runner()
+        stub.failures = [(500, {}), (503, {})]
+        response = await runner.run(completion(client), user_id=1)
+
+        assert response.choices[0].message.content
+        assert services.calls["llm"] == 3
+        assert runner.breaker.state == "closed" and runner.breaker.failures == 0
+
+    with_stub(scenario)
+
+
+def test_waits_for_retry_after():
+    async def scenario(client, stub, services):
+        runner = make_runner()
+        stub.failures = [(429, {"Retry-After": "0.3"})]
+        started = time.monotonic()
+        await runner.run(completion(client), user_id=1)
+
+        assert time.monotonic() - started >= 0.3
+        assert services.calls["llm"] == 2
+
+    with_stub(scenario)
+
+
+def test_exhausted_retries_raise_unavailable():
+    async def scenario(client, stub, services):
+        runner = make_runner(max_retries=2)
+        stub.failures = [(500, {})] * 3
+        with pytest.raises(LLMUnavailableError):
+            await runner.run(completion(client), user_id=1)
+
+        assert services.calls["llm"] == 3
+        assert runner.breaker.failures == 1
+
+    with_stub(scenario)
+
+
+def test_non_retryable_errors_do_not_trip_the_breaker():
+    async def scenario(client, stub, services):
+        runner = make_runner()
+        stub.failures = [(400, {}), (401, {}), (400, {})]
+        for error in (openai.BadRequestError, openai.AuthenticationError, openai.BadRequestError):
+            with pytest.raises(error):
+                await runner.run(completion(client), user_id=1)
+
+        assert services.calls["llm"] == 3
+        assert runner.breaker.state == "closed" and runner.breaker.failures == 0
+
+    with_stub(scenario)
+
+
+def test_per_user_concurrency_limit():
+    async def scenario(client, stub, services):
+        runner = make_runner(per_user_concurrency=1)
+        await asyncio.gather(*(runner.run(completion(client), user_id=1) for _ in range(4)))
+        assert stub.peak_in_flight == 1
+
+        stub.peak_in_flight = 0
+        await asyncio.gather(*(runner.run(completion(client), user_id=user_id) for user_id in range(4)))
+        assert stub.peak_in_flight == 4
+        assert runner._per_user == {}
+
+    with_stub(scenario, llm_latency=0.05)
+
+
+def test_global_concurrency_limit():
+    async def scenario(client, stub, services):
+        runner = make_runner(max_concurrency=2)
+        await asyncio.gather(*(runner.run(completion(client), user_id=user_id) for user_id in range(6)))
+        assert stub.peak_in_flight == 2
+
+    with_stub(scenario, llm_latency=0.05)
+
+
+def test_breaker_opens_half_opens_and_closes():
+    async def scenario(client, stub, services):
+        runner = make_runner(max_retries=0)
+        breaker = runner.breaker
+
+        stub.failures = [(500, {})] * 2
+        for _ in range(2):
+            with pytest.raises(LLMUnavailableError):
+                await runner.run(completion(client), user_id=1)
+        assert breaker.state == "open"
+
+        # Open: rejected without a request
+        with pytest.raises(CircuitOpenError):
+            await runner.run(completion(client), user_id=1)
+        assert services.calls["llm"] == 2
+
+        # A failed probe opens it again
+        await asyncio.sleep(0.25)
+        assert breaker.state == "half_open"
+        stub.failures = [(502, {})]
+        with pytest.raises(LLMUnavailableError):
+            await runner.run(completion(client), user_id=1)
+        assert breaker.state == "open"
+
+        # A successful probe closes it
+        await asyncio.sleep(0.25)
+        await runner.run(completion(client), user_id=1)
+        assert breaker.state == "closed" and breaker.failures == 0
+
+    with_stub(scenario)
+
+
+def test_half_open_lets_one_probe_through():
+    async def scenario(client, stub, services):
+        runner = make_runner(breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0.05))
+        runner.breaker.record_failure()
+        await asyncio.sleep(0.06)
+
+        results = await asyncio.gather(
+            runner.run(completion(client), user_id=1),
+            runner.run(completion(client), user_id=2),
+            return_exceptions=True
+        )
+        assert sum(isinstance(result, CircuitOpenError) for result in results) == 1
+        assert services.calls["llm"] == 1
+        assert runner.breaker.state == "closed"
+
+    with_stub(scenario, llm_latency=0.05)
+
+
+def test_cancelled_probe_releases_the_breaker():
+    async def scenario(client, stub, services):
+        runner = make_runner(breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0.05))
+        runner.breaker.record_failure()
+        await asyncio.sleep(0.06)
+
+        probe = asyncio.create_task(runner.run(completion(client), user_id=1))
+        await asyncio.sleep(0.02)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+        await runner.run(completion(client), user_id=1)
+        assert runner.breaker.state == "closed"
+
+    with_stub(scenario, llm_latency=0.2)
+
+
+def test_large_requests_are_charged_their_full_token_estimate():
+    async def scenario():
+        runner = make_runner(tpm=60_000)
+        await runner.run(lambda: asyncio.sleep(0, "ok"), tokens=5000)
+        return runner._tokens._tokens
+
+    # 5000 tokens is five seconds of a 60k TPM budget
+    assert asyncio.run(scenario()) == pytest.approx(55_000, abs=50)